@@ -2,14 +2,36 @@
 Small script to generate the required metadata.json for GRoot
 to generate the query equivalence classes.
 https://github.com/dns-groot/groot#packaging-zone-files-data
+
+usage: metadata_gen.py ZONE_FILE
+       metadata_gen.py -batch DIRECTORY
+
+With -batch, each zone file of the directory is moved into a sub-directory named after
+the zone file (without the extension) along with its own metadata.json, so that GRoot can
+be run on each zone separately.
 """
 
 import json
+import os
 import sys
 
-metadata = {}
-metadata["TopNameServers"] = ["ns1.campus.edu."]
-metadata["ZoneFiles"] = [
-    {"FileName": sys.argv[1], "NameServer": "ns1.campus.edu."}]
-with open('/home/groot/groot/build/bin/zonefile/metadata.json', 'w') as f:
-    json.dump(metadata, f)
+
+def metadata(file_name):
+    """Returns the GRoot metadata for a single zone file."""
+    return {"TopNameServers": ["ns1.campus.edu."],
+            "ZoneFiles": [{"FileName": file_name, "NameServer": "ns1.campus.edu."}]}
+
+
+if sys.argv[1] == '-batch':
+    batch_dir = sys.argv[2]
+    for zone_file in os.listdir(batch_dir):
+        if not zone_file.endswith('.txt'):
+            continue
+        zone_dir = os.path.join(batch_dir, zone_file[:-len('.txt')])
+        os.makedirs(zone_dir, exist_ok=True)
+        os.rename(os.path.join(batch_dir, zone_file), os.path.join(zone_dir, zone_file))
+        with open(os.path.join(zone_dir, 'metadata.json'), 'w') as f:
+            json.dump(metadata(zone_file), f)
+else:
+    with open('/home/groot/groot/build/bin/zonefile/metadata.json', 'w') as f:
+        json.dump(metadata(sys.argv[1]), f)
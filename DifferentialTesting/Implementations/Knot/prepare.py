@@ -8,9 +8,11 @@ port 53, which is mapped to a host port.
 
 import pathlib
 import subprocess
+from typing import Optional
 
 
-def run(zone_file: pathlib.Path, zone_domain: str, cname: str, port: int, restart: bool, tag: str) -> None:
+def run(zone_file: pathlib.Path, zone_domain: str, cname: str, port: int, restart: bool, tag: str,
+        batch_dir: Optional[str] = None) -> None:
     """
     :param zone_file: Path to the Bind-style zone file
     :param zone_domain: The domain name of the zone
@@ -19,6 +21,8 @@ def run(zone_file: pathlib.Path, zone_domain: str, cname: str, port: int, restar
     :param restart: Whether to load the input zone file in a new container
                         or reuse the existing container
     :param tag: The image tag to be used if restarting the container
+    :param batch_dir: The directory in the container the zone file was already copied to
+                      (by the preprocessor checks), if any
     """
     if restart:
         subprocess.run(['docker', 'container', 'rm', cname, '-f'],
@@ -30,9 +34,15 @@ def run(zone_file: pathlib.Path, zone_domain: str, cname: str, port: int, restar
         subprocess.run(['docker', 'exec', cname, 'knotc', '-c',
                         '/usr/local/etc/knot/knot.conf', 'stop'],
                        stdout=subprocess.PIPE, check=False)
-    # Copy the new zone file into the container
-    subprocess.run(['docker', 'cp', str(zone_file), cname +
-                    ':/usr/local/var/lib/knot/'], stdout=subprocess.PIPE, check=False)
+    # Copy the new zone file into the container, from the batch directory in the
+    # container if it is still there
+    copied = batch_dir is not None and subprocess.run(
+        ['docker', 'exec', cname, 'cp', batch_dir + '/' + zone_file.name,
+         '/usr/local/var/lib/knot/'], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        check=False).returncode == 0
+    if not copied:
+        subprocess.run(['docker', 'cp', str(zone_file), cname +
+                        ':/usr/local/var/lib/knot/'], stdout=subprocess.PIPE, check=False)
     # Create the Knot-specific configuration file
     knot_conf = 'server:\n    listen: 0.0.0.0@53\n    listen: ::@53\n    rundir: "/usr/local/var/run/knot"\n\n'
     knot_conf += f'zone:\n  - domain: {zone_domain}\n    storage: /usr/local/var/lib/knot/\n    file: {zone_file.name}\n\n'
@@ -1,18 +1,94 @@
 """
-Script copies the input zone file and a script "mararc.sh" which,
-when run in the container, generates the necessary configuration file "mararc"
-into an existing or a new MaraDNS container and starts the DNS server
-on container port 53, which is mapped to a host port.
+Script converts the input zone file into the MaraDNS CSV2 format and generates the
+necessary configuration file "mararc" on the host, copies them along with the zone file
+into an existing or a new MaraDNS container in a single transfer and starts the
+DNS server on container port 53, which is mapped to a host port.
 """
 
 #!/usr/bin/env python3
 
+import hashlib
+import io
+import os
 import pathlib
 import subprocess
+import tarfile
+import tempfile
+from typing import List, Tuple
+
+from .tocsv2 import to_csv2
 
 # Maradns seems to work easily on Centos compared to Ubuntu as mentioned on the website.
 # Start MaraDNS from the terminal inside the container using `maradns` to see the logs on stdout.
 
+# The CSV2 conversions are cached by the zone file hash across runs and processes
+CSV2_CACHE = pathlib.Path(tempfile.gettempdir()) / 'ferret_maradns_csv2'
+# The hash of the converter source is part of the cache key so that a change to
+# tocsv2.py does not reuse the conversions of the previous version
+TOCSV2_HASH = hashlib.sha256(pathlib.Path(__file__).with_name('tocsv2.py').read_bytes())
+
+
+def get_csv2(zone: bytes) -> bytes:
+    """
+    Returns the CSV2 conversion of the zone file contents, from the cache if available.
+
+    :param zone: The zone file contents
+    """
+    key = TOCSV2_HASH.copy()
+    key.update(zone)
+    cache_file = CSV2_CACHE / (key.hexdigest() + '.csv2')
+    if cache_file.exists():
+        return cache_file.read_bytes()
+    csv2 = ''.join(to_csv2(zone.decode('utf-8').splitlines())).encode('utf-8')
+    CSV2_CACHE.mkdir(parents=True, exist_ok=True)
+    # Write to a temporary file first as other processes might read the cache concurrently
+    tmp_file = cache_file.with_name(f'{cache_file.name}.{os.getpid()}')
+    tmp_file.write_bytes(csv2)
+    os.replace(tmp_file, cache_file)
+    return csv2
+
+
+def get_container_ip(cname: str) -> str:
+    """
+    Returns the container interface IP to which the DNS server has to bind.
+
+    :param cname: Container name
+    """
+    inspect = subprocess.run(['docker', 'inspect', '--format',
+                              '{{range .NetworkSettings.Networks}}{{.IPAddress}} {{end}}', cname],
+                             stdout=subprocess.PIPE, check=False)
+    addresses = inspect.stdout.decode('utf-8').split()
+    return addresses[0] if addresses else '0.0.0.0'
+
+
+def get_mararc(ipaddr: str, zone_domain: str, csv2_name: str) -> str:
+    """
+    Returns the MaraDNS-specific configuration file "mararc".
+
+    :param ipaddr: The container interface IP to which the DNS server has to bind
+    :param zone_domain: The domain name of the zone
+    :param csv2_name: The name of the zone file in CSV2 format in the chroot directory
+    """
+    mararc = [f'ipv4_bind_addresses = "{ipaddr}"', 'chroot_dir = "/etc/maradns"', 'csv2 = {}',
+              f'csv2["{zone_domain}"] = "{csv2_name}"']
+    return '\n'.join(mararc) + '\n'
+
+
+def make_archive(files: List[Tuple[str, bytes]]) -> bytes:
+    """
+    Returns a tar archive with the input files to copy into the container with `docker cp`.
+
+    :param files: List of tuples of the path in the archive and the file contents
+    """
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode='w') as tar:
+        for name, data in files:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mode = 0o644
+            tar.addfile(info, io.BytesIO(data))
+    return archive.getvalue()
+
 
 def run(zone_file: pathlib.Path, zone_domain: str, cname: str, port: int, restart: bool, tag: str) -> None:
     """
@@ -33,30 +109,16 @@ def run(zone_file: pathlib.Path, zone_domain: str, cname: str, port: int, restar
         # Stop the running server instance inside the container
         subprocess.run(['docker', 'exec', cname,
                         '/etc/init.d/maradns', 'stop'], stdout=subprocess.PIPE, check=False)
-    # Copy the new zone file into the container
-    subprocess.run(['docker', 'cp', str(zone_file),
-                    cname + ':/etc/maradns'], stdout=subprocess.PIPE, check=False)
-    # Shell script to run inside the container to generate the "mararc" configuration file
-    # It has to be run in the container to get the container interface IP to which the
-    # DNS server has to bind.
-    mararc = 'ipaddr=\\"$(hostname -i)\\"\necho "ipv4_bind_addresses = $ipaddr"\n'
-    mararc += 'echo \'chroot_dir = "/etc/maradns"\'\necho \'csv2 = {}\'\n'
-    mararc += f'echo \'csv2["{zone_domain}"] = "{zone_file.name + ".csv2"}"\''
-
-    with open(cname + '_mararc.sh', 'w') as file_pointer:
-        file_pointer.write(mararc)
-    subprocess.run(['docker', 'cp', cname + '_mararc.sh',
-                    cname + ':/etc/mararc.sh'], check=False)
-    pathlib.Path(cname + '_mararc.sh').unlink()
-    # Give executable permissions to the copied script
-    subprocess.run(['docker', 'exec', cname,
-                    'chmod', '+x', '/etc/mararc.sh'], stdout=subprocess.PIPE, check=False)
-    # Covnert the zone file into CSV2 format using the python script
-    subprocess.run(['docker', 'exec', cname, 'python3', 'tocsv2.py',
-                    f'/etc/maradns/{zone_file.name}'], stdout=subprocess.PIPE, check=False)
-    # Generate the configuration file using the shell script
-    subprocess.run(['docker', 'exec', cname, 'sh',
-                    '-c', './etc/mararc.sh > /etc/mararc'], stdout=subprocess.PIPE, check=False)
+    zone = zone_file.read_bytes()
+    csv2_name = zone_file.name + '.csv2'
+    # The "mararc" is generated on the host with the container interface IP
+    mararc = get_mararc(get_container_ip(cname), zone_domain, csv2_name)
+    # Copy the zone file, its CSV2 conversion and the configuration file in one transfer
+    archive = make_archive([('maradns/' + zone_file.name, zone),
+                            ('maradns/' + csv2_name, get_csv2(zone)),
+                            ('mararc', mararc.encode('utf-8'))])
+    subprocess.run(['docker', 'cp', '-', cname + ':/etc'], input=archive,
+                   stdout=subprocess.PIPE, check=False)
     # Start the server
     subprocess.run(['docker', 'exec', cname,
                     '/etc/init.d/maradns', 'start'], stdout=subprocess.PIPE, check=False)
@@ -4,19 +4,33 @@ https://maradns.samiam.org/tutorial/man.csv2.html
 """
 import sys
 import pathlib
+from typing import Iterable, List
 
-filePath = pathlib.Path(sys.argv[1])
 
-with open(filePath, 'r') as f:
+def to_csv2(lines: Iterable[str]) -> List[str]:
+    """
+    Converts the lines of a (named-compilezone formatted) zone file to CSV2 lines.
+
+    :param lines: The lines of the zone file
+    """
     csv2 = []
-    for line in f:
-        line = line[:-1]
-        parts = line.split()
+    for line in lines:
+        parts = line.rstrip('\r\n').split()
+        if not parts:
+            continue
         parts[1] = '+' + parts[1]
         if parts[3] == 'TXT':
             parts[4] = parts[4][1:-1]
         JOINED = '\t'.join(parts)
         JOINED += ' ~\n'
         csv2.append(JOINED)
+    return csv2
+
+
+if __name__ == '__main__':
+    filePath = pathlib.Path(sys.argv[1])
+
+    with open(filePath, 'r') as f:
+        csv2 = to_csv2(f)
     with open(filePath.parent / (filePath.name + '.csv2'), 'w') as c:
         c.writelines(csv2)
@@ -8,11 +8,13 @@ port 53, which is mapped to a host port.
 
 import pathlib
 import subprocess
+from typing import Optional
 
 # Zone file has to have a new line at the end for NSD to accept it without any issues.
 
 
-def run(zone_file: pathlib.Path, zone_domain: str, cname: str, port: int, restart: bool, tag: str) -> None:
+def run(zone_file: pathlib.Path, zone_domain: str, cname: str, port: int, restart: bool, tag: str,
+        batch_dir: Optional[str] = None) -> None:
     """
     :param zone_file: Path to the Bind-style zone file
     :param zone_domain: The domain name of the zone
@@ -21,6 +23,8 @@ def run(zone_file: pathlib.Path, zone_domain: str, cname: str, port: int, restar
     :param restart: Whether to load the input zone file in a new container
                         or reuse the existing container
     :param tag: The image tag to be used if restarting the container
+    :param batch_dir: The directory in the container the zone file was already copied to
+                      (by the preprocessor checks), if any
     """
     if restart:
         subprocess.run(['docker', 'container', 'rm', cname, '-f'],
@@ -31,9 +35,15 @@ def run(zone_file: pathlib.Path, zone_domain: str, cname: str, port: int, restar
         # Stop the running server instance inside the container
         subprocess.run(
             ['docker', 'exec', cname, 'nsd-control', 'stop'], stdout=subprocess.PIPE, check=False)
-    # Copy the new zone file into the container
-    subprocess.run(['docker', 'cp', str(zone_file),
-                    cname + ':/etc/nsd/zones'], stdout=subprocess.PIPE, check=False)
+    # Copy the new zone file into the container, from the batch directory in the
+    # container if it is still there
+    copied = batch_dir is not None and subprocess.run(
+        ['docker', 'exec', cname, 'cp', batch_dir + '/' + zone_file.name,
+         '/etc/nsd/zones'], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        check=False).returncode == 0
+    if not copied:
+        subprocess.run(['docker', 'cp', str(zone_file),
+                        cname + ':/etc/nsd/zones'], stdout=subprocess.PIPE, check=False)
     # Create the NSD-specific configuration file
     nsd_conf = f'''
 server:
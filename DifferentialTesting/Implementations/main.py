@@ -28,23 +28,18 @@ import sys
 from argparse import ArgumentParser, FileType, RawTextHelpFormatter
 from typing import Dict, Optional
 
-from Bind.prepare import run as bind
-from Coredns.prepare import run as coredns
-from Knot.prepare import run as knot
-from Maradns.prepare import run as maradns
-from Nsd.prepare import run as nsd
-from Powerdns.prepare import run as powerdns
-from Technitium.prepare import run as technitium
-from Trustdns.prepare import run as trustdns
-from Yadifa.prepare import run as yadifa
+from registry import REGISTRY, load_runner
+
+# The zone file parser is shared with the test scripts in the Scripts directory
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+from Scripts.zone_features import get_zone_features  # pylint: disable=wrong-import-position
 
 
 def load_and_serve_zone_file(zone_file: pathlib.Path,
                              image: Optional[str],
                              cname: Optional[str],
                              port: Optional[int],
-                             latest: bool,
-                             technitium: bool) -> None:
+                             latest: bool) -> None:
     """
     :param zone_file: Path to the Bind-style zone file
     :param image: The image name of the implementation
@@ -66,13 +61,7 @@ def load_and_serve_zone_file(zone_file: pathlib.Path,
                 f'Error: No image exists with the input container name: {image}')
 
     # Retrieve the zone domain name from the input zone file.
-    zone_domain = ''
-    with open(zone_file, 'r') as zone_pointer:
-        for line in zone_pointer:
-            if 'SOA' in line:
-                zone_domain = line.split('\t')[0]
-                if ' ' in zone_domain:
-                    zone_domain = line.split()[0]
+    zone_domain = get_zone_features(zone_file).origin
     if not zone_domain:
         sys.exit(f'Error: SOA not found in {zone_file}')
 
@@ -93,19 +82,13 @@ def load_and_serve_zone_file(zone_file: pathlib.Path,
                 sys.exit(
                     f'Error: Cannot start a container with name {cname} as it exists already')
             else:
-                if technitium:
-                    start_container = subprocess.run(['docker', 'run', '-dp', str(port) + ':53/udp', '-p', f'{str(port + 1)}:5380/tcp',
-                                                      '--name=' + cname, image], stdout=subprocess.PIPE, check=True)
-                else:
-                    start_container = subprocess.run(['docker', 'run', '-dp', str(
-                        port) + ':53/udp', '--name=' + cname, image], stdout=subprocess.PIPE, check=False)
+                start_container = subprocess.run(
+                    ['docker', 'run', '-d', *REGISTRY[image.split(':')[0]].port_arguments(port),
+                     '--name=' + cname, image], stdout=subprocess.PIPE, check=False)
         else:
-            if technitium:
-                start_container = subprocess.run(['docker', 'run', '-dp', str(port) + ':53/udp', '-p', f'{str(port + 1)}:5380/tcp',
-                                                  image], stdout=subprocess.PIPE, check=True)
-            else:
-                start_container = subprocess.run(['docker', 'run', '-dp', str(port) + ':53/udp',
-                                                  image], stdout=subprocess.PIPE, check=False)
+            start_container = subprocess.run(
+                ['docker', 'run', '-d', *REGISTRY[image.split(':')[0]].port_arguments(port),
+                 image], stdout=subprocess.PIPE, check=False)
         if start_container.returncode != 0:
             sys.exit(f'Unable to a start a container for {image}')
         cid = start_container.stdout.decode("utf-8").strip()
@@ -120,7 +103,7 @@ def load_and_serve_zone_file(zone_file: pathlib.Path,
         sys.exit(
             f'Error: Docker inspect failed when getting name for the container with id: {cid}')
     cname, image_name = get_name.stdout.decode("utf-8").strip("/\n\"").split()
-    globals()[image_name.split(":")[0]](
+    load_runner(image_name.split(":")[0])(
         zone_file, zone_domain, cname, port, False, tag)
 
 
@@ -133,8 +116,7 @@ if __name__ == '__main__':
                             'assign a name) or only the name of an existing container to reuse it.')
     parser.add_argument('-z', metavar='ZONE_FILE_PATH', type=FileType('r'), default='db.campus.edu',
                         help='The path to the zone file to be served. (default: db.campus.edu.)')
-    parser.add_argument('-i', type=str, choices={'bind', 'nsd', 'knot', 'powerdns', 'coredns',
-                                                 'yadifa', 'maradns', 'trustdns', 'technitium'},
+    parser.add_argument('-i', type=str, choices=REGISTRY.keys(),
                         help='The docker image name of the implementation to start a container.')
     parser.add_argument('-p', metavar='UNUSED_PORT', type=int,
                         help='An unused host port to map to port 53 of the container.')
@@ -152,10 +134,10 @@ if __name__ == '__main__':
         sys.exit('Error: Specify either an image name and a port to start a fresh '
                  'container (also container name if you want to assign a name) or '
                  'only the name of an existing container to reuse it.')
-    if args.i and args.i == 'technitium':
+    if args.i and REGISTRY[args.i].latest_only:
         args.e = True
     if args.e and not args.latest:
         print('Technitium does not have an older image, using the latest version')
         args.latest = True
     load_and_serve_zone_file(pathlib.Path(args.z.name),
-                             args.i, args.c, args.p, args.latest, args.e)
+                             args.i, args.c, args.p, args.latest)
@@ -0,0 +1,158 @@
+"""
+Declarative registry of the DNS implementations that can be tested.
+Each entry records the image name, the host port its container port 53 is mapped to,
+the command-line flag that disables it, and the entry points used to serve and
+to preprocess a zone file. The loader modules are imported only when requested,
+so the heavy dependencies of a single implementation (for example, `requests` for
+Technitium) are not imported unless that implementation is enabled.
+
+The registry also records what each implementation can represent: the record types
+its loader supports and the zone features it can not serve. Zones using any of those
+are not loaded into that implementation, as its responses would only produce known
+false-positive differences.
+
+Adding a new implementation only requires a directory with a Dockerfile and a
+prepare.py with a `run` function, and a new entry in IMPLEMENTATIONS.
+"""
+
+#!/usr/bin/env python3
+
+import importlib
+from argparse import ArgumentParser, Namespace
+from typing import (Callable, Dict, FrozenSet, Iterable, List, NamedTuple,
+                    Optional, Tuple)
+
+# Zone features (besides the record types) that some implementations can not serve
+WILDCARD = 'wildcard'
+MULTI_STRING_TXT = 'multi_string_txt'
+TXT_WITH_SPACES = 'txt_with_spaces'
+
+# Record types the Technitium loader maps to its HTTP API, others are silently dropped
+TECHNITIUM_TYPES = frozenset(['SOA', 'NS', 'A', 'AAAA', 'CNAME', 'DNAME', 'TXT'])
+
+
+class Implementation(NamedTuple):
+    """
+    Static description of an implementation.
+
+    name: The implementation name, which is also the Docker image name
+    directory: The directory in Implementations with the Dockerfile and prepare.py
+    title: The human readable name used in help messages and outputs
+    flag: The single-letter command-line flag that disables the implementation
+    port: The base host port to map to the container port 53 (multiplied by the run id)
+    api_port: A container TCP port mapped to the host port `port + 1`, if any
+    preprocessor: The name of the zone-file checker in PREPROCESSORS of
+                  Scripts/preprocessor_checks.py, if any
+    latest_only: Whether the image is always built from the latest code
+    supported_types: The only record types the implementation can load (None for any type)
+    unsupported_types: The record types the implementation does not support
+    unsupported_features: The zone features the implementation can not serve
+    """
+    name: str
+    directory: str
+    title: str
+    flag: str
+    port: int
+    api_port: Optional[int] = None
+    preprocessor: Optional[str] = None
+    latest_only: bool = False
+    supported_types: Optional[FrozenSet[str]] = None
+    unsupported_types: FrozenSet[str] = frozenset()
+    unsupported_features: FrozenSet[str] = frozenset()
+
+    @property
+    def loader(self) -> str:
+        """The module (relative to Implementations) with the `run` function."""
+        return f'{self.directory}.prepare'
+
+    def container_name(self, cid: int) -> str:
+        """Returns the name of the container of this implementation for the run id."""
+        return f'{cid}_{self.name}_server'
+
+    def port_arguments(self, port: int) -> List[str]:
+        """Returns the `docker run` arguments to publish the container ports on the host."""
+        arguments = ['-p', f'{port}:53/udp']
+        if self.api_port:
+            arguments += ['-p', f'{port + 1}:{self.api_port}/tcp']
+        return arguments
+
+    def can_serve(self, record_types: Iterable[str], features: Iterable[str]) -> bool:
+        """
+        Returns whether the implementation can meaningfully serve a zone.
+
+        :param record_types: The record types present in the zone
+        :param features: The features present in the zone
+        """
+        record_types = set(record_types)
+        if record_types & self.unsupported_types:
+            return False
+        if self.supported_types is not None and not record_types <= self.supported_types:
+            return False
+        return not set(features) & self.unsupported_features
+
+
+IMPLEMENTATIONS = [
+    Implementation('bind', 'Bind', 'Bind', 'b', 8000, preprocessor='bind'),
+    Implementation('nsd', 'Nsd', 'Nsd', 'n', 8100, preprocessor='nsd'),
+    Implementation('knot', 'Knot', 'Knot', 'k', 8200, preprocessor='knot'),
+    Implementation('powerdns', 'Powerdns', 'PowerDns', 'p', 8300, preprocessor='powerdns'),
+    Implementation('yadifa', 'Yadifa', 'Yadifa', 'y', 8400,
+                   unsupported_types=frozenset(['DNAME'])),
+    Implementation('coredns', 'Coredns', 'CoreDns', 'c', 8500),
+    # tocsv2.py only strips the quotes of a single-string TXT without spaces
+    Implementation('maradns', 'Maradns', 'MaraDns', 'm', 8600,
+                   unsupported_types=frozenset(['DNAME']),
+                   unsupported_features=frozenset([MULTI_STRING_TXT, TXT_WITH_SPACES])),
+    Implementation('trustdns', 'Trustdns', 'TrustDns', 't', 8700,
+                   unsupported_types=frozenset(['DNAME'])),
+    # The loader adds only the first string of a TXT record
+    Implementation('technitium', 'Technitium', 'Technitium', 'e', 8800,
+                   api_port=5380, latest_only=True, supported_types=TECHNITIUM_TYPES,
+                   unsupported_features=frozenset([MULTI_STRING_TXT])),
+]
+
+REGISTRY = {impl.name: impl for impl in IMPLEMENTATIONS}  # type: Dict[str, Implementation]
+
+
+def with_preprocessor() -> List[Implementation]:
+    """Returns the implementations that have a mature zone-file preprocessor."""
+    return [impl for impl in IMPLEMENTATIONS if impl.preprocessor]
+
+
+def add_disable_arguments(parser: ArgumentParser,
+                          implementations: Optional[List[Implementation]] = None) -> None:
+    """
+    Adds a flag to the parser to disable each of the input implementations.
+
+    :param parser: The argument parser
+    :param implementations: The implementations to add flags for (default: all)
+    """
+    for impl in implementations if implementations is not None else IMPLEMENTATIONS:
+        parser.add_argument('-' + impl.flag, action="store_true",
+                            help=f'Disable {impl.title}.')
+
+
+def get_ports(input_args: Namespace,
+              implementations: Optional[List[Implementation]] = None) -> Dict[str, Tuple[bool, int]]:
+    """
+    Returns a map from an implementation to the host port its container port 53
+    should be mapped and whether that implementation should be tested.
+
+    :param input_args: The input arguments with a disable flag for each implementation
+    :param implementations: The implementations to consider (default: all)
+    """
+    return {impl.name: (not getattr(input_args, impl.flag, False), impl.port)
+            for impl in (implementations if implementations is not None else IMPLEMENTATIONS)}
+
+
+def load_runner(name: str) -> Callable[..., None]:
+    """
+    Imports the prepare module of the implementation and returns its `run` function.
+    The import happens only on the first call for that implementation.
+
+    :param name: The implementation name
+    """
+    # Works both when imported as `Implementations.registry` (from the DifferentialTesting
+    # directory) and as `registry` (from the Implementations directory).
+    prefix = f'{__package__}.' if __package__ else ''
+    return importlib.import_module(prefix + REGISTRY[name].loader).run
@@ -0,0 +1,242 @@
+"""
+Clusters the tests that resulted in differences by how the responses differ, independent
+of which implementations are in each group.
+The diff signature of a test is the set of differences between the response of the
+largest group and the response of each other group: the rcode change, the flags added or
+removed, the sections that differ and the record types added to or removed from each
+section. Tests with the same signature are in the same cluster, and clusters with similar
+signatures (estimated Jaccard similarity at least the threshold) are merged using a MinHash
+index with locality-sensitive hashing (LSH), which takes near-linear time in the number of
+unique signatures. The clusters, each with a representative test, are output as the
+Clusters.json file in each of the directories with the differences.
+
+usage: python3 -m Scripts.clustering [-h] [-path DIRECTORY_PATH] [-db | -stream]
+                                     [-threshold THRESHOLD]
+
+optional arguments:
+  -h, --help            show this help message and exit
+  -path DIRECTORY_PATH  The path to the directory containing Differences directory.
+                        Searches recursively (default: Results/)
+  -db                   Read the differences from the differences database
+                        (Differences.sqlite3) instead of the Differences directory.
+                        (default: False)
+  -stream               Read the differences from the Differences stream files
+                        (Differences_<id>.bin) instead of the Differences directory.
+                        (default: False)
+  -threshold THRESHOLD  The minimum similarity of the signatures of merged clusters.
+                        (default: 0.8)
+"""
+
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import pathlib
+from argparse import SUPPRESS, ArgumentDefaultsHelpFormatter, ArgumentParser
+from collections import defaultdict
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+from Scripts.diff_signature import Signature, diff_signature
+from Scripts.differences_db import DIFFERENCES_DB, DifferencesDB
+from Scripts.differences_stream import STREAM_PATTERN, read_stream_directory
+from Scripts.fingerprints import Test, atomic_json_dump
+from Scripts.test_with_valid_zone_files import DIFFERENCES
+
+CLUSTERS = "Clusters.json"
+NUM_PERMUTATIONS = 64
+# A Mersenne prime larger than the 64-bit token hashes truncated to 60 bits
+PRIME = (1 << 61) - 1
+
+
+def _token_hash(token: str) -> int:
+    """Returns a stable 60-bit hash of the token."""
+    return int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(),
+                          'big') >> 4
+
+
+class MinHashLSH:
+    """
+    MinHash index of signatures with `bands` bands of `rows` rows each.
+    """
+
+    def __init__(self, threshold: float, num_permutations: int = NUM_PERMUTATIONS) -> None:
+        """
+        :param threshold: The approximate Jaccard similarity above which signatures
+                          are likely to share a band
+        :param num_permutations: The number of hash functions
+        """
+        # The banding with the S-curve threshold (1/bands)^(1/rows) closest to the input
+        self.rows = min((rows for rows in range(1, num_permutations + 1)
+                         if num_permutations % rows == 0),
+                        key=lambda rows: abs((rows / num_permutations) ** (1 / rows) - threshold))
+        self.bands = num_permutations // self.rows
+        # Deterministic permutations so that the clusters are reproducible
+        self.permutations = [(_token_hash(f'a{i}') | 1, _token_hash(f'b{i}'))
+                             for i in range(num_permutations)]
+        self.buckets = defaultdict(list)  # type: Dict[Tuple[int, Tuple[int, ...]], List[int]]
+
+    def minhash(self, signature: Signature) -> List[int]:
+        """Returns the MinHash of the signature."""
+        hashes = [_token_hash(token) for token in signature] or [0]
+        return [min((a * value + b) % PRIME for value in hashes) for a, b in self.permutations]
+
+    def insert(self, key: int, signature: Signature) -> None:
+        """Adds the signature to the buckets of its bands."""
+        minhash = self.minhash(signature)
+        for band in range(self.bands):
+            self.buckets[(band, tuple(minhash[band * self.rows:(band + 1) * self.rows]))] \
+                .append(key)
+
+    def candidate_buckets(self) -> Iterator[List[int]]:
+        """Yields the keys in each bucket with more than one key."""
+        for keys in self.buckets.values():
+            if len(keys) > 1:
+                yield keys
+
+
+def jaccard(first: Signature, second: Signature) -> float:
+    """Returns the Jaccard similarity of the signatures."""
+    if not first and not second:
+        return 1.0
+    return len(first & second) / len(first | second)
+
+
+def cluster_tests(zones: Iterable[Tuple[str, List[Dict[str, Any]]]],
+                  threshold: float = 0.8) -> List[Dict[str, Any]]:
+    """
+    Returns the clusters of the tests of the input zones in descending order of size.
+
+    :param zones: The zone id and the differences of each zone
+    :param threshold: The minimum similarity of the signatures of merged clusters
+    """
+    tests_by_signature = defaultdict(list)  # type: Dict[Signature, List[Test]]
+    for zoneid, differences in zones:
+        for difference in differences:
+            query_str = difference["Query Name"] + ":" + difference["Query Type"]
+            tests_by_signature[diff_signature(difference)].append((zoneid, query_str))
+    signatures = sorted(tests_by_signature, key=lambda sig: (-len(tests_by_signature[sig]),
+                                                             sorted(sig)))
+    # Union-find over the unique signatures
+    parent = list(range(len(signatures)))
+
+    def find(key: int) -> int:
+        while parent[key] != key:
+            parent[key] = parent[parent[key]]
+            key = parent[key]
+        return key
+
+    index = MinHashLSH(threshold)
+    for key, signature in enumerate(signatures):
+        index.insert(key, signature)
+    for keys in index.candidate_buckets():
+        # Compare with the first (most frequent) signature in the bucket only,
+        # which keeps the number of comparisons linear in the bucket size
+        first = keys[0]
+        for key in keys[1:]:
+            if jaccard(signatures[first], signatures[key]) >= threshold:
+                root_first, root_key = find(first), find(key)
+                if root_first != root_key:
+                    parent[max(root_first, root_key)] = min(root_first, root_key)
+    members = defaultdict(list)  # type: Dict[int, List[int]]
+    for key in range(len(signatures)):
+        members[find(key)].append(key)
+    clusters = []
+    for root, keys in members.items():
+        tests = sorted(test for key in keys for test in tests_by_signature[signatures[key]])
+        clusters.append({
+            'Signature': sorted(signatures[root]),
+            'Signatures': len(keys),
+            'Count': len(tests),
+            'Representative': list(sorted(tests_by_signature[signatures[root]])[0]),
+            'Tests': [list(test) for test in tests]
+        })
+    clusters.sort(key=lambda cluster: (-cluster['Count'], cluster['Signature']))
+    return clusters
+
+
+def read_zones(dir_path: pathlib.Path, source: str) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+    """
+    Yields the zone id and the differences of each zone in the directory.
+
+    :param dir_path: The path to the directory with the differences
+    :param source: Where to read the differences from: the Differences directory,
+                   the differences database or the Differences stream files
+    """
+    if source == DIFFERENCES_DB:
+        database = DifferencesDB(dir_path)
+        for zoneid, differences, _ in database.zones():
+            yield zoneid, differences
+        database.close()
+    elif source == STREAM_PATTERN:
+        for zoneid, differences, _ in read_stream_directory(dir_path):
+            yield zoneid, differences
+    else:
+        for diff in (dir_path / DIFFERENCES).iterdir():
+            with open(diff, 'r') as diff_fp:
+                yield diff.stem, json.load(diff_fp)
+
+
+def write_clusters(dir_path: pathlib.Path, clusters: List[Dict[str, Any]]) -> None:
+    """
+    Outputs the clusters as the Clusters.json file with a summary line for each cluster.
+
+    :param dir_path: The path to the directory with the differences
+    :param clusters: The clusters in descending order of size
+    """
+    summary = [f'{cluster["Count"]} {" ".join(cluster["Signature"]) or "-"} '
+               f'(e.g. {cluster["Representative"][0]} {cluster["Representative"][1]})'
+               for cluster in clusters]
+    atomic_json_dump({'Summary': summary, 'Clusters': clusters}, dir_path / CLUSTERS, indent=2)
+
+
+def cluster_tests_helper(input_dir: pathlib.Path, source: str, threshold: float) -> None:
+    """
+    Helper function to cluster the tests.
+    Iterates recursively over the input directory to find Differences directory
+    (or the differences database or the Differences stream files).
+
+    :param input_dir: The input directory
+    :param source: Where to read the differences from
+    :param threshold: The minimum similarity of the signatures of merged clusters
+    """
+    # Exit if the inputted path does not exist or is not a directory.
+    if not (input_dir.exists() or input_dir.is_dir()):
+        return
+    if (source == DIFFERENCES_DB and (input_dir / DIFFERENCES_DB).exists()) or \
+            (source == STREAM_PATTERN and any(input_dir.glob(STREAM_PATTERN))) or \
+            (source == DIFFERENCES and (input_dir / DIFFERENCES).is_dir()):
+        write_clusters(input_dir, cluster_tests(read_zones(input_dir, source), threshold))
+    else:
+        if input_dir.is_dir():
+            for subdir in input_dir.iterdir():
+                cluster_tests_helper(subdir, source, threshold)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter,
+                            description='Clusters the tests that resulted in differences by '
+                            'how the responses differ.')
+    parser.add_argument('-path', metavar='DIRECTORY_PATH', default=SUPPRESS,
+                        help='The path to the directory containing Differences directory.'
+                        ' Searches recursively (default: Results/)')
+    source_group = parser.add_mutually_exclusive_group()
+    source_group.add_argument('-db', action="store_true",
+                              help='Read the differences from the differences database '
+                              '(Differences.sqlite3) instead of the Differences directory.')
+    source_group.add_argument('-stream', action="store_true",
+                              help='Read the differences from the Differences stream files '
+                              '(Differences_<id>.bin) instead of the Differences directory.')
+    parser.add_argument('-threshold', type=float, default=0.8,
+                        help='The minimum similarity of the signatures of merged clusters.')
+    args = parser.parse_args()
+    if "path" in args:
+        directory_path = pathlib.Path(args.path)
+    else:
+        directory_path = pathlib.Path("Results/")
+    if args.db:
+        differences_source = DIFFERENCES_DB
+    elif args.stream:
+        differences_source = STREAM_PATTERN
+    else:
+        differences_source = DIFFERENCES
+    cluster_tests_helper(directory_path, differences_source, args.threshold)
@@ -0,0 +1,94 @@
+"""
+The diff signature of a test that resulted in a difference: how the responses of the
+groups differ, independent of which implementations are in each group.
+The signature is the set of differences between the response of the largest group and
+the response of each other group: the rcode change, the flags added or removed, the
+sections that differ and the record types added to or removed from each section.
+"""
+
+#!/usr/bin/env python3
+
+from collections import Counter, defaultdict
+from typing import Any, Dict, FrozenSet, NamedTuple, Set, Tuple
+
+SECTIONS = (';ANSWER', ';AUTHORITY', ';ADDITIONAL')
+CLASSES = {'IN', 'CH', 'CS', 'HS', 'ANY', 'NONE'}
+
+Signature = FrozenSet[str]
+
+
+class ParsedResponse(NamedTuple):
+    """
+    rcode: The response code ('' if the response is not a DNS message)
+    flags: The header flags
+    sections: The records and the histogram of record types in each section
+    """
+    rcode: str
+    flags: FrozenSet[str]
+    sections: Dict[str, Tuple[FrozenSet[str], Counter]]
+
+
+def parse_response(response: Any) -> ParsedResponse:
+    """
+    Parses a response in the Differences files format (the lines of the dnspython
+    text format or an error message).
+
+    :param response: The response of a group
+    """
+    if isinstance(response, str):
+        return ParsedResponse('', frozenset(), {})
+    rcode = ''
+    flags = frozenset()  # type: FrozenSet[str]
+    records = defaultdict(set)  # type: Dict[str, Set[str]]
+    types = defaultdict(Counter)  # type: Dict[str, Counter]
+    section = ''
+    for line in response:
+        if line.startswith(';'):
+            section = line
+        elif line.startswith('rcode '):
+            rcode = line.split()[1]
+        elif line.startswith('flags'):
+            flags = frozenset(line.split()[1:])
+        elif section in SECTIONS and line.strip():
+            tokens = line.split()
+            # The record type follows the class
+            rtype = next((tokens[i + 1] for i in range(1, len(tokens) - 1)
+                          if tokens[i] in CLASSES), tokens[-1])
+            records[section].add(line)
+            types[section][rtype] += 1
+    return ParsedResponse(rcode, flags,
+                          {sec: (frozenset(records[sec]), types[sec]) for sec in SECTIONS})
+
+
+def diff_signature(difference: Dict[str, Any]) -> Signature:
+    """
+    Returns the diff signature of a test that resulted in a difference.
+
+    :param difference: The difference of a test as in the Differences files
+    """
+    groups = [(len(group["Server/s"].split()), parse_response(group["Response"]))
+              for group in difference["Groups"]]
+    # The response of the largest group (the first one in case of a tie) is the reference
+    reference = max(groups, key=lambda group: group[0])[1]
+    signature = set()
+    for _, response in groups:
+        if response is reference:
+            continue
+        if not response.rcode or not reference.rcode:
+            signature.add('no-message')
+            continue
+        if response.rcode != reference.rcode:
+            signature.add(f'rcode:{reference.rcode}>{response.rcode}')
+        signature.update(f'flag-:{flag}' for flag in reference.flags - response.flags)
+        signature.update(f'flag+:{flag}' for flag in response.flags - reference.flags)
+        for section in SECTIONS:
+            ref_records, ref_types = reference.sections[section]
+            records, types = response.sections[section]
+            if records != ref_records:
+                signature.add(f'section:{section[1:]}')
+            for rtype in set(ref_types) | set(types):
+                if types[rtype] < ref_types[rtype]:
+                    signature.add(f'{section[1:]}:{rtype}-')
+                elif types[rtype] > ref_types[rtype]:
+                    signature.add(f'{section[1:]}:{rtype}+')
+    return frozenset(signature)
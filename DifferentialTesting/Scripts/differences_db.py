@@ -0,0 +1,295 @@
+"""
+SQLite database of the differences, an alternative to one JSON file per zone in the
+Differences directory. The database (Differences.sqlite3, a sibling of the Differences
+directory) stores a row per test with a difference, with indexed columns for the zone id,
+the query name and type, the Zen model case and the fingerprint, and a row per group of
+implementations with the same response. Each group is stored as a bitmask of its
+implementations (bits in the order of the implementations registry) and a key to the
+response, which is stored only once, JSON encoded so that both the lines of a DNS response
+and an error message string come back unchanged. Importing checks that each imported zone
+reads back the same as its Differences file.
+
+usage: python3 -m Scripts.differences_db [-h] [-path DIRECTORY_PATH] [-import]
+                                         [-only IMPLEMENTATION] [-counts] [-zone ZONE_ID]
+
+optional arguments:
+  -h, --help            show this help message and exit
+  -path DIRECTORY_PATH  The path to the directory containing the Differences.sqlite3 file.
+                        (default: Results/ValidZoneFileTests/)
+  -import               Import the Differences directory files into the database.
+                        (default: False)
+  -only IMPLEMENTATION  List the tests where only this implementation disagrees with all
+                        the others. (default: None)
+  -counts               List the number of tests for each fingerprint. (default: False)
+  -zone ZONE_ID         Output the differences of the zone in the Differences JSON format.
+                        (default: None)
+"""
+
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import pathlib
+import sqlite3
+import sys
+from argparse import SUPPRESS, ArgumentDefaultsHelpFormatter, ArgumentParser
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+from Implementations.registry import IMPLEMENTATIONS, REGISTRY
+
+DIFFERENCES_DB = "Differences.sqlite3"
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS servers (
+    name TEXT PRIMARY KEY,
+    bit INTEGER NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    response TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS differences (
+    id INTEGER PRIMARY KEY,
+    zoneid TEXT NOT NULL,
+    qname TEXT NOT NULL,
+    qtype TEXT NOT NULL,
+    model_case TEXT,
+    fingerprint TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS response_groups (
+    difference INTEGER NOT NULL REFERENCES differences(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    mask INTEGER NOT NULL,
+    servers TEXT NOT NULL,
+    response_key TEXT NOT NULL REFERENCES responses(key),
+    PRIMARY KEY (difference, position)
+);
+CREATE INDEX IF NOT EXISTS differences_zoneid ON differences(zoneid);
+CREATE INDEX IF NOT EXISTS differences_query ON differences(qname, qtype);
+CREATE INDEX IF NOT EXISTS differences_model_case ON differences(model_case);
+CREATE INDEX IF NOT EXISTS differences_fingerprint ON differences(fingerprint);
+CREATE INDEX IF NOT EXISTS response_groups_mask ON response_groups(mask);
+CREATE INDEX IF NOT EXISTS response_groups_response ON response_groups(response_key);
+'''
+
+
+def encode_response(response: Union[str, List[str]]) -> str:
+    """
+    Returns the text stored for a response, which is either the list of lines of a DNS
+    response or an error message string (such as "No response") in the Differences files.
+    """
+    return json.dumps(response, separators=(',', ':'))
+
+
+def response_key(response: Union[str, List[str]]) -> str:
+    """Returns the key of a response (a list of lines or a string)."""
+    return hashlib.sha256(encode_response(response).encode('utf-8')).hexdigest()[:32]
+
+
+class DifferencesDB:
+    """
+    Connection to the differences database of a directory.
+    Multiple test runs (with different ids) can write to the same database.
+    """
+
+    def __init__(self, dir_path: pathlib.Path) -> None:
+        """
+        Opens the database of the directory, creating it if it does not exist.
+
+        :param dir_path: The path to the directory to store the database in
+        """
+        self.path = dir_path / DIFFERENCES_DB
+        self.conn = sqlite3.connect(str(self.path), timeout=60)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA foreign_keys=ON')
+        self.conn.executescript(SCHEMA)
+        self.conn.executemany('INSERT OR IGNORE INTO servers VALUES (?, ?)',
+                              [(impl.name, bit) for bit, impl in enumerate(IMPLEMENTATIONS)])
+        self.conn.commit()
+        self.bits = dict(self.conn.execute('SELECT name, bit FROM servers'))
+
+    def close(self) -> None:
+        """Closes the connection."""
+        self.conn.close()
+
+    def _bit(self, server: str) -> int:
+        """Returns the bit of the server, assigning the next free bit to a new server."""
+        if server not in self.bits:
+            self.conn.execute('INSERT OR IGNORE INTO servers SELECT ?, COALESCE(MAX(bit), -1) + 1'
+                              ' FROM servers', (server,))
+            self.bits[server] = self.conn.execute('SELECT bit FROM servers WHERE name = ?',
+                                                  (server,)).fetchone()[0]
+        return self.bits[server]
+
+    def mask(self, servers: str) -> int:
+        """Returns the bitmask of the whitespace separated servers."""
+        mask = 0
+        for server in servers.split():
+            mask |= 1 << self._bit(server)
+        return mask
+
+    def add(self,
+            zoneid: str,
+            differences: List[Dict[str, Any]],
+            model_cases: Dict[str, str]) -> None:
+        """
+        Replaces the differences of the zone in the database.
+
+        :param zoneid: The unique zone identifier
+        :param differences: The differences of the zone as in the Differences files
+        :param model_cases: Map from a query "name:type" to its Zen model case, if available
+        """
+        with self.conn:
+            self.conn.execute('DELETE FROM differences WHERE zoneid = ?', (zoneid,))
+            for difference in differences:
+                qname, qtype = difference["Query Name"], difference["Query Type"]
+                groups = [(self.mask(group["Server/s"]), group["Server/s"], group["Response"])
+                          for group in difference["Groups"]]
+                fingerprint = ','.join(str(mask) for mask in sorted(mask for mask, _, _ in groups
+                                                                    if mask))
+                cursor = self.conn.execute(
+                    'INSERT INTO differences (zoneid, qname, qtype, model_case, fingerprint) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (zoneid, qname, qtype, model_cases.get(qname + ":" + qtype), fingerprint))
+                for position, (mask, servers, response) in enumerate(groups):
+                    key = response_key(response)
+                    self.conn.execute('INSERT OR IGNORE INTO responses VALUES (?, ?)',
+                                      (key, encode_response(response)))
+                    self.conn.execute('INSERT INTO response_groups VALUES (?, ?, ?, ?, ?)',
+                                      (cursor.lastrowid, position, mask, servers, key))
+
+    def zone_ids(self) -> List[str]:
+        """Returns the ids of the zones with differences."""
+        return [zoneid for zoneid, in
+                self.conn.execute('SELECT DISTINCT zoneid FROM differences ORDER BY zoneid')]
+
+    def zones(self, zoneid: Optional[str] = None) -> Iterator[Tuple[str,
+                                                                     List[Dict[str, Any]],
+                                                                     Dict[str, str]]]:
+        """
+        Yields the zone id, the differences in the Differences files format and the
+        model cases of each zone (or only the input zone).
+
+        :param zoneid: The zone to output (default: all the zones)
+        """
+        query = ('SELECT d.id, d.zoneid, d.qname, d.qtype, d.model_case, g.servers, r.response '
+                 'FROM differences d JOIN response_groups g ON g.difference = d.id '
+                 'JOIN responses r ON r.key = g.response_key')
+        params = ()  # type: Tuple[str, ...]
+        if zoneid is not None:
+            query += ' WHERE d.zoneid = ?'
+            params = (zoneid,)
+        query += ' ORDER BY d.zoneid, d.id, g.position'
+        current = None  # type: Optional[str]
+        differences = []  # type: List[Dict[str, Any]]
+        model_cases = {}  # type: Dict[str, str]
+        last_id = None
+        for diff_id, zone, qname, qtype, model_case, servers, response in \
+                self.conn.execute(query, params):
+            if zone != current:
+                if current is not None:
+                    yield current, differences, model_cases
+                current, differences, model_cases = zone, [], {}
+            if diff_id != last_id:
+                differences.append({"Query Name": qname, "Query Type": qtype, "Groups": []})
+                if model_case is not None:
+                    model_cases[qname + ":" + qtype] = model_case
+                last_id = diff_id
+            differences[-1]["Groups"].append({"Server/s": servers,
+                                              "Response": json.loads(response)})
+        if current is not None:
+            yield current, differences, model_cases
+
+    def only_disagrees(self, impl: str) -> List[Tuple[str, str, str]]:
+        """
+        Returns the tests (zone id, query name, query type) where the implementation is
+        alone in its group and all the other implementations have the same response.
+
+        :param impl: The implementation name
+        """
+        if impl not in self.bits:
+            return []
+        return list(self.conn.execute(
+            'SELECT d.zoneid, d.qname, d.qtype FROM differences d '
+            'JOIN response_groups g ON g.difference = d.id WHERE g.mask = ? AND '
+            '(SELECT COUNT(*) FROM response_groups o WHERE o.difference = d.id) = 2 '
+            'ORDER BY CAST(d.zoneid AS INTEGER), d.zoneid, d.id', (1 << self.bits[impl],)))
+
+    def fingerprint_counts(self) -> List[Tuple[Optional[str], List[List[str]], int]]:
+        """
+        Returns the model case, the implementation groups and the number of tests for each
+        fingerprint, in descending order of the number of tests.
+        """
+        names = {bit: name for name, bit in self.bits.items()}
+        counts = []
+        for model_case, fingerprint, count in self.conn.execute(
+                'SELECT model_case, fingerprint, COUNT(*) AS total FROM differences '
+                'GROUP BY model_case, fingerprint ORDER BY total DESC'):
+            groups = [[names[bit] for bit in sorted(names) if int(mask) >> bit & 1]
+                      for mask in fingerprint.split(',') if mask]
+            counts.append((model_case, groups, count))
+        return counts
+
+
+def import_differences(dir_path: pathlib.Path, database: DifferencesDB) -> int:
+    """
+    Imports the Differences directory files into the database and returns their number.
+
+    :param dir_path: The path to the directory containing the Differences directory
+    :param database: The differences database
+    """
+    # Imported here as the test runners import this module
+    from Scripts.model_cases import ModelCaseIndex
+    from Scripts.test_with_valid_zone_files import DIFFERENCES
+    index = ModelCaseIndex(dir_path)
+    imported = 0
+    for diff in (dir_path / DIFFERENCES).iterdir():
+        with open(diff, 'r') as diff_fp:
+            differences = json.load(diff_fp)
+        database.add(diff.stem, differences, index.get(diff.stem))
+        # The database must give back the same differences, whatever the response shapes
+        _, stored, _ = next(database.zones(diff.stem), (diff.stem, [], {}))
+        if stored != differences:
+            sys.exit(f'The differences of {diff} do not round-trip through the database')
+        imported += 1
+    index.close()
+    return imported
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter,
+                            description='Queries the differences database.')
+    parser.add_argument('-path', metavar='DIRECTORY_PATH', default=SUPPRESS,
+                        help='The path to the directory containing the Differences.sqlite3 '
+                        'file. (default: Results/ValidZoneFileTests/)')
+    parser.add_argument('-import', dest='import_files', action="store_true",
+                        help='Import the Differences directory files into the database.')
+    parser.add_argument('-only', metavar='IMPLEMENTATION', choices=REGISTRY.keys(),
+                        help='List the tests where only this implementation disagrees with '
+                        'all the others.')
+    parser.add_argument('-counts', action="store_true",
+                        help='List the number of tests for each fingerprint.')
+    parser.add_argument('-zone', metavar='ZONE_ID',
+                        help='Output the differences of the zone in the Differences JSON '
+                        'format.')
+    args = parser.parse_args()
+    if "path" in args:
+        directory_path = pathlib.Path(args.path)
+    else:
+        directory_path = pathlib.Path("Results/ValidZoneFileTests/")
+    if not args.import_files and not (directory_path / DIFFERENCES_DB).exists():
+        sys.exit(f'There is no {DIFFERENCES_DB} file in "{directory_path}".')
+    db = DifferencesDB(directory_path)
+    if args.import_files:
+        print(f'Imported {import_differences(directory_path, db)} Differences files')
+    if args.only:
+        for test in db.only_disagrees(args.only):
+            print(' '.join(test))
+    if args.counts:
+        for case, impl_groups, total in db.fingerprint_counts():
+            groups_summary = ' '.join('{' + ','.join(grp) + '}' for grp in impl_groups)
+            print(f'{total}\t{case if case is not None else "-"}\t{groups_summary}')
+    if args.zone:
+        _, zone_differences, _ = next(db.zones(args.zone), (args.zone, [], {}))
+        print(json.dumps(zone_differences, indent=2))
+    db.close()
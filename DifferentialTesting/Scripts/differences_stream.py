@@ -0,0 +1,256 @@
+"""
+Compact binary alternative to the Differences directory JSON files.
+Each test run appends the differences to a single stream file (Differences_<id>.bin,
+a sibling of the Differences directory) with one length-prefixed frame per zone.
+A frame has the zone id (uncompressed, so that frames can be skipped without
+decompressing them) and the compressed records written for the zone:
+    - a response record defines the next response id with the response (the lines of a
+      DNS response or an error message string) JSON encoded; each unique response is
+      stored once per file
+    - a zone record has the differences of the zone with the responses referenced by id,
+      along with the model cases of the zone
+The frames share a single zlib stream (flushed at the end of each frame), so that the
+responses and names repeated across zones compress well. Each time a writer opens the
+file, a new zlib stream starts with a segment frame.
+A later frame of a zone replaces the earlier ones. A partially written frame at the
+end of a file (for example, if the run was killed) is ignored by the reader and
+overwritten by the writer.
+
+usage: python3 -m Scripts.differences_stream [-h] [-path DIRECTORY_PATH] [-export]
+
+optional arguments:
+  -h, --help            show this help message and exit
+  -path DIRECTORY_PATH  The path to the directory containing the Differences stream files.
+                        (default: Results/ValidZoneFileTests/)
+  -export               Export the differences of each zone to the Differences directory as
+                        JSON files. (default: False)
+"""
+
+#!/usr/bin/env python3
+
+import json
+import os
+import pathlib
+import struct
+import sys
+import zlib
+from argparse import SUPPRESS, ArgumentDefaultsHelpFormatter, ArgumentParser
+from typing import Any, BinaryIO, Dict, Iterator, List, Tuple, Union
+
+from Scripts.differences_db import encode_response
+
+# Identifies the file format (and its version); files of any other format are rejected
+MAGIC = b'FERRETDIFF1\n'
+STREAM_PATTERN = "Differences_*.bin"
+# Frame kind, zone id length, payload length
+FRAME = struct.Struct('>cHI')
+SEGMENT = b'S'
+CONTINUATION = b'C'
+# Record kind, data length
+RECORD = struct.Struct('>cI')
+RESPONSE = b'R'
+ZONE = b'Z'
+
+
+def stream_path(dir_path: pathlib.Path, cid: int) -> pathlib.Path:
+    """Returns the path of the stream file of the run with the input id."""
+    return dir_path / f'Differences_{cid}.bin'
+
+
+def _frames(stream_fp: BinaryIO,
+            decode: bool = True) -> Iterator[Tuple[str, List[Tuple[bytes, bytes]], int]]:
+    """
+    Yields the zone id, the records (kind and data) and the end offset of each complete
+    frame of the stream file.
+
+    :param stream_fp: The stream file opened for reading (after the magic)
+    :param decode: Whether to decompress the frames (no records are yielded otherwise)
+    """
+    size = os.fstat(stream_fp.fileno()).st_size
+    decompressor = zlib.decompressobj()
+    while True:
+        header = stream_fp.read(FRAME.size)
+        if len(header) < FRAME.size:
+            return
+        kind, zone_length, payload_length = FRAME.unpack(header)
+        zoneid = stream_fp.read(zone_length)
+        end = stream_fp.tell() + payload_length
+        if len(zoneid) < zone_length or end > size:
+            return
+        records = []
+        if decode:
+            if kind == SEGMENT:
+                decompressor = zlib.decompressobj()
+            try:
+                data = decompressor.decompress(stream_fp.read(payload_length))
+            except zlib.error:
+                return
+            offset = 0
+            while offset < len(data):
+                record_kind, length = RECORD.unpack_from(data, offset)
+                offset += RECORD.size
+                records.append((record_kind, data[offset:offset + length]))
+                offset += length
+        else:
+            stream_fp.seek(end)
+        yield zoneid.decode('utf-8'), records, end
+
+
+class DifferencesWriter:
+    """
+    Appends the differences of zones to a stream file.
+    """
+
+    def __init__(self, path: pathlib.Path) -> None:
+        """
+        Opens the stream file for appending, creating it if it does not exist.
+        The responses already in the file are reused.
+
+        :param path: The path to the stream file
+        """
+        self.path = path
+        self.responses = {}  # type: Dict[str, int]
+        self.compressor = zlib.compressobj()
+        self.segment = True
+        end = len(MAGIC)
+        if path.exists() and path.stat().st_size >= len(MAGIC):
+            with open(path, 'rb') as stream_fp:
+                if stream_fp.read(len(MAGIC)) != MAGIC:
+                    sys.exit(f'{path} is not a Differences stream file')
+                for _, records, end in _frames(stream_fp):
+                    for kind, data in records:
+                        if kind == RESPONSE:
+                            self.responses[data.decode('utf-8')] = len(self.responses)
+            self.stream_fp = open(path, 'r+b')
+            # Drop a partially written frame at the end
+            self.stream_fp.truncate(end)
+            self.stream_fp.seek(end)
+        else:
+            self.stream_fp = open(path, 'wb')
+            self.stream_fp.write(MAGIC)
+            self.stream_fp.flush()
+
+    def write(self,
+              zoneid: str,
+              differences: List[Dict[str, Any]],
+              model_cases: Dict[str, str]) -> None:
+        """
+        Appends the differences of the zone, along with the new responses, to the stream.
+
+        :param zoneid: The unique zone identifier
+        :param differences: The differences of the zone as in the Differences files
+        :param model_cases: Map from a query "name:type" to its Zen model case, if available
+        """
+        records = []
+        compact = []
+        for difference in differences:
+            groups = []
+            for group in difference["Groups"]:
+                response = encode_response(group["Response"])
+                if response not in self.responses:
+                    self.responses[response] = len(self.responses)
+                    data = response.encode('utf-8')
+                    records.append(RECORD.pack(RESPONSE, len(data)) + data)
+                groups.append([group["Server/s"], self.responses[response]])
+            compact.append([difference["Query Name"], difference["Query Type"], groups])
+        data = json.dumps([compact, model_cases], separators=(',', ':')).encode('utf-8')
+        records.append(RECORD.pack(ZONE, len(data)) + data)
+        payload = self.compressor.compress(b''.join(records)) + \
+            self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        zone = zoneid.encode('utf-8')
+        # A zone is written with a single write so that it is either complete or dropped
+        self.stream_fp.write(FRAME.pack(SEGMENT if self.segment else CONTINUATION,
+                                        len(zone), len(payload)) + zone + payload)
+        self.stream_fp.flush()
+        self.segment = False
+
+    def close(self) -> None:
+        """Closes the stream file."""
+        self.stream_fp.close()
+
+
+def read_differences(path: pathlib.Path) -> Iterator[Tuple[str,
+                                                           List[Dict[str, Any]],
+                                                           Dict[str, str]]]:
+    """
+    Yields the zone id, the differences in the Differences files format and the model
+    cases of each zone in the stream file, skipping the frames replaced later.
+
+    :param path: The path to the stream file
+    """
+    with open(path, 'rb') as stream_fp:
+        if stream_fp.read(len(MAGIC)) != MAGIC:
+            sys.exit(f'{path} is not a Differences stream file')
+        # The first pass only reads the frame headers to find the latest frame of each zone
+        latest = {}  # type: Dict[str, int]
+        for index, (zoneid, _, _) in enumerate(_frames(stream_fp, decode=False)):
+            latest[zoneid] = index
+        stream_fp.seek(len(MAGIC))
+        responses = []  # type: List[Union[str, List[str]]]
+        for index, (zoneid, records, _) in enumerate(_frames(stream_fp)):
+            for kind, data in records:
+                if kind == RESPONSE:
+                    responses.append(json.loads(data.decode('utf-8')))
+                elif kind == ZONE and latest[zoneid] == index:
+                    compact, model_cases = json.loads(data)
+                    differences = [{"Query Name": qname, "Query Type": qtype,
+                                    "Groups": [{"Server/s": servers,
+                                                "Response": responses[rid]}
+                                               for servers, rid in groups]}
+                                   for qname, qtype, groups in compact]
+                    yield zoneid, differences, model_cases
+
+
+def read_stream_directory(dir_path: pathlib.Path) -> Iterator[Tuple[str,
+                                                                   List[Dict[str, Any]],
+                                                                   Dict[str, str]]]:
+    """
+    Yields the zone id, the differences and the model cases of each zone in the
+    stream files of the directory.
+
+    :param dir_path: The path to the directory containing the stream files
+    """
+    for path in sorted(dir_path.glob(STREAM_PATTERN)):
+        yield from read_differences(path)
+
+
+def export_differences(dir_path: pathlib.Path) -> int:
+    """
+    Exports the differences of each zone in the stream files of the directory to the
+    Differences directory as JSON files and returns the number of zones.
+
+    :param dir_path: The path to the directory containing the stream files
+    """
+    # Imported here as the test runners import this module
+    from Scripts.test_with_valid_zone_files import DIFFERENCES
+    (dir_path / DIFFERENCES).mkdir(parents=True, exist_ok=True)
+    zones = 0
+    for zoneid, differences, _ in read_stream_directory(dir_path):
+        with open(dir_path / DIFFERENCES / (zoneid + '.json'), 'w') as difference_fp:
+            json.dump(differences, difference_fp, indent=2)
+        zones += 1
+    return zones
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter,
+                            description='Reads the Differences stream files of a directory.')
+    parser.add_argument('-path', metavar='DIRECTORY_PATH', default=SUPPRESS,
+                        help='The path to the directory containing the Differences stream '
+                        'files. (default: Results/ValidZoneFileTests/)')
+    parser.add_argument('-export', action="store_true",
+                        help='Export the differences of each zone to the Differences directory '
+                        'as JSON files.')
+    args = parser.parse_args()
+    if "path" in args:
+        directory_path = pathlib.Path(args.path)
+    else:
+        directory_path = pathlib.Path("Results/ValidZoneFileTests/")
+    if args.export:
+        print(f'Exported {export_differences(directory_path)} zones')
+    else:
+        total_zones = total_tests = 0
+        for _, zone_differences, _ in read_stream_directory(directory_path):
+            total_zones += 1
+            total_tests += len(zone_differences)
+        print(f'{total_zones} zones with {total_tests} tests with differences')
@@ -0,0 +1,123 @@
+"""
+Run-to-run comparison of the fingerprints.
+After triaging, the fingerprints of a directory are indexed in FingerprintIndex.json
+(a sibling of Fingerprints.json) by the fingerprint and by the stable identity of each
+test: the hash of the zone file contents (from the zone manifest, or the zone id if the
+ZoneFiles directory is not available) and the query. Comparing the index with the index of
+a baseline run reports the new and the disappeared fingerprints and, for the others, the
+tests that were added to or removed from them as FingerprintsDelta.json.
+"""
+
+#!/usr/bin/env python3
+
+import json
+import pathlib
+from typing import Any, Dict, List, Optional, Tuple
+
+from Scripts.fingerprints import FINGERPRINTS, atomic_json_dump
+from Scripts.test_with_valid_zone_files import ZONE_FILES
+from Scripts.zone_manifest import load_manifest
+
+FINGERPRINT_INDEX = "FingerprintIndex.json"
+FINGERPRINTS_DELTA = "FingerprintsDelta.json"
+
+
+def fingerprint_key(model_case: str, groups: List[List[str]]) -> str:
+    """Returns the fingerprint as a string, for example "E1 {bind,nsd} {knot}"."""
+    groups_str = ' '.join('{' + ','.join(sorted(grp)) + '}'
+                          for grp in sorted(sorted(grp) for grp in groups))
+    return f'{model_case} {groups_str}'
+
+
+def build_index(dir_path: pathlib.Path) -> Dict[str, Any]:
+    """
+    Returns the index of the fingerprints in the Fingerprints.json file of the directory.
+
+    :param dir_path: The path to the directory containing the Fingerprints.json file
+    """
+    with open(dir_path / FINGERPRINTS, 'r') as fingerprints_fp:
+        details = json.load(fingerprints_fp)["Details"]
+    hashes = {}  # type: Dict[str, str]
+    if (dir_path / ZONE_FILES).is_dir():
+        manifest = load_manifest(dir_path / ZONE_FILES)
+        hashes = {zoneid: entry["Hash"] for zoneid, entry in manifest.entries.items()}
+    fingerprints = {}  # type: Dict[str, List[str]]
+    tests = {}  # type: Dict[str, List[str]]
+    for model_case, groups_list in details.items():
+        for fingerprint in groups_list:
+            key = fingerprint_key(model_case if model_case != "Fingerprints" else '-',
+                                  fingerprint["Groups"])
+            identities = []
+            for zoneid, query_str in fingerprint["Tests"]:
+                identity = f'{hashes.get(zoneid, "zone-" + zoneid)}:{query_str}'
+                identities.append(identity)
+                tests[identity] = [zoneid, query_str]
+            fingerprints[key] = sorted(identities)
+    return {'Fingerprints': fingerprints, 'Tests': tests}
+
+
+def load_index(path: pathlib.Path) -> Dict[str, Any]:
+    """
+    Returns the fingerprint index at the path.
+
+    :param path: The path to the index file or to the directory containing it
+    """
+    if path.is_dir():
+        path = path / FINGERPRINT_INDEX
+    with open(path, 'r') as index_fp:
+        return json.load(index_fp)
+
+
+def compare_indexes(baseline: Dict[str, Any], current: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Returns the new, the disappeared and the changed fingerprints of the current index
+    compared to the baseline index.
+
+    :param baseline: The fingerprint index of the baseline run
+    :param current: The fingerprint index of the current run
+    """
+    def tests(index: Dict[str, Any], identities: List[str]) -> List[List[str]]:
+        return sorted(index['Tests'][identity] for identity in identities)
+
+    base_fps, current_fps = baseline['Fingerprints'], current['Fingerprints']
+    new = []
+    changed = []
+    for key in sorted(current_fps, key=lambda fp: (-len(current_fps[fp]), fp)):
+        if key not in base_fps:
+            new.append({'Fingerprint': key, 'Count': len(current_fps[key]),
+                        'Tests': tests(current, current_fps[key])})
+            continue
+        added = sorted(set(current_fps[key]) - set(base_fps[key]))
+        removed = sorted(set(base_fps[key]) - set(current_fps[key]))
+        if added or removed:
+            changed.append({'Fingerprint': key, 'Baseline Count': len(base_fps[key]),
+                            'Count': len(current_fps[key]),
+                            'Added': tests(current, added), 'Removed': tests(baseline, removed)})
+    disappeared = [{'Fingerprint': key, 'Baseline Count': len(base_fps[key]),
+                    'Tests': tests(baseline, base_fps[key])}
+                   for key in sorted(base_fps, key=lambda fp: (-len(base_fps[fp]), fp))
+                   if key not in current_fps]
+    summary = [f'+ {fp["Count"]} {fp["Fingerprint"]}' for fp in new]
+    summary += [f'- {fp["Baseline Count"]} {fp["Fingerprint"]}' for fp in disappeared]
+    summary += [f'~ {fp["Baseline Count"]} -> {fp["Count"]} {fp["Fingerprint"]}'
+                for fp in changed]
+    return {'Summary': summary, 'New': new, 'Disappeared': disappeared, 'Changed': changed}
+
+
+def fingerprint_delta(dir_path: pathlib.Path,
+                      baseline_path: Optional[pathlib.Path] = None) -> Tuple[int, int, int]:
+    """
+    Indexes the fingerprints of the directory and, if a baseline is given, outputs the
+    delta to the baseline as the FingerprintsDelta.json file.
+    Returns the number of new, disappeared and changed fingerprints.
+
+    :param dir_path: The path to the directory containing the Fingerprints.json file
+    :param baseline_path: The path to the baseline index file or its directory
+    """
+    current = build_index(dir_path)
+    atomic_json_dump(current, dir_path / FINGERPRINT_INDEX, separators=(',', ':'))
+    if baseline_path is None:
+        return 0, 0, 0
+    delta = compare_indexes(load_index(baseline_path), current)
+    atomic_json_dump(delta, dir_path / FINGERPRINTS_DELTA, indent=2)
+    return len(delta['New']), len(delta['Disappeared']), len(delta['Changed'])
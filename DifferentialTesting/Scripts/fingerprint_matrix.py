@@ -0,0 +1,272 @@
+"""
+Vectorized fingerprints of the tests that resulted in differences (requires NumPy).
+Each test is encoded as a row of the response class of every implementation, where the
+response class is the index of the implementation's group in that test (-1 if the
+implementation was not tested). The classes are numbered in the order of the first
+implementation (column) in each group, so that tests with the same implementation
+groups have identical rows. The tests are then grouped by fingerprint with a single
+`numpy.unique` over the rows and the model case ids, and the per-implementation
+disagreement rates and the pairwise agreement matrix are computed in bulk.
+A row can not encode an implementation in more than one group, which happens when only one
+implementation is tested and the group of the expected response also lists it; such tests
+are kept aside with their fingerprints from fingerprints.py instead, so that the grouped
+fingerprints are the same as without the matrix. They are not in the statistics.
+"""
+
+#!/usr/bin/env python3
+
+import json
+import pathlib
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, NamedTuple, Set, Tuple
+
+import numpy as np
+
+from Implementations.registry import IMPLEMENTATIONS
+from Scripts.fingerprints import (Fingerprint, Test, atomic_json_dump,
+                                  fingerprint_differences)
+from Scripts.model_cases import ModelCaseIndex
+
+STATISTICS = "Statistics.json"
+UNTESTED = -1
+
+
+class FingerprintMatrix(NamedTuple):
+    """
+    servers: The implementation of each column
+    classes: The response class of each implementation (column) for each test (row)
+    case_names: The model cases ("-" if not available)
+    cases: The index of the model case of each test in case_names
+    tests: The zone id and query of each test
+    fallback: The fingerprint and the test of each test with an implementation in more
+              than one group, which are not in the matrix
+    """
+    servers: List[str]
+    classes: np.ndarray
+    case_names: List[str]
+    cases: np.ndarray
+    tests: List[Test]
+    fallback: List[Tuple[Fingerprint, Test]]
+
+
+def encode_differences(zones: Iterable[Tuple[str, List[Dict[str, Any]], Dict[str, str]]]
+                       ) -> FingerprintMatrix:
+    """
+    Returns the fingerprint matrix of the tests of the input zones.
+
+    :param zones: The zone id, the differences and the model cases of each zone
+    """
+    columns = {impl.name: index for index, impl in enumerate(IMPLEMENTATIONS)}
+    case_ids = {}  # type: Dict[str, int]
+    rows = []  # type: List[List[int]]
+    cases = []  # type: List[int]
+    tests = []  # type: List[Test]
+    fallback = []  # type: List[Tuple[Fingerprint, Test]]
+    for zoneid, differences, model_cases in zones:
+        for (model_case, groups), query_str in fingerprint_differences(differences,
+                                                                       model_cases):
+            servers = [server for group in groups for server in group]
+            if len(servers) != len(set(servers)):
+                fallback.append(((model_case, groups), (zoneid, query_str)))
+                continue
+            row = [UNTESTED] * len(columns)
+            for group_class, group in enumerate(groups):
+                for server in group:
+                    if server not in columns:
+                        columns[server] = len(columns)
+                        row.append(UNTESTED)
+                    row[columns[server]] = group_class
+            rows.append(row)
+            cases.append(case_ids.setdefault(model_case, len(case_ids)))
+            tests.append((zoneid, query_str))
+    classes = np.full((len(rows), len(columns)), UNTESTED, dtype=np.int8)
+    for index, row in enumerate(rows):
+        classes[index, :len(row)] = row
+    return FingerprintMatrix(list(columns), canonical_classes(classes), list(case_ids),
+                             np.array(cases, dtype=np.int32), tests, fallback)
+
+
+def canonical_classes(classes: np.ndarray) -> np.ndarray:
+    """
+    Renumbers the response classes of each row in the order of their first column.
+
+    :param classes: The response classes (tests x implementations)
+    """
+    if not classes.size:
+        return classes
+    num_classes = int(classes.max()) + 1
+    columns = classes.shape[1]
+    # The first column of each class in each row (columns if the class is absent)
+    first = np.full((classes.shape[0], num_classes), columns, dtype=np.int32)
+    for group_class in range(num_classes):
+        present = classes == group_class
+        first[:, group_class] = np.where(present.any(axis=1), present.argmax(axis=1), columns)
+    order = np.argsort(first, axis=1, kind='stable')
+    rank = np.empty_like(order)
+    np.put_along_axis(rank, order, np.arange(num_classes)[None, :].repeat(len(order), axis=0),
+                      axis=1)
+    renumbered = np.take_along_axis(rank, np.maximum(classes, 0).astype(np.intp), axis=1)
+    return np.where(classes == UNTESTED, UNTESTED, renumbered).astype(np.int8)
+
+
+def merge_matrices(matrices: List[FingerprintMatrix]) -> FingerprintMatrix:
+    """
+    Returns the fingerprint matrix with the tests of all the input matrices.
+
+    :param matrices: The fingerprint matrices (for example, of the shards of a directory)
+    """
+    servers = [impl.name for impl in IMPLEMENTATIONS]
+    case_names = []  # type: List[str]
+    for matrix in matrices:
+        servers += [server for server in matrix.servers if server not in servers]
+        case_names += [case for case in matrix.case_names if case not in case_names]
+    columns = {server: index for index, server in enumerate(servers)}
+    case_ids = {case: index for index, case in enumerate(case_names)}
+    classes = []
+    cases = []
+    tests = []  # type: List[Test]
+    fallback = []  # type: List[Tuple[Fingerprint, Test]]
+    for matrix in matrices:
+        fallback += matrix.fallback
+        remapped = np.full((len(matrix.tests), len(servers)), UNTESTED, dtype=np.int8)
+        remapped[:, [columns[server] for server in matrix.servers]] = matrix.classes
+        classes.append(remapped)
+        cases.append(np.array([case_ids[case] for case in matrix.case_names],
+                              dtype=np.int32)[matrix.cases])
+        tests += matrix.tests
+    if not classes:
+        return FingerprintMatrix(servers, np.empty((0, len(servers)), dtype=np.int8), [],
+                                 np.empty(0, dtype=np.int32), [], fallback)
+    return FingerprintMatrix(servers, canonical_classes(np.concatenate(classes)), case_names,
+                             np.concatenate(cases), tests, fallback)
+
+
+def group_fingerprints(matrix: FingerprintMatrix) -> Dict[Fingerprint, List[Test]]:
+    """
+    Groups the tests of the matrix with the same model case and response classes, along
+    with the tests kept aside by their fingerprints.
+    Returns the map from a fingerprint to the tests with that fingerprint.
+
+    :param matrix: The fingerprint matrix
+    """
+    vectors = defaultdict(list)  # type: Dict[Fingerprint, List[Test]]
+    for fingerprint, test in matrix.fallback:
+        vectors[fingerprint].append(test)
+    if not matrix.tests:
+        return vectors
+    # The classes are shifted by one so that the untested class is not negative
+    keys = np.column_stack([matrix.cases, matrix.classes.astype(np.int64) + 1])
+    # Pack each row into a single integer (if it fits) as unique over scalars is much faster
+    base = int(keys[:, 1:].max()) + 1
+    if (int(keys[:, 0].max()) + 1) * base ** (keys.shape[1] - 1) < 2 ** 63:
+        packed = np.zeros(len(keys), dtype=np.int64)
+        for column in range(keys.shape[1]):
+            packed = packed * base + keys[:, column]
+        _, first, inverse, counts = np.unique(packed, return_index=True, return_inverse=True,
+                                              return_counts=True)
+        unique_keys = keys[first]
+    else:
+        unique_keys, inverse, counts = np.unique(keys, axis=0, return_inverse=True,
+                                                 return_counts=True)
+    order = np.argsort(inverse.ravel(), kind='stable')
+    boundaries = np.cumsum(counts)[:-1]
+    for key, test_indices in zip(unique_keys, np.split(order, boundaries)):
+        groups = defaultdict(list)  # type: Dict[int, List[str]]
+        for server, group_class in zip(matrix.servers, key[1:] - 1):
+            if group_class != UNTESTED:
+                groups[int(group_class)].append(server)
+        fingerprint = (matrix.case_names[key[0]],
+                       tuple(sorted(tuple(sorted(grp)) for grp in groups.values())))
+        vectors[fingerprint].extend(matrix.tests[index] for index in test_indices)
+    return vectors
+
+
+def disagreement_rates(matrix: FingerprintMatrix) -> Dict[str, Dict[str, Any]]:
+    """
+    Returns for each implementation the number of tests it was tested in and the
+    fraction of those in which its response differs from the majority response
+    (the response of the largest group, the first one in case of a tie).
+
+    :param matrix: The fingerprint matrix
+    """
+    classes = matrix.classes
+    num_classes = int(classes.max()) + 1 if classes.size else 0
+    sizes = np.stack([(classes == group_class).sum(axis=1)
+                      for group_class in range(num_classes)], axis=1) \
+        if num_classes else np.zeros((len(classes), 1), dtype=np.int64)
+    majority = sizes.argmax(axis=1)
+    tested = classes != UNTESTED
+    disagrees = tested & (classes != majority[:, None])
+    tested_counts = tested.sum(axis=0)
+    disagree_counts = disagrees.sum(axis=0)
+    rates = {}
+    for index, server in enumerate(matrix.servers):
+        rates[server] = {
+            'Tests': int(tested_counts[index]),
+            'Disagreements': int(disagree_counts[index]),
+            'Rate': float(disagree_counts[index] / tested_counts[index])
+                    if tested_counts[index] else 0.0
+        }
+    return rates
+
+
+def pairwise_agreement(matrix: FingerprintMatrix) -> Dict[str, Dict[str, float]]:
+    """
+    Returns for each pair of implementations the fraction of the tests with both
+    implementations in which they have the same response.
+
+    :param matrix: The fingerprint matrix
+    """
+    classes = matrix.classes
+    tested = classes != UNTESTED
+    agreement = {}  # type: Dict[str, Dict[str, float]]
+    for index, server in enumerate(matrix.servers):
+        both = tested[:, index:index + 1] & tested
+        same = both & (classes[:, index:index + 1] == classes)
+        both_counts = both.sum(axis=0)
+        same_counts = same.sum(axis=0)
+        agreement[server] = {
+            other: float(same_counts[other_index] / both_counts[other_index])
+            for other_index, other in enumerate(matrix.servers) if both_counts[other_index]
+        }
+    return agreement
+
+
+def encode_shard(shard: List[pathlib.Path],
+                 dir_path: pathlib.Path) -> Tuple[FingerprintMatrix, Set[bool]]:
+    """
+    Returns the fingerprint matrix of the tests in the input Differences files and whether
+    their zones have model cases (True, False or both), which are looked up a zone at a
+    time in the model case index of the directory.
+
+    :param shard: The Differences files to encode
+    :param dir_path: The path to the directory containing the Differences directory
+    """
+    index = ModelCaseIndex(dir_path)
+    has_model_cases = set()  # type: Set[bool]
+
+    def zones() -> Iterable[Tuple[str, List[Dict[str, Any]], Dict[str, str]]]:
+        for diff in shard:
+            model_cases = index.get(diff.stem)
+            has_model_cases.add(bool(model_cases))
+            with open(diff, 'r') as diff_fp:
+                yield diff.stem, json.load(diff_fp), model_cases
+    matrix = encode_differences(zones())
+    index.close()
+    return matrix, has_model_cases
+
+
+def write_statistics(dir_path: pathlib.Path, matrix: FingerprintMatrix) -> None:
+    """
+    Outputs the disagreement rates and the pairwise agreement of the implementations
+    as the Statistics.json file.
+
+    :param dir_path: The path to the directory containing the Differences directory
+    :param matrix: The fingerprint matrix
+    """
+    statistics = {
+        'Tests': len(matrix.tests),
+        'Disagreement': disagreement_rates(matrix),
+        'Agreement': pairwise_agreement(matrix)
+    }
+    atomic_json_dump(statistics, dir_path / STATISTICS, indent=2)
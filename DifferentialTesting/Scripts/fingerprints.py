@@ -0,0 +1,314 @@
+"""
+Fingerprints of the tests that resulted in differences and the persistent fingerprint
+state used for incremental triaging.
+The state (FingerprintsState.json, a sibling of the Differences directory) stores the
+fingerprinted tests of each Differences file along with the file size and modification
+time, so that only new or modified Differences files are fingerprinted again and the
+Fingerprints.json file can be refreshed while the tests are still running.
+"""
+
+#!/usr/bin/env python3
+
+import fcntl
+import json
+import os
+import pathlib
+import sqlite3
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# A fingerprint is the model case ("-" if not available) and the implementation groups,
+# each group as a sorted tuple of implementations and the groups in sorted order
+Fingerprint = Tuple[str, Tuple[Tuple[str, ...], ...]]
+# A test is identified by the zone id and the query as "name:type"
+Test = Tuple[str, str]
+
+FINGERPRINTS = "Fingerprints.json"
+STATE = "FingerprintsState.json"
+
+
+def fingerprint_differences(differences: List[Dict[str, Any]],
+                            model_cases: Dict[str, str]) -> List[Tuple[Fingerprint, str]]:
+    """
+    Returns the fingerprint of each query of a zone that resulted in a difference.
+
+    :param differences: The differences of the zone as written to the Differences directory
+    :param model_cases: Map from a query "name:type" to its Zen model case, if available
+    """
+    fingerprinted = []
+    for difference in differences:
+        query_str = difference["Query Name"] + \
+            ":" + difference["Query Type"]
+        groups = []
+        for group in difference["Groups"]:
+            servers = group["Server/s"].strip().split()
+            if servers:
+                groups.append(tuple(sorted(servers)))
+        if len(groups) > 1:
+            fingerprinted.append(((model_cases.get(query_str, "-"), tuple(sorted(groups))),
+                                  query_str))
+    return fingerprinted
+
+
+def atomic_json_dump(obj: Any, path: pathlib.Path, **kwargs: Any) -> None:
+    """Writes the object as JSON to a temporary file and renames it to the path."""
+    tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    with open(tmp_path, 'w') as tmp_fp:
+        json.dump(obj, tmp_fp, **kwargs)
+    os.replace(tmp_path, path)
+
+
+def write_fingerprints(dir_path: pathlib.Path, vectors: Dict[Fingerprint, List[Test]]) -> None:
+    """
+    Outputs the fingerprints and their tests as the Fingerprints.json file in a single
+    pass over the sorted fingerprints. The file is replaced atomically.
+
+    :param dir_path: The path to the directory containing the Differences directory
+    :param vectors: Map from a fingerprint to the tests with that fingerprint
+    """
+    summary = []
+    output_json = defaultdict(list)  # type: Dict[str, List[Dict[str, Any]]]
+    for model_case, groups in sorted(vectors):
+        tests = sorted(set(vectors[(model_case, groups)]))
+        sorted_groups = sorted(groups, key=len, reverse=True)
+        groups_summary = ''
+        for grp in sorted_groups:
+            groups_summary += f' {{{",".join(grp)}}} '
+        if model_case != '-':
+            summary.append(f'{model_case} {len(tests)} {groups_summary}')
+        else:
+            summary.append(f'{len(tests)} {groups_summary}')
+        output_json[model_case if model_case != '-' else "Fingerprints"].append({
+            'Groups': [list(grp) for grp in sorted_groups],
+            'Count': len(tests),
+            'Tests': tests
+        })
+    output = {}  # type: Dict[str, Any]
+    output["Summary"] = summary
+    output["Details"] = output_json
+    atomic_json_dump(output, dir_path / FINGERPRINTS, indent=2)
+
+
+def _fingerprint_key(fingerprint: Fingerprint) -> str:
+    return json.dumps(fingerprint, separators=(',', ':'))
+
+
+def _key_fingerprint(key: str) -> Fingerprint:
+    model_case, groups = json.loads(key)
+    return model_case, tuple(tuple(grp) for grp in groups)
+
+
+class FingerprintSpill:
+    """
+    On-disk (SQLite) store of the distinct tests of each fingerprint, so that the tests are
+    grouped without holding them in memory. Each shard of the Differences files can be
+    fingerprinted into its own spill, which are then merged into one.
+    """
+
+    def __init__(self, path: pathlib.Path) -> None:
+        """
+        :param path: The path to the spill database, created if it does not exist
+        """
+        self.path = path
+        self.conn = sqlite3.connect(str(path))
+        self.conn.execute('PRAGMA journal_mode=OFF')
+        self.conn.execute('PRAGMA synchronous=OFF')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS tests (fingerprint TEXT NOT NULL, '
+                          'zoneid TEXT NOT NULL, query TEXT NOT NULL, '
+                          'PRIMARY KEY (fingerprint, zoneid, query)) WITHOUT ROWID')
+
+    def add(self, zoneid: str, fingerprinted: List[Tuple[Fingerprint, str]]) -> None:
+        """Adds the fingerprinted queries of the zone."""
+        self.conn.executemany('INSERT OR IGNORE INTO tests VALUES (?, ?, ?)',
+                              [(_fingerprint_key(fingerprint), zoneid, query_str)
+                               for fingerprint, query_str in fingerprinted])
+
+    def merge(self, other: pathlib.Path) -> None:
+        """Adds the tests of another spill database."""
+        self.conn.commit()
+        self.conn.execute('ATTACH DATABASE ? AS other', (str(other),))
+        self.conn.execute('INSERT OR IGNORE INTO tests SELECT * FROM other.tests')
+        self.conn.commit()
+        self.conn.execute('DETACH DATABASE other')
+
+    def counts(self) -> Dict[Fingerprint, int]:
+        """Returns the number of tests of each fingerprint."""
+        self.conn.commit()
+        return {_key_fingerprint(key): count for key, count in self.conn.execute(
+            'SELECT fingerprint, COUNT(*) FROM tests GROUP BY fingerprint')}
+
+    def tests(self, fingerprint: Fingerprint) -> Iterator[Test]:
+        """Yields the tests of the fingerprint in sorted order."""
+        yield from self.conn.execute('SELECT zoneid, query FROM tests WHERE fingerprint = ? '
+                                     'ORDER BY zoneid, query', (_fingerprint_key(fingerprint),))
+
+    def close(self) -> None:
+        """Commits and closes the spill database."""
+        self.conn.commit()
+        self.conn.close()
+
+
+def _indented(value: Any, level: int) -> str:
+    """Returns the value as JSON (indent 2) to be written at the nesting level."""
+    return json.dumps(value, indent=2).replace('\n', '\n' + '  ' * level)
+
+
+def write_spilled_fingerprints(dir_path: pathlib.Path, spill: FingerprintSpill) -> None:
+    """
+    Outputs the fingerprints and their tests in the spill as the Fingerprints.json file,
+    the same as write_fingerprints, streaming the tests of each fingerprint from the spill
+    so that only the fingerprints and their counts are in memory. The file is replaced
+    atomically.
+
+    :param dir_path: The path to the directory containing the Differences directory
+    :param spill: The spill with the tests of each fingerprint
+    """
+    counts = spill.counts()
+    summary = []
+    for model_case, groups in sorted(counts):
+        groups_summary = ''.join(f' {{{",".join(grp)}}} '
+                                 for grp in sorted(groups, key=len, reverse=True))
+        count = counts[(model_case, groups)]
+        summary.append(f'{model_case} {count} {groups_summary}' if model_case != '-'
+                       else f'{count} {groups_summary}')
+    path = dir_path / FINGERPRINTS
+    tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    with open(tmp_path, 'w') as output_fp:
+        output_fp.write('{\n  "Summary": ' + _indented(summary, 1) + ',\n  "Details": ')
+        if not counts:
+            output_fp.write('{}')
+        current = None  # type: Optional[str]
+        for model_case, groups in sorted(counts):
+            key = model_case if model_case != '-' else "Fingerprints"
+            if current is None:
+                output_fp.write('{\n    ' + json.dumps(key) + ': [\n')
+            elif key != current:
+                output_fp.write('\n    ],\n    ' + json.dumps(key) + ': [\n')
+            else:
+                output_fp.write(',\n')
+            current = key
+            sorted_groups = [list(grp) for grp in sorted(groups, key=len, reverse=True)]
+            output_fp.write('      {\n        "Groups": ' + _indented(sorted_groups, 4) +
+                            ',\n        "Count": ' + str(counts[(model_case, groups)]) +
+                            ',\n        "Tests": [')
+            for index, test in enumerate(spill.tests((model_case, groups))):
+                output_fp.write((',\n' if index else '\n') + '          ' +
+                                _indented(list(test), 5))
+            output_fp.write('\n        ]\n      }')
+        if counts:
+            output_fp.write('\n    ]\n  }')
+        output_fp.write('\n}')
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def file_lock(lock_path: pathlib.Path) -> Iterator[None]:
+    """
+    Holds an exclusive lock on the lock file while the context is active.
+    The lock is released by the kernel when the holder exits, even if it is killed, so the
+    lock file is left in place and never removed.
+    """
+    with open(lock_path, 'a') as lock_fp:
+        fcntl.flock(lock_fp, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_fp, fcntl.LOCK_UN)
+
+
+class FingerprintState:
+    """
+    The persistent fingerprint state of a directory with the Differences directory.
+    Zone updates are recorded in memory and written (merged with the updates from other
+    runs sharing the directory) along with a refreshed Fingerprints.json at most once
+    every `interval` seconds and on `flush`.
+    """
+
+    def __init__(self, dir_path: pathlib.Path, interval: float = 10) -> None:
+        """
+        :param dir_path: The path to the directory containing the Differences directory
+        :param interval: The minimum number of seconds between two writes
+        """
+        self.dir_path = dir_path
+        self.path = dir_path / STATE
+        self.interval = interval
+        self.zones = {}  # type: Dict[str, Dict[str, Any]]
+        self.pending = {}  # type: Dict[str, Optional[Dict[str, Any]]]
+        self.last_flush = time.time()
+
+    def load(self) -> None:
+        """Loads the state written by the last flush, if any."""
+        self.zones = {}
+        if self.path.exists():
+            try:
+                with open(self.path, 'r') as state_fp:
+                    self.zones = json.load(state_fp)
+            except ValueError:
+                # A corrupt state is rebuilt from the Differences files
+                self.zones = {}
+
+    def is_current(self, diff_path: pathlib.Path) -> bool:
+        """Returns whether the state of the Differences file is up to date."""
+        entry = self.pending.get(diff_path.stem, self.zones.get(diff_path.stem))
+        stat = diff_path.stat()
+        return bool(entry) and entry["Size"] == stat.st_size and \
+            entry["MTime"] == stat.st_mtime_ns
+
+    def record(self,
+               diff_path: pathlib.Path,
+               differences: List[Dict[str, Any]],
+               model_cases: Dict[str, str]) -> None:
+        """
+        Records the fingerprints of the tests in a Differences file.
+
+        :param diff_path: The path to the Differences file of the zone
+        :param differences: The differences in the file
+        :param model_cases: Map from a query "name:type" to its Zen model case, if available
+        """
+        stat = diff_path.stat()
+        self.pending[diff_path.stem] = {
+            "Size": stat.st_size,
+            "MTime": stat.st_mtime_ns,
+            "Tests": [[model_case, [list(grp) for grp in groups], query_str] for
+                      (model_case, groups), query_str in
+                      fingerprint_differences(differences, model_cases)]
+        }
+        if time.time() - self.last_flush >= self.interval:
+            self.flush()
+
+    def remove(self, zoneid: str) -> None:
+        """Records that the Differences file of the zone was removed."""
+        self.pending[zoneid] = None
+
+    def vectors(self) -> Dict[Fingerprint, List[Test]]:
+        """Returns the map from a fingerprint to the tests with that fingerprint."""
+        vectors = defaultdict(list)  # type: Dict[Fingerprint, List[Test]]
+        for zoneid, entry in self.zones.items():
+            for model_case, groups, query_str in entry["Tests"]:
+                fingerprint = (model_case, tuple(tuple(grp) for grp in groups))
+                vectors[fingerprint].append((zoneid, query_str))
+        return vectors
+
+    def flush(self, refresh: bool = False) -> None:
+        """
+        Writes the recorded updates to the state and refreshes Fingerprints.json.
+
+        :param refresh: Whether to refresh Fingerprints.json even if there are no updates
+        """
+        if not self.pending and not refresh:
+            return
+        with file_lock(self.path.with_name(STATE + '.lock')):
+            # Another run sharing the directory might have written the state meanwhile
+            self.load()
+            for zoneid, entry in self.pending.items():
+                if entry is None:
+                    self.zones.pop(zoneid, None)
+                else:
+                    self.zones[zoneid] = entry
+            if self.pending:
+                atomic_json_dump(self.zones, self.path, separators=(',', ':'))
+            write_fingerprints(self.dir_path, self.vectors())
+        self.pending = {}
+        self.last_flush = time.time()
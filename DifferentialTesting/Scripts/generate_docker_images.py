@@ -1,12 +1,17 @@
 """
 Builds docker images for the implementations.
-Creates and prints logs to the image_generation_log.txt file.
+Creates and prints logs to the image_generation_log.txt file and records the time taken by
+each build in the image_build_times.json file.
+The images are built a few at a time; an image that is up to date (built from the current
+Dockerfile, build arguments and copied files) is not built again.
 
-usage: generate_docker_images.py [-h] [-l] [-b] [-n] [-k] [-p] [-c] [-y] [-m] [-t] [-e]
+usage: python3 -m Scripts.generate_docker_images [-h] [-l] [-j JOBS] [-force] [-b] [-n] [-k] [-p] [-c] [-y] [-m] [-t] [-e]
 
 optional arguments:
   -h, --help    show this help message and exit
-  -l, --latest  Build the images using latest code for all implementations. (default: False)
+  -l, --latest  Build the images using latest code. (default: False)
+  -j JOBS       The maximum number of images built concurrently. (default: 3)
+  -force        Build the images even if they are up to date. (default: False)
   -b            Disable Bind. (default: False)
   -n            Disable Nsd. (default: False)
   -k            Disable Knot. (default: False)
@@ -19,51 +24,13 @@ optional arguments:
 """
 #!/usr/bin/env python3
 
-import os
-import platform
-import subprocess
+import sys
 import time
 from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser
 from datetime import datetime
-from multiprocessing import Process
-from typing import TextIO
-
-
-def build_docker_images(implementation: str, latest: bool, log_fp: TextIO) -> None:
-    """
-    Builds the docker image for the input implementation.
-    Expects a directory with the implementation name (first letter capitalized) in the
-    "Implementations" directory with a Dockerfile in the directory.
-
-    :param cmd: The name of the implementation to the build the image for.
-    :param latest: Whether to build the image using latest code.
-    :param log_fp: Log file pointer.
-    """
-    if latest:
-        implementation += ':latest'
-        run_cmd = ['docker', 'build', '-t', implementation + ":latest", '-f',
-                   implementation.capitalize() + "/Dockerfile", '--no-cache',
-                   '--build-arg', 'latest=true', '.']
-    else:
-        run_cmd = ['docker', 'build', '-t',
-                   implementation + ":oct", '-f', implementation.capitalize() + "/Dockerfile", '.']
-    log_fp.write(f'{datetime.now()}\tBuilding image for {implementation}.\n')
-    begin_time = time.time()
-    if platform.system() == 'Linux':
-        my_env = os.environ.copy()
-        my_env['DOCKER_BUILDKIT'] = '1'
-        cmd_output = subprocess.run(
-            run_cmd, env=my_env, stdout=subprocess.PIPE, cwd='Implementations/', check=True)
-    else:
-        cmd_output = subprocess.run(
-            run_cmd, stdout=subprocess.PIPE, cwd='Implementations/', check=True)
-    if cmd_output.returncode != 0:
-        log_fp.write(
-            f'{datetime.now()}\tError in building image for {implementation}.\n')
-    else:
-        log_fp.write(
-            f'{datetime.now()}\tTime to build {implementation} image: {time.time()-begin_time}s\n')
 
+from Implementations.registry import add_disable_arguments, get_ports
+from Scripts.image_builds import DEFAULT_JOBS, BuildScheduler, implementation_build
 
 if __name__ == '__main__':
     parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter,
@@ -71,48 +38,18 @@ if __name__ == '__main__':
                             ' (check image_generation_log.txt for logs)')
     parser.add_argument(
         '-l', '--latest', help='Build the images using latest code.', action="store_true")
-    parser.add_argument('-b', help='Disable Bind.', action="store_true")
-    parser.add_argument('-n', help='Disable Nsd.', action="store_true")
-    parser.add_argument('-k', help='Disable Knot.', action="store_true")
-    parser.add_argument('-p', help='Disable PowerDns.', action="store_true")
-    parser.add_argument('-c', help='Disable CoreDns.', action="store_true")
-    parser.add_argument('-y', help='Disable Yadifa.', action="store_true")
-    parser.add_argument('-m', help='Disable MaraDns.', action="store_true")
-    parser.add_argument('-t', help='Disable TrustDns.', action="store_true")
-    parser.add_argument('-e', help='Disable Technitium.', action="store_true")
+    parser.add_argument('-j', metavar='JOBS', type=int, default=DEFAULT_JOBS,
+                        help='The maximum number of images built concurrently.')
+    parser.add_argument('-force', action="store_true",
+                        help='Build the images even if they are up to date.')
+    add_disable_arguments(parser)
     args = parser.parse_args()
-    cmds = []
-    if not args.b:
-        cmds.append("bind")
-    if not args.k:
-        cmds.append("knot")
-    if not args.n:
-        cmds.append("nsd")
-    if not args.p:
-        cmds.append("powerdns")
-    if not args.c:
-        cmds.append("coredns")
-    if not args.y:
-        cmds.append("yadifa")
-    if not args.m:
-        cmds.append("maradns")
-    if not args.t:
-        cmds.append("trustdns")
-    if not args.e:
-        cmds.append("technitium")
-    processPool = []
-    i = 0
-    j = len(cmds)
+    builds = [implementation_build(impl, args.latest)
+              for impl, (check, _) in get_ports(args).items() if check]
     start = time.time()
     with open('image_generation_log.txt', 'w', 1) as log:
-        while j:
-            processPool.append(
-                Process(target=build_docker_images, args=(cmds[i], args.latest, log)))
-            i = i + 1
-            j = j - 1
-        for t in processPool:
-            t.start()
-        for t in processPool:
-            t.join()
+        failed = BuildScheduler(args.j, log, args.force).run(builds)
         log.write(
             f'{datetime.now()}\tTime taken to build all images: {time.time()-start}s\n')
+    if failed:
+        sys.exit('Error in building the images: ' + ', '.join(failed))
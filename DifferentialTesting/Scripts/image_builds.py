@@ -0,0 +1,260 @@
+"""
+Builds docker images with a bounded number of concurrent builds.
+Each image is labelled with a hash of its Dockerfile, its build arguments and the files the
+Dockerfile copies into the image; an image whose label matches the current hash is up to
+date and is not built again. Images built with the latest code of an implementation are
+hashed with the build date as well, as the code they fetch changes without the Dockerfile
+changing, so they are rebuilt (without the docker cache) at most once a day.
+The time taken by each build is written to the log file and to the image_build_times.json
+file.
+The images imported from a bundle (see image_bundle.py) are listed with their IDs in the
+image_manifest.json file; while it exists, the containers of a listed image are started
+only if the image ID matches. A listed image that is built again is no longer listed.
+"""
+
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import os
+import pathlib
+import platform
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, TextIO, Tuple
+
+from Implementations.registry import REGISTRY
+from Scripts.fingerprints import atomic_json_dump
+
+HASH_LABEL = 'ferret.build-hash'
+BUILD_TIMES = 'image_build_times.json'
+DEFAULT_JOBS = 3
+IMAGE_MANIFEST = 'image_manifest.json'
+# The images whose IDs were found to match the image manifest
+VERIFIED_IMAGES = set()  # type: Set[str]
+
+
+class ImageBuild(NamedTuple):
+    """
+    A docker image and how to build it.
+    """
+    image: str
+    dockerfile: str
+    context: str
+    build_args: Tuple[Tuple[str, str], ...] = ()
+    latest: bool = False
+
+
+def implementation_build(implementation: str, latest: bool) -> ImageBuild:
+    """
+    Returns the build of the image for the input implementation, which uses the Dockerfile
+    in the implementation's directory (as declared in the implementations registry) in the
+    "Implementations" directory.
+
+    :param implementation: The name of the implementation
+    :param latest: Whether to build the image using latest code
+    """
+    dockerfile = REGISTRY[implementation].directory + "/Dockerfile"
+    if latest:
+        return ImageBuild(implementation + ":latest", dockerfile, 'Implementations/',
+                          (('latest', 'true'),), True)
+    return ImageBuild(implementation + ":oct", dockerfile, 'Implementations/')
+
+
+GROOT_BUILD = ImageBuild("groot:ferret", "GRoot/Dockerfile", '.')
+
+
+def _copied_sources(context: pathlib.Path, dockerfile: pathlib.Path) -> Iterator[pathlib.Path]:
+    """Yields the files of the build context copied by the COPY and ADD instructions."""
+    with open(dockerfile, 'r') as dockerfile_fp:
+        for line in dockerfile_fp:
+            tokens = line.split()
+            if len(tokens) < 3 or tokens[0].upper() not in ('COPY', 'ADD'):
+                continue
+            for source in [token for token in tokens[1:-1] if not token.startswith('--')]:
+                if '://' in source:
+                    continue
+                for path in sorted(context.glob(source)):
+                    if path.is_dir():
+                        yield from sorted(p for p in path.rglob('*') if p.is_file())
+                    elif path.is_file():
+                        yield path
+
+
+def build_hash(build: ImageBuild) -> str:
+    """
+    Returns the content hash of the build.
+
+    :param build: The image build
+    """
+    context = pathlib.Path(build.context)
+    dockerfile = context / build.dockerfile
+    digest = hashlib.sha256()
+    digest.update(build.image.encode())
+    digest.update(json.dumps(sorted(build.build_args)).encode())
+    if build.latest:
+        digest.update(date.today().isoformat().encode())
+    digest.update(dockerfile.read_bytes())
+    for source in _copied_sources(context, dockerfile):
+        digest.update(str(source.relative_to(context)).encode())
+        digest.update(source.read_bytes())
+    return digest.hexdigest()
+
+
+def image_hash(image: str) -> Optional[str]:
+    """
+    Returns the build hash the image is labelled with, if the image exists.
+
+    :param image: The image name with the tag
+    """
+    cmd_output = subprocess.run(
+        ['docker', 'image', 'inspect', '-f', f'{{{{index .Config.Labels "{HASH_LABEL}"}}}}',
+         image], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=False, text=True)
+    if cmd_output.returncode != 0:
+        return None
+    return cmd_output.stdout.strip()
+
+
+def image_id(image: str) -> Optional[str]:
+    """
+    Returns the ID of the image (the digest of its configuration), if the image exists.
+
+    :param image: The image name with the tag
+    """
+    cmd_output = subprocess.run(['docker', 'image', 'inspect', '-f', '{{.Id}}', image],
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                check=False, text=True)
+    if cmd_output.returncode != 0:
+        return None
+    return cmd_output.stdout.strip()
+
+
+def load_image_manifest() -> Dict[str, str]:
+    """Returns the map from each image listed in the image manifest to its ID."""
+    manifest_path = pathlib.Path(IMAGE_MANIFEST)
+    if not manifest_path.exists():
+        return {}
+    with open(manifest_path, 'r') as manifest_fp:
+        return json.load(manifest_fp)["Images"]
+
+
+def verify_images(images: Iterable[str]) -> None:
+    """
+    Exits the program if the ID of any of the input images listed in the image manifest
+    does not match the manifest.
+
+    :param images: The image names with the tags
+    """
+    expected = load_image_manifest()
+    for image in images:
+        if image in VERIFIED_IMAGES or image not in expected:
+            continue
+        actual = image_id(image)
+        if actual != expected[image]:
+            sys.exit(f'The image {image} ({actual or "missing"}) does not match the imported'
+                     f' {expected[image]} in {IMAGE_MANIFEST}; import the bundle again or'
+                     f' delete {IMAGE_MANIFEST} to use the local images')
+        VERIFIED_IMAGES.add(image)
+
+
+def forget_images(images: Iterable[str]) -> None:
+    """
+    Removes the input images from the image manifest.
+
+    :param images: The image names with the tags
+    """
+    manifest_path = pathlib.Path(IMAGE_MANIFEST)
+    if not manifest_path.exists():
+        return
+    with open(manifest_path, 'r') as manifest_fp:
+        manifest = json.load(manifest_fp)
+    if not set(images) & set(manifest["Images"]):
+        return
+    for image in images:
+        manifest["Images"].pop(image, None)
+    atomic_json_dump(manifest, manifest_path, indent=2)
+
+
+class BuildScheduler:
+    """
+    Builds the images at most `jobs` at a time and skips the images that are up to date.
+    """
+
+    def __init__(self, jobs: int, log_fp: TextIO, force: bool = False) -> None:
+        """
+        :param jobs: The maximum number of concurrent builds
+        :param log_fp: Log file pointer
+        :param force: Whether to build the images even if they are up to date
+        """
+        self.jobs = max(1, jobs)
+        self.log_fp = log_fp
+        self.force = force
+        self.lock = threading.Lock()
+        self.times = {}  # type: Dict[str, Dict[str, object]]
+
+    def _log(self, message: str) -> None:
+        with self.lock:
+            self.log_fp.write(f'{datetime.now()}\t{message}\n')
+            self.log_fp.flush()
+
+    def _build(self, build: ImageBuild) -> bool:
+        """Builds the image unless it is up to date and returns whether it is available."""
+        content_hash = build_hash(build)
+        if not self.force and image_hash(build.image) == content_hash:
+            self._log(f'Image {build.image} is up to date.')
+            with self.lock:
+                self.times[build.image] = {"Status": "current", "Hash": content_hash}
+            return True
+        run_cmd = ['docker', 'build', '-t', build.image, '-f', build.dockerfile,
+                   '--label', f'{HASH_LABEL}={content_hash}']
+        if build.latest:
+            # The code is fetched by the Dockerfile, so the cached layers would be stale
+            run_cmd.append('--no-cache')
+        for name, value in build.build_args:
+            run_cmd += ['--build-arg', f'{name}={value}']
+        run_cmd.append('.')
+        self._log(f'Building image {build.image}.')
+        my_env = None
+        if platform.system() == 'Linux':
+            my_env = os.environ.copy()
+            my_env['DOCKER_BUILDKIT'] = '1'
+        begin_time = time.time()
+        cmd_output = subprocess.run(run_cmd, env=my_env, stdout=subprocess.PIPE,
+                                    cwd=build.context, check=False)
+        seconds = time.time() - begin_time
+        succeeded = cmd_output.returncode == 0
+        with self.lock:
+            self.times[build.image] = {"Status": "built" if succeeded else "failed",
+                                       "Hash": content_hash, "Seconds": round(seconds, 1),
+                                       "Finished": datetime.now().isoformat()}
+        if succeeded:
+            self._log(f'Time to build {build.image} image: {seconds}s')
+        else:
+            self._log(f'Error in building image {build.image}.')
+        return succeeded
+
+    def run(self, builds: List[ImageBuild]) -> List[str]:
+        """
+        Builds the images and returns the ones that failed to build.
+        The build times are merged into the image_build_times.json file.
+
+        :param builds: The image builds
+        """
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            results = list(executor.map(self._build, builds))
+        times_path = pathlib.Path(BUILD_TIMES)
+        times = {}  # type: Dict[str, Dict[str, object]]
+        if times_path.exists():
+            with open(times_path, 'r') as times_fp:
+                times = json.load(times_fp)
+        for image, record in self.times.items():
+            # A skipped image keeps the time of its last build
+            times[image] = {**times.get(image, {}), **record}
+        atomic_json_dump(times, times_path, indent=2)
+        forget_images([image for image, record in self.times.items()
+                       if record["Status"] == "built"])
+        return [build.image for build, result in zip(builds, results) if not result]
@@ -0,0 +1,169 @@
+"""
+Exports the built implementation images and the GRoot image as a single bundle and imports
+the bundle on another host, without building the images or accessing the network.
+The bundle is a tar file with two members:
+    - bundle_manifest.json: the bundle format version, the creation time, the image tag,
+      the ID (the digest of the configuration) of each image and the sha256 of images.tar
+    - images.tar: the images as saved by `docker save`
+Importing verifies the sha256 of images.tar before loading the images and their IDs after,
+and writes the image_manifest.json file with the IDs. While that file exists, the test
+scripts refuse to start the containers of an image whose ID does not match it.
+
+usage: python3 -m Scripts.image_bundle [-h] (-export BUNDLE_PATH | -import BUNDLE_PATH) [-l] [-b] [-n] [-k] [-p] [-c] [-y] [-m] [-t] [-e]
+
+optional arguments:
+  -h, --help           show this help message and exit
+  -export BUNDLE_PATH  Export the images to the bundle.
+  -import BUNDLE_PATH  Verify and import the images from the bundle.
+  -l, --latest         Export the images built using latest code. (default: False)
+  -b                   Disable Bind. (default: False)
+  -n                   Disable Nsd. (default: False)
+  -k                   Disable Knot. (default: False)
+  -p                   Disable PowerDns. (default: False)
+  -c                   Disable CoreDns. (default: False)
+  -y                   Disable Yadifa. (default: False)
+  -m                   Disable MaraDns. (default: False)
+  -t                   Disable TrustDns. (default: False)
+  -e                   Disable Technitium. (default: False)
+"""
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import os
+import pathlib
+import subprocess
+import sys
+import tarfile
+import tempfile
+from argparse import (SUPPRESS, ArgumentDefaultsHelpFormatter, ArgumentParser,
+                      Namespace)
+from datetime import datetime
+from typing import Any, Dict
+
+from Implementations.registry import add_disable_arguments, get_ports
+from Scripts.fingerprints import atomic_json_dump
+from Scripts.image_builds import GROOT_BUILD, IMAGE_MANIFEST, VERIFIED_IMAGES, image_id
+
+BUNDLE_VERSION = 1
+BUNDLE_MANIFEST = 'bundle_manifest.json'
+BUNDLE_IMAGES = 'images.tar'
+
+
+def file_sha256(path: pathlib.Path) -> str:
+    """Returns the sha256 of the file, reading it a chunk at a time."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file_fp:
+        for chunk in iter(lambda: file_fp.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def export_bundle(input_args: Namespace, bundle_path: pathlib.Path) -> None:
+    """
+    Saves the images of the enabled implementations (with the tag chosen by the input
+    arguments) and the GRoot image to the bundle.
+    Exits the program if any of the images does not exist.
+
+    :param input_args: The input arguments
+    :param bundle_path: The path to the bundle
+    """
+    tag = ':latest' if input_args.latest else ':oct'
+    images = [impl + tag for impl, (check, _) in get_ports(input_args).items() if check]
+    images.append(GROOT_BUILD.image)
+    ids = {image: image_id(image) for image in images}
+    missing = [image for image, identifier in ids.items() if not identifier]
+    if missing:
+        sys.exit('The images are not built: ' + ', '.join(missing))
+    with tempfile.TemporaryDirectory(dir=bundle_path.parent) as tmp_dir:
+        images_path = pathlib.Path(tmp_dir) / BUNDLE_IMAGES
+        print(f'{datetime.now()}\tSaving {len(images)} images')
+        subprocess.run(['docker', 'save', '-o', str(images_path)] + images, check=True)
+        manifest = {"Version": BUNDLE_VERSION,
+                    "Created": datetime.now().isoformat(),
+                    "Tag": tag,
+                    "Images": ids,
+                    "Sha256": file_sha256(images_path)}
+        manifest_path = pathlib.Path(tmp_dir) / BUNDLE_MANIFEST
+        with open(manifest_path, 'w') as manifest_fp:
+            json.dump(manifest, manifest_fp, indent=2)
+        tmp_bundle = pathlib.Path(tmp_dir) / bundle_path.name
+        with tarfile.open(tmp_bundle, 'w') as bundle:
+            bundle.add(manifest_path, BUNDLE_MANIFEST)
+            bundle.add(images_path, BUNDLE_IMAGES)
+        os.replace(tmp_bundle, bundle_path)
+    print(f'{datetime.now()}\tExported the images to {bundle_path}')
+
+
+def read_manifest(bundle: tarfile.TarFile) -> Dict[str, Any]:
+    """
+    Returns the manifest of the bundle.
+    Exits the program if the bundle has no manifest or a manifest of another version.
+
+    :param bundle: The opened bundle
+    """
+    try:
+        manifest_fp = bundle.extractfile(BUNDLE_MANIFEST)
+    except KeyError:
+        manifest_fp = None
+    if manifest_fp is None:
+        sys.exit(f'The bundle has no {BUNDLE_MANIFEST}')
+    manifest = json.load(manifest_fp)
+    if manifest.get("Version") != BUNDLE_VERSION:
+        sys.exit(f'The bundle version {manifest.get("Version")} is not supported '
+                 f'(expected {BUNDLE_VERSION})')
+    return manifest
+
+
+def import_bundle(bundle_path: pathlib.Path) -> None:
+    """
+    Verifies the bundle, loads its images and writes their IDs to the image manifest.
+    Exits the program if the bundle or the loaded images do not match its manifest.
+
+    :param bundle_path: The path to the bundle
+    """
+    with tempfile.TemporaryDirectory(dir=bundle_path.parent) as tmp_dir, \
+            tarfile.open(bundle_path, 'r') as bundle:
+        manifest = read_manifest(bundle)
+        images_fp = bundle.extractfile(BUNDLE_IMAGES)
+        if images_fp is None:
+            sys.exit(f'The bundle has no {BUNDLE_IMAGES}')
+        images_path = pathlib.Path(tmp_dir) / BUNDLE_IMAGES
+        with open(images_path, 'wb') as output_fp:
+            for chunk in iter(lambda: images_fp.read(1 << 20), b''):
+                output_fp.write(chunk)
+        if file_sha256(images_path) != manifest["Sha256"]:
+            sys.exit(f'The {BUNDLE_IMAGES} of the bundle does not match its manifest')
+        print(f'{datetime.now()}\tLoading {len(manifest["Images"])} images')
+        subprocess.run(['docker', 'load', '-i', str(images_path)],
+                       stdout=subprocess.DEVNULL, check=True)
+    mismatched = [image for image, identifier in manifest["Images"].items()
+                  if image_id(image) != identifier]
+    if mismatched:
+        sys.exit('The loaded images do not match the bundle manifest: ' + ', '.join(mismatched))
+    atomic_json_dump({"Bundle": bundle_path.name, **manifest}, pathlib.Path(IMAGE_MANIFEST),
+                     indent=2)
+    VERIFIED_IMAGES.update(manifest["Images"])
+    print(f'{datetime.now()}\tImported the images from {bundle_path}')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter,
+                            description='Exports the implementation and GRoot images as a '
+                            'bundle or imports them from a bundle.')
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument('-export', metavar='BUNDLE_PATH', default=SUPPRESS,
+                      help='Export the images to the bundle.')
+    mode.add_argument('-import', metavar='BUNDLE_PATH', default=SUPPRESS, dest='import_path',
+                      help='Verify and import the images from the bundle.')
+    parser.add_argument('-l', '--latest', action="store_true",
+                        help='Export the images built using latest code.')
+    add_disable_arguments(parser)
+    args = parser.parse_args()
+    if "export" in args:
+        export_bundle(args, pathlib.Path(args.export).resolve())
+    else:
+        import_path = pathlib.Path(args.import_path).resolve()
+        if not import_path.is_file():
+            sys.exit(f'The bundle {import_path} does not exist')
+        import_bundle(import_path)
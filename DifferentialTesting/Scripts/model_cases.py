@@ -0,0 +1,163 @@
+"""
+Lazy lookup of the Zen model case (ZenResponseTag) of each test.
+The model cases are read from the Queries (or ExpectedResponses) file of a zone only
+when that zone is looked up, and are cached in an SQLite index, ModelCases.sqlite3,
+a sibling of the Queries directory, which is read a zone at a time. A zone's index entry
+is reused as long as the size and modification time of its Queries file are unchanged.
+
+usage: python3 -m Scripts.model_cases [-h] [-path DIRECTORY_PATH]
+
+optional arguments:
+  -h, --help            show this help message and exit
+  -path DIRECTORY_PATH  The path to the directory containing Queries or ExpectedResponses
+                        directory. Searches recursively (default: Results/)
+"""
+
+#!/usr/bin/env python3
+
+import json
+import pathlib
+import sqlite3
+from argparse import SUPPRESS, ArgumentDefaultsHelpFormatter, ArgumentParser
+from typing import Dict, Optional
+
+from Scripts.test_with_valid_zone_files import QUERIES, QUERY_RESPONSES
+
+MODEL_CASES = "ModelCases.sqlite3"
+
+
+def get_tag_dir(dir_path: pathlib.Path) -> Optional[pathlib.Path]:
+    """
+    Returns the directory with the Zen model cases (Queries or ExpectedResponses), if any.
+
+    :param dir_path: The path to the directory containing the Queries directory
+    """
+    for tag_dir in (dir_path / QUERIES, dir_path / QUERY_RESPONSES):
+        if tag_dir.exists() and tag_dir.is_dir():
+            return tag_dir
+    return None
+
+
+class ModelCaseIndex:
+    """
+    The index from a zone id and a query "name:type" to the Zen model case of that test.
+    Each zone is a row of the index database, read only when the zone is looked up, so
+    the index is never loaded in memory as a whole. The index can be opened by several
+    processes at a time.
+    """
+
+    def __init__(self, dir_path: pathlib.Path) -> None:
+        """
+        Opens (or creates) the index of the directory, if it has a Queries directory.
+
+        :param dir_path: The path to the directory containing the Queries directory
+        """
+        self.tag_dir = get_tag_dir(dir_path)
+        self.path = dir_path / MODEL_CASES
+        self.conn = None  # type: Optional[sqlite3.Connection]
+        if not self.tag_dir:
+            return
+        try:
+            self.conn = self._connect()
+        except sqlite3.DatabaseError:
+            # A corrupt index is rebuilt from the Queries files
+            self.path.unlink()
+            self.conn = self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.path), timeout=60)
+        conn.execute('CREATE TABLE IF NOT EXISTS zones (zoneid TEXT PRIMARY KEY, '
+                     'size INTEGER NOT NULL, mtime INTEGER NOT NULL, tags TEXT NOT NULL)')
+        conn.commit()
+        return conn
+
+    def get(self, zoneid: str) -> Dict[str, str]:
+        """
+        Returns the map from a query "name:type" to its Zen model case for the zone,
+        reading the Queries file of the zone only if it is not indexed or changed.
+
+        :param zoneid: The unique zone identifier
+        """
+        if not self.tag_dir or not self.conn:
+            return {}
+        queries_file = self.tag_dir / (zoneid + '.json')
+        if not queries_file.exists():
+            return {}
+        stat = queries_file.stat()
+        row = self.conn.execute('SELECT size, mtime, tags FROM zones WHERE zoneid = ?',
+                                (zoneid,)).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return json.loads(row[2])
+        tags = {}
+        with open(queries_file, 'r') as qf_fp:
+            for qinfo in json.load(qf_fp):
+                if "ZenResponseTag" in qinfo:
+                    query_str = qinfo["Query"]["Name"] + ":" + qinfo["Query"]["Type"]
+                    tags[query_str] = qinfo["ZenResponseTag"]
+        self.conn.execute('INSERT OR REPLACE INTO zones VALUES (?, ?, ?, ?)',
+                          (zoneid, stat.st_size, stat.st_mtime_ns,
+                           json.dumps(tags, separators=(',', ':'))))
+        self.conn.commit()
+        return tags
+
+    def update(self) -> None:
+        """Indexes all the Queries files and removes the entries of deleted ones."""
+        if not self.tag_dir or not self.conn:
+            return
+        present = set()
+        for queries_file in self.tag_dir.iterdir():
+            present.add(queries_file.stem)
+            self.get(queries_file.stem)
+        indexed = [zoneid for zoneid, in self.conn.execute('SELECT zoneid FROM zones')]
+        self.conn.executemany('DELETE FROM zones WHERE zoneid = ?',
+                              [(zoneid,) for zoneid in indexed if zoneid not in present])
+        self.conn.commit()
+
+    def __len__(self) -> int:
+        """The number of indexed zones."""
+        if not self.conn:
+            return 0
+        return self.conn.execute('SELECT COUNT(*) FROM zones').fetchone()[0]
+
+    def close(self) -> None:
+        """Closes the index, whose updates are already written."""
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+
+def build_index_helper(input_dir: pathlib.Path) -> None:
+    """
+    Helper function to build or update the model case indexes.
+    Iterates recursively over the input directory to find Queries or ExpectedResponses
+    directories.
+
+    :param input_dir: The path to the parent directory with Queries directory.
+    """
+    # Exit if the inputted path does not exist or is not a directory.
+    if not (input_dir.exists() or input_dir.is_dir()):
+        return
+    if get_tag_dir(input_dir):
+        index = ModelCaseIndex(input_dir)
+        index.update()
+        print(f'{index.path}: {len(index)} zones')
+        index.close()
+    else:
+        if input_dir.is_dir():
+            for subdir in input_dir.iterdir():
+                build_index_helper(subdir)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter,
+                            description='Builds or updates the index of the Zen model cases '
+                            'in each directory with a Queries or ExpectedResponses directory.')
+    parser.add_argument('-path', metavar='DIRECTORY_PATH', default=SUPPRESS,
+                        help='The path to the directory containing Queries or ExpectedResponses'
+                        ' directory. Searches recursively (default: Results/)')
+    args = parser.parse_args()
+    if "path" in args:
+        directory_path = pathlib.Path(args.path)
+    else:
+        directory_path = pathlib.Path("Results/")
+    build_index_helper(directory_path)
@@ -0,0 +1,515 @@
+"""
+Runs the valid zone file tests end to end, from the Zen tests to the fingerprints, as a
+pipeline of concurrent stages connected by bounded queues:
+    1. translate: translates the Zen tests (ZenTests directory) in a pool of processes
+       (see translate_tests.py)
+    2. dedup: skips the tests whose zone file and queries are identical to an earlier test
+    3. test: loads each zone file in the containers of one of the runs and compares the
+       responses of the implementations (see test_with_valid_zone_files.py)
+    4. triage: updates the fingerprints (Fingerprints.json) incrementally
+A stage blocks when the queue to the next stage is full, so that the slowest stage
+throttles the earlier ones instead of the tests piling up. The throughput, the utilization
+and the input queue depth of each stage are reported periodically in the log file and
+written to PipelineMetrics.json. With -metrics, the run metrics of all the runs (see
+run_metrics.py) and the queue depths are written as often to pipeline_metrics.prom and
+pipeline_metrics.jsonl.
+
+usage: python3 -m Scripts.pipeline [-h] [-path DIRECTORY_PATH] [-runs {1,2,3,4,5}] [-j JOBS]
+                                   [-queue QUEUE_SIZE] [-follow SECONDS]
+                                   [-interval SECONDS] [-metrics] [-expand MAX_QUERIES]
+                                   [-b] [-n] [-k] [-p] [-c] [-y] [-m] [-t] [-e] [-l]
+                                   [-network NETWORK_NAME]
+
+optional arguments:
+  -h, --help            show this help message and exit
+  -path DIRECTORY_PATH  The path to the directory containing the ZenTests directory.
+                        (default: Results/ValidZoneFileTests/)
+  -runs {1,2,3,4,5}     The number of parallel test runs, each with its own containers
+                        (ids 1 to RUNS). (default: 1)
+  -j JOBS               The number of processes to translate the tests with.
+                        (default: Number of CPUs)
+  -queue QUEUE_SIZE     The maximum number of tests waiting between two stages.
+                        (default: 256)
+  -follow SECONDS       Keep translating the Zen tests added to the ZenTests directory (for
+                        example, while the tests are being generated) until there are none
+                        for this many seconds. (default: Translate the existing tests)
+  -interval SECONDS     The number of seconds between two metrics reports. (default: 30)
+  -metrics              Also write the run metrics and the queue depths to
+                        pipeline_metrics.prom and pipeline_metrics.jsonl every interval.
+                        (default: False)
+  -expand MAX_QUERIES   Also send up to MAX_QUERIES queries derived from the contents of
+                        each zone file while it is loaded (see
+                        test_with_valid_zone_files.py). (default: Only the Zen queries)
+  -b                    Disable Bind. (default: False)
+  -n                    Disable Nsd. (default: False)
+  -k                    Disable Knot. (default: False)
+  -p                    Disable PowerDns. (default: False)
+  -c                    Disable CoreDns. (default: False)
+  -y                    Disable Yadifa. (default: False)
+  -m                    Disable MaraDns. (default: False)
+  -t                    Disable TrustDns. (default: False)
+  -e                    Disable Technitium. (default: False)
+  -l, --latest          Test using latest image tag. (default: False)
+  -network NETWORK_NAME Attach the containers to this Docker bridge network (created if
+                        missing) and query their IPs directly instead of the published
+                        host ports (Linux hosts only). (default: Use published host ports)
+"""
+
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import os
+import pathlib
+import queue
+import sys
+import threading
+import time
+import traceback
+from argparse import SUPPRESS, ArgumentDefaultsHelpFormatter, ArgumentParser, Namespace
+from datetime import datetime
+from functools import partial
+from itertools import islice
+from multiprocessing import Pool
+from multiprocessing.pool import Pool as PoolType
+from typing import Any, Dict, Iterator, List, Optional, Set, TextIO, Tuple
+
+from Implementations.registry import add_disable_arguments, get_ports
+from Scripts.fingerprints import FingerprintState, atomic_json_dump
+from Scripts.run_metrics import RunMetrics
+from Scripts.test_shards import is_sharded, read_tests
+from Scripts.test_with_valid_zone_files import (DIFFERENCES, QUERIES, ZONE_FILES,
+                                                get_addresses, remove_container, run_test,
+                                                start_containers)
+from Scripts.translate_tests import TESTS_INFO, ZEN_TESTS, test_translator
+from Scripts.zone_manifest import ZoneManifest
+
+PIPELINE_METRICS = "PipelineMetrics.json"
+DUPLICATES = "Duplicates.json"
+# Marks the end of the items in a queue
+DONE = None
+
+
+class PipelineAborted(Exception):
+    """Raised in a stage when another stage failed."""
+
+
+class Stage:
+    """
+    The bounded input queue and the counters of a pipeline stage.
+    """
+
+    def __init__(self, name: str, queue_size: int, workers: int = 1) -> None:
+        """
+        :param name: The name of the stage
+        :param queue_size: The maximum number of items in the input queue (0 if the stage
+                           has no input queue)
+        :param workers: The number of threads (or processes) of the stage
+        """
+        self.name = name
+        self.queue = queue.Queue(queue_size) if queue_size else None  # type: Optional[queue.Queue]
+        self.queue_size = queue_size
+        self.workers = workers
+        self.processed = 0
+        self.busy = 0.0
+        self.blocked = 0.0
+        self.lock = threading.Lock()
+        self.start = time.time()
+
+    def get(self, aborted: threading.Event) -> Any:
+        """Returns the next item of the input queue."""
+        while True:
+            try:
+                return self.queue.get(timeout=1)
+            except queue.Empty:
+                if aborted.is_set():
+                    raise PipelineAborted()
+
+    def put(self, item: Any, aborted: threading.Event, source: 'Stage') -> None:
+        """
+        Adds the item to the input queue, counting the time the source stage is blocked.
+
+        :param item: The item to add
+        :param aborted: Set when a stage failed
+        :param source: The stage adding the item
+        """
+        start = time.time()
+        while True:
+            try:
+                self.queue.put(item, timeout=1)
+                break
+            except queue.Full:
+                if aborted.is_set():
+                    raise PipelineAborted()
+        with source.lock:
+            source.blocked += time.time() - start
+
+    def done(self, busy: float) -> None:
+        """Counts an item processed in the input number of seconds."""
+        with self.lock:
+            self.processed += 1
+            self.busy += busy
+
+    def metrics(self) -> Dict[str, Any]:
+        """Returns the counters of the stage."""
+        elapsed = max(time.time() - self.start, 1e-9)
+        with self.lock:
+            return {
+                "Processed": self.processed,
+                "Throughput": round(self.processed / elapsed, 3),
+                # The fraction of the time the workers were processing items
+                "Utilization": round(self.busy / (elapsed * self.workers), 3),
+                # The fraction of the time the workers waited for the next stage
+                "Blocked": round(self.blocked / (elapsed * self.workers), 3),
+                "Queue": self.queue.qsize() if self.queue else 0,
+                "QueueSize": self.queue_size
+            }
+
+
+class TriageFeed:
+    """
+    Passed to `run_test` as the fingerprint state, so that each Differences file written
+    is handed to the triage stage instead of being recorded by the test run.
+    """
+
+    def __init__(self, triage: Stage, aborted: threading.Event, source: Stage) -> None:
+        self.triage = triage
+        self.aborted = aborted
+        self.source = source
+
+    def record(self,
+               diff_path: pathlib.Path,
+               differences: List[Dict[str, Any]],
+               model_cases: Dict[str, str]) -> None:
+        """Adds the Differences file to the input queue of the triage stage."""
+        self.triage.put((diff_path, differences, model_cases), self.aborted, self.source)
+
+
+def new_tests(zen_tests_dir: pathlib.Path, seen: Set[str]) -> Iterator[Tuple[str, Any]]:
+    """
+    Yields the id and the Zen test of each test in the ZenTests directory that was not
+    seen before. A test file that can not be parsed (for example, as it is still being
+    written) is skipped and yielded in a later call.
+
+    :param zen_tests_dir: The path to the ZenTests directory
+    :param seen: The ids of the tests seen before, updated with the yielded tests
+    """
+    if is_sharded(zen_tests_dir):
+        for test_id, test in read_tests(zen_tests_dir):
+            if test_id not in seen:
+                seen.add(test_id)
+                yield test_id, test
+        return
+    for test in zen_tests_dir.iterdir():
+        if test.suffix != '.json' or test.stem in seen or not test.is_file():
+            continue
+        try:
+            with open(test, 'r') as test_fp:
+                test_json = json.load(test_fp)
+        except ValueError:
+            continue
+        seen.add(test.stem)
+        yield test.stem, test_json
+
+
+def translate_stage(dir_path: pathlib.Path,
+                    pool: PoolType,
+                    jobs: int,
+                    follow: Optional[float],
+                    stages: Dict[str, Stage],
+                    aborted: threading.Event) -> None:
+    """
+    Translates the Zen tests and passes the ids of the translated tests to the dedup stage.
+    The output of formatting each zone file is written to CompileZoneOutput.json.
+
+    :param dir_path: The path to the directory containing the ZenTests directory
+    :param pool: The pool of processes to translate the tests with
+    :param jobs: The number of processes in the pool
+    :param follow: The number of seconds without new tests after which to stop
+                   (None to translate only the existing tests)
+    :param stages: The stages of the pipeline
+    :param aborted: Set when a stage failed
+    """
+    stage = stages['translate']
+    seen = set()  # type: Set[str]
+    compilezone_output = {}  # type: Dict[str, Any]
+    translator = partial(test_translator, compilezone=None, output_path=dir_path)
+    last_new = time.time()
+    while True:
+        tests = new_tests(dir_path / ZEN_TESTS, seen)
+        batch = list(islice(tests, jobs * 16))
+        while batch:
+            last_new = time.time()
+            start = time.time()
+            for fileid, error, output, _ in pool.imap_unordered(translator, batch, chunksize=4):
+                stage.done(time.time() - start)
+                if output is not None:
+                    compilezone_output[fileid] = output
+                if not error and output is not None:
+                    stages['dedup'].put(fileid, aborted, stage)
+                start = time.time()
+            batch = list(islice(tests, jobs * 16))
+        if follow is None or is_sharded(dir_path / ZEN_TESTS) or \
+                time.time() - last_new >= follow:
+            break
+        time.sleep(1)
+    with open(dir_path / 'CompileZoneOutput.json', 'w') as compile_output_fp:
+        json.dump(dict(sorted(compilezone_output.items())), compile_output_fp, indent=2)
+
+
+def dedup_stage(dir_path: pathlib.Path,
+                manifest: ZoneManifest,
+                stages: Dict[str, Stage],
+                aborted: threading.Event) -> Dict[str, str]:
+    """
+    Adds the translated zone files to the manifest and passes the ids of the tests with a
+    new zone file and queries to the test stage. Returns the map from the id of each
+    duplicate test to the id of the earlier test.
+
+    :param dir_path: The path to the directory containing the ZoneFiles directory
+    :param manifest: The manifest of the zone files
+    :param stages: The stages of the pipeline
+    :param aborted: Set when a stage failed
+    """
+    stage = stages['dedup']
+    tests = {}  # type: Dict[str, str]
+    duplicates = {}  # type: Dict[str, str]
+    while True:
+        zoneid = stage.get(aborted)
+        if zoneid is DONE:
+            return duplicates
+        start = time.time()
+        with open(dir_path / QUERIES / (zoneid + '.json'), 'rb') as query_fp:
+            key = manifest.entry(zoneid)["Hash"] + hashlib.sha256(query_fp.read()).hexdigest()
+        stage.done(time.time() - start)
+        if key in tests:
+            duplicates[zoneid] = tests[key]
+        else:
+            tests[key] = zoneid
+            stages['test'].put(zoneid, aborted, stage)
+
+
+def test_stage(dir_path: pathlib.Path,
+               cid: int,
+               implementations: Dict[str, Tuple[bool, int]],
+               tag: str,
+               network: Optional[str],
+               manifest: ZoneManifest,
+               errors: Dict[str, str],
+               log_fp: TextIO,
+               expand: Optional[int],
+               metrics: Optional[RunMetrics],
+               stages: Dict[str, Stage],
+               aborted: threading.Event) -> None:
+    """
+    Runs the tests on the zone files from the dedup stage with the containers of one run.
+    The Differences files are passed to the triage stage.
+
+    :param dir_path: The path to the directory containing zone files and queries
+    :param cid: The unique id for all the containers of the run
+    :param implementations: Map from an implementation to a tuple of two items
+                            - 1. whether to check that implementation 2. which host port
+                            should be mapped to the container port 53
+    :param tag: Tag of the images to use
+    :param network: The Docker network to attach the containers to, if any
+    :param manifest: The manifest of the zone files
+    :param errors: A map from zoneid to any error encountered during testing
+    :param log_fp: The log file pointer
+    :param expand: The maximum number of extra queries derived from each zone file, if any
+    :param metrics: The metrics of the runs, if any
+    :param stages: The stages of the pipeline
+    :param aborted: Set when a stage failed
+    """
+    stage = stages['test']
+    start_containers(cid, implementations, tag, network)
+    addresses = get_addresses(cid, implementations, network)
+    feed = TriageFeed(stages['triage'], aborted, stage)
+    try:
+        while True:
+            zoneid = stage.get(aborted)
+            if zoneid is DONE:
+                return
+            log_fp.write(f'{datetime.now()}\tChecking zone: {zoneid} (run {cid})\n')
+            start = time.time()
+            run_test(zoneid, dir_path, errors, cid, implementations, log_fp, tag, manifest,
+                     addresses, network, feed, expand=expand, metrics=metrics)
+            stage.done(time.time() - start)
+            if metrics:
+                metrics.zone_done()
+    finally:
+        remove_container(cid)
+
+
+def triage_stage(dir_path: pathlib.Path,
+                 stages: Dict[str, Stage],
+                 aborted: threading.Event) -> None:
+    """
+    Records the fingerprints of the Differences files from the test stage.
+
+    :param dir_path: The path to the directory containing the Differences directory
+    :param stages: The stages of the pipeline
+    :param aborted: Set when a stage failed
+    """
+    stage = stages['triage']
+    state = FingerprintState(dir_path)
+    while True:
+        item = stage.get(aborted)
+        if item is DONE:
+            break
+        start = time.time()
+        state.record(*item)
+        stage.done(time.time() - start)
+    state.flush(refresh=True)
+
+
+def report_metrics(stages: Dict[str, Stage], log_fp: TextIO) -> Dict[str, Dict[str, Any]]:
+    """
+    Writes a line with the metrics of each stage to the log file and returns the metrics.
+
+    :param stages: The stages of the pipeline
+    :param log_fp: The log file pointer
+    """
+    metrics = {name: stage.metrics() for name, stage in stages.items()}
+    line = ' | '.join(f'{name}: {stage["Processed"]} ({stage["Throughput"]}/s, '
+                      f'{stage["Utilization"]:.0%} busy, {stage["Blocked"]:.0%} blocked, '
+                      f'queue {stage["Queue"]}/{stage["QueueSize"]})'
+                      for name, stage in metrics.items())
+    log_fp.write(f'{datetime.now()}\tMetrics: {line}\n')
+    return metrics
+
+
+def run_pipeline(dir_path: pathlib.Path, input_args: Namespace) -> None:
+    """
+    Runs the stages of the pipeline until all the Zen tests are translated, tested and
+    fingerprinted.
+
+    :param dir_path: The path to the directory containing the ZenTests directory
+    :param input_args: The input arguments
+    """
+    for directory in (ZONE_FILES, QUERIES, TESTS_INFO, DIFFERENCES):
+        (dir_path / directory).mkdir(parents=True, exist_ok=True)
+    implementations = get_ports(input_args)
+    tag = ':latest' if input_args.latest else ':oct'
+    network = input_args.network if "network" in input_args else None
+    jobs = input_args.j if "j" in input_args else os.cpu_count() or 1
+    follow = input_args.follow if "follow" in input_args else None
+    expand = input_args.expand if "expand" in input_args else None
+    stages = {
+        'translate': Stage('translate', 0, jobs),
+        'dedup': Stage('dedup', input_args.queue),
+        'test': Stage('test', input_args.queue, input_args.runs),
+        'triage': Stage('triage', input_args.queue),
+    }
+    aborted = threading.Event()
+    manifest = ZoneManifest(dir_path / ZONE_FILES)
+    errors = {}  # type: Dict[str, str]
+    duplicates = {}  # type: Dict[str, str]
+    start = time.time()
+    run_metrics = None  # type: Optional[RunMetrics]
+    if input_args.metrics:
+        run_metrics = RunMetrics(dir_path / 'pipeline_metrics', 'pipeline', input_args.interval,
+                                 lambda: {name: stage.queue.qsize()
+                                          for name, stage in stages.items() if stage.queue})
+        run_metrics.start_writing()
+
+    def run_stage(name: str, target: Any, *args: Any) -> None:
+        try:
+            result = target(*args)
+            if name == 'dedup':
+                duplicates.update(result)
+        except PipelineAborted:
+            pass
+        except Exception:  # pylint: disable=broad-except
+            log_fp.write(f'{datetime.now()}\tThe {name} stage failed:\n{traceback.format_exc()}')
+            aborted.set()
+
+    with open(dir_path / 'pipeline_log.txt', 'w', 1) as log_fp, Pool(jobs) as pool:
+        threads = {
+            'translate': [threading.Thread(target=run_stage, args=(
+                'translate', translate_stage, dir_path, pool, jobs, follow, stages, aborted))],
+            'dedup': [threading.Thread(target=run_stage, args=(
+                'dedup', dedup_stage, dir_path, manifest, stages, aborted))],
+            'test': [threading.Thread(target=run_stage, args=(
+                'test', test_stage, dir_path, cid, implementations, tag, network, manifest,
+                errors, log_fp, expand, run_metrics, stages, aborted))
+                     for cid in range(1, input_args.runs + 1)],
+            'triage': [threading.Thread(target=run_stage, args=(
+                'triage', triage_stage, dir_path, stages, aborted))],
+        }
+        for stage_threads in threads.values():
+            for thread in stage_threads:
+                thread.start()
+        # Each stage is told that there are no more items once the previous stage finished
+        for previous, stage in (('translate', 'dedup'), ('dedup', 'test'), ('test', 'triage')):
+            while any(thread.is_alive() for thread in threads[previous]):
+                for thread in threads[previous]:
+                    thread.join(input_args.interval)
+                    if thread.is_alive():
+                        report_metrics(stages, log_fp)
+            for _ in threads[stage]:
+                try:
+                    stages[stage].put(DONE, aborted, stages[previous])
+                except PipelineAborted:
+                    break
+        for thread in threads['triage']:
+            thread.join()
+        if run_metrics:
+            run_metrics.close()
+        metrics = report_metrics(stages, log_fp)
+        log_fp.write(f'{datetime.now()}\tTotal time: {time.time() - start}s\n')
+        log_fp.write("Errors:\n")
+        log_fp.write(str(errors))
+    manifest.save()
+    atomic_json_dump(duplicates, dir_path / DUPLICATES, indent=2)
+    atomic_json_dump({"Stages": metrics, "Duplicates": len(duplicates),
+                      "Seconds": round(time.time() - start, 3)},
+                     dir_path / PIPELINE_METRICS, indent=2)
+    if aborted.is_set():
+        sys.exit(f'The pipeline failed, see {dir_path / "pipeline_log.txt"}')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter,
+                            description='Runs the valid zone file tests end to end, from the '
+                            'Zen tests to the fingerprints, as a pipeline of concurrent stages.')
+    parser.add_argument('-path', metavar='DIRECTORY_PATH', default=SUPPRESS,
+                        help='The path to the directory containing the ZenTests directory. '
+                        '(default: Results/ValidZoneFileTests/)')
+    parser.add_argument('-runs', type=int, default=1, choices=range(1, 6),
+                        help='The number of parallel test runs, each with its own containers '
+                        '(ids 1 to RUNS).')
+    parser.add_argument('-j', metavar='JOBS', type=int, default=SUPPRESS,
+                        help='The number of processes to translate the tests with. '
+                        '(default: Number of CPUs)')
+    parser.add_argument('-queue', metavar='QUEUE_SIZE', type=int, default=256,
+                        help='The maximum number of tests waiting between two stages.')
+    parser.add_argument('-follow', metavar='SECONDS', type=float, default=SUPPRESS,
+                        help='Keep translating the Zen tests added to the ZenTests directory '
+                        '(for example, while the tests are being generated) until there are '
+                        'none for this many seconds. (default: Translate the existing tests)')
+    parser.add_argument('-interval', metavar='SECONDS', type=float, default=30,
+                        help='The number of seconds between two metrics reports.')
+    parser.add_argument('-metrics', action="store_true",
+                        help='Also write the run metrics and the queue depths to '
+                        'pipeline_metrics.prom and pipeline_metrics.jsonl every interval.')
+    parser.add_argument('-expand', metavar='MAX_QUERIES', type=int, default=SUPPRESS,
+                        help='Also send up to MAX_QUERIES queries derived from the contents of '
+                        'each zone file while it is loaded (see test_with_valid_zone_files.py).'
+                        ' (default: Only the Zen queries)')
+    add_disable_arguments(parser)
+    parser.add_argument(
+        '-l', '--latest', help='Test using latest image tag.', action="store_true")
+    parser.add_argument('-network', metavar='NETWORK_NAME', default=SUPPRESS,
+                        help='Attach the containers to this Docker bridge network (created if '
+                        'missing) and query their IPs directly instead of the published host '
+                        'ports (Linux hosts only). (default: Use published host ports)')
+    args = parser.parse_args()
+    if "path" in args:
+        directory_path = pathlib.Path(args.path)
+    else:
+        directory_path = pathlib.Path("Results/ValidZoneFileTests")
+    if not (directory_path / ZEN_TESTS).is_dir():
+        sys.exit(f'There is no ZenTests directory in {directory_path}')
+    if sum(check for check, _ in get_ports(args).values()) < 2:
+        sys.exit('Choose at least two implementations to perform differential testing')
+    run_pipeline(directory_path, args)
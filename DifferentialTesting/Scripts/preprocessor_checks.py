@@ -1,8 +1,10 @@
 """
 Run zone preprocessors on (invalid) zone files
+The preprocessors run concurrently, each checking a batch of zone files with one shell
+loop in its container.
 
-usage: preprocessor_checks.py [-h] [-path DIRECTORY_PATH] [-id {1,2,3,4,5}]
-                              [-b] [-n] [-k] [-p] [-l]
+usage: python3 -m Scripts.preprocessor_checks [-h] [-path DIRECTORY_PATH] [-id {1,2,3,4,5}]
+                                             [-batch BATCH_SIZE] [-b] [-n] [-k] [-p] [-l]
 
 optional arguments:
   -h, --help            show this help message and exit
@@ -10,6 +12,8 @@ optional arguments:
                         for ZoneFiles directory recursively(default:
                         Results/InvalidZoneFileTests/)
   -id {1,2,3,4,5}       Unique id for all the containers (default: 1)
+  -batch BATCH_SIZE     The number of zone files each preprocessor checks with one command
+                        in its container. (default: 100)
   -b                    Disable Bind. (default: False)
   -n                    Disable Nsd. (default: False)
   -k                    Disable Knot. (default: False)
@@ -21,13 +25,27 @@ optional arguments:
 from datetime import datetime
 import json
 import pathlib
+import shutil
 import subprocess
+import tempfile
 import time
 import sys
 from argparse import SUPPRESS, ArgumentDefaultsHelpFormatter, ArgumentParser, Namespace
-from typing import Dict, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from Implementations.registry import (REGISTRY, add_disable_arguments,
+                                     get_ports as get_registry_ports,
+                                     with_preprocessor)
+from Scripts.image_builds import verify_images
+from Scripts.zone_manifest import ZoneManifest, load_manifest
 
 PREPROCESSOR_DIRECTORY = "PreprocessorOutputs/"
+# Separates the outputs of the zones of a batch in the output stream of a container
+ZONE_MARKER = "#PREPROCESSOR-CHECK#"
+# The directory in the containers the zone files of a batch are copied to
+BATCH_DIRECTORY = "/preprocessor_batch"
+BATCH_LIST = "batch.txt"
 
 
 def get_ports(input_args: Namespace) -> Dict[str, Tuple[bool, int]]:
@@ -35,14 +53,11 @@ def get_ports(input_args: Namespace) -> Dict[str, Tuple[bool, int]]:
     Returns a map from an implementation to the host port its container port 53
     should be mapped and whether that implementation should be tested.
 
+    Only the implementations with a zone-file preprocessor are included.
+
     :param input_args: The input arguments
     """
-    implementations = {}
-    implementations['bind'] = (not input_args.b, 8000)
-    implementations['nsd'] = (not input_args.n, 8100)
-    implementations['knot'] = (not input_args.k, 8200)
-    implementations['powerdns'] = (not input_args.p, 8300)
-    return implementations
+    return get_registry_ports(input_args, with_preprocessor())
 
 
 def delete_container(container_name: str) -> None:
@@ -56,189 +71,228 @@ def delete_container(container_name: str) -> None:
     if container_name in all_container_names:
         subprocess.run(['docker', 'container', 'rm', '-f', container_name], check=True)
 
-def bind(zone_file: pathlib.Path,
-         origin: str,
+
+def start_preprocessor_container(impl: str, cid: str, port: int, tag: str) -> None:
+    """
+    Starts a new container of the implementation, deleting an existing one.
+
+    :param impl: The implementation name
+    :param cid: The unique id for the container
+    :param port: The host port to map to the container port 53
+    :param tag: Tag of the image to use
+    """
+    delete_container(f'{cid}_{impl}_server')
+    subprocess.run(['docker', 'run', '-dp', str(port * int(cid))+':53/udp',
+                    '--name=' + cid + f'_{impl}_server', impl + tag], check=False)
+
+
+def check_batch(container_name: str,
+                zones: List[Tuple[pathlib.Path, str]],
+                check_command: str) -> Dict[str, Tuple[int, List[str]]]:
+    """
+    Copies the zone files of a batch to the container and checks them with one shell loop
+    in the container, which writes a marker line with the zone file name and the return
+    code followed by the output of the check for each zone file.
+    Returns a map from the zone id to the preprocessor return code and output.
+
+    :param container_name: The name of the container
+    :param zones: The path and the origin of each zone file of the batch
+    :param check_command: The shell command checking the zone file "$name" with the
+                          origin "$origin" in the batch directory
+    """
+    with tempfile.TemporaryDirectory() as batch_dir:
+        with open(pathlib.Path(batch_dir) / BATCH_LIST, 'w', newline='\n') as batch_fp:
+            for zone_file, origin in zones:
+                shutil.copy(zone_file, batch_dir)
+                batch_fp.write(f'{zone_file.name} {origin}\n')
+        subprocess.run(['docker', 'exec', container_name, 'rm', '-rf', BATCH_DIRECTORY],
+                       check=False)
+        subprocess.run(['docker', 'cp', batch_dir, container_name + ':' + BATCH_DIRECTORY],
+                       check=False)
+    script = (f'cd {BATCH_DIRECTORY} && while read -r name origin; do '
+              f'output=$({check_command} 2>/dev/null); code=$?; '
+              f'printf "%s %s %s\\n%s\\n" "{ZONE_MARKER}" "$name" "$code" "$output"; '
+              f'done < {BATCH_LIST}')
+    checks = subprocess.run(['docker', 'exec', container_name, 'sh', '-c', script],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False)
+    results = {}  # type: Dict[str, Tuple[int, List[str]]]
+    name, code, lines = None, 0, []  # type: Tuple[Optional[str], int, List[str]]
+    for line in checks.stdout.decode("utf-8").split('\n') + [ZONE_MARKER]:
+        if line.startswith(ZONE_MARKER):
+            if name is not None:
+                results[pathlib.Path(name).stem] = (code, '\n'.join(lines).strip().split('\n'))
+            if line == ZONE_MARKER:
+                break
+            _, name, code_str = line.split(' ')
+            code, lines = int(code_str), []
+        else:
+            lines.append(line)
+    # The zone files not checked (for example, as the container is not running) are rejected
+    error = checks.stderr.decode("utf-8").strip().split('\n')
+    for zone_file, _ in zones:
+        results.setdefault(zone_file.stem, (checks.returncode or 1, error))
+    return results
+
+
+def bind(zones: List[Tuple[pathlib.Path, str]],
          cid: str,
          new: bool,
          port: int,
-         tag: str) -> Tuple[int, str]:
+         tag: str) -> Dict[str, Tuple[int, List[str]]]:
     """
-    Uses a Bind container to check the input zone file with Bind preprocessor named-checkzone.
-    Returns the preprocessor return code and output.
+    Uses a Bind container to check the input zone files with Bind preprocessor named-checkzone.
+    Returns a map from the zone id to the preprocessor return code and output.
 
-    :param zone_file: The path to the zone file
-    :param zone_domain: The zone origin
+    :param zones: The path and the origin of each zone file
     :param cid: The unique id for the container
-    :param new: Whether to load the input zone file in a new container
+    :param new: Whether to check the input zone files in a new container
                         or reuse the existing container
     :param port: The host port to map to the container port 53
     :param tag: Tag of the image to use
     """
     if new:
-        delete_container(f'{cid}_bind_server')
-        subprocess.run(['docker', 'run', '-dp', str(port * int(cid))+':53/udp',
-                        '--name=' + cid + '_bind_server', 'bind' + tag], check=False)
-    subprocess.run(['docker', 'cp', zone_file, cid +
-                    '_bind_server:.'], check=False)
-    compilezone = subprocess.run(['docker', 'exec', cid + '_bind_server', 'named-checkzone', '-i',
-                                  'local', '-k', 'ignore', origin, f'{zone_file.name}'],
-                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False)
-    output = compilezone.stdout.decode("utf-8").strip().split('\n')
-    return (compilezone.returncode, output)
-
-
-def nsd(zone_file: pathlib.Path,
-        origin: str,
+        start_preprocessor_container('bind', cid, port, tag)
+    return check_batch(cid + '_bind_server', zones,
+                       'named-checkzone -i local -k ignore "$origin" "$name"')
+
+
+def nsd(zones: List[Tuple[pathlib.Path, str]],
         cid: str,
         new: bool,
         port: int,
-        tag: str) -> Tuple[int, str]:
+        tag: str) -> Dict[str, Tuple[int, List[str]]]:
     """
-    Uses a NSD container to check the input zone file with NSD preprocessor nsd-checkzone.
-    Returns the preprocessor return code and output.
+    Uses a NSD container to check the input zone files with NSD preprocessor nsd-checkzone.
+    Returns a map from the zone id to the preprocessor return code and output.
 
-    :param zone_file: The path to the zone file
-    :param zone_domain: The zone origin
+    :param zones: The path and the origin of each zone file
     :param cid: The unique id for the container
-    :param new: Whether to load the input zone file in a new container
+    :param new: Whether to check the input zone files in a new container
                         or reuse the existing container
     :param port: The host port to map to the container port 53
     :param tag: Tag of the image to use
     """
     if new:
-        delete_container(f'{cid}_nsd_server')
-        subprocess.run(['docker', 'run', '-dp', str(port * int(cid))+':53/udp',
-                        '--name=' + cid + '_nsd_server', 'nsd' + tag], check=False)
-    subprocess.run(['docker', 'cp', zone_file, cid +
-                    '_nsd_server:.'], check=False)
-    compilezone = subprocess.run(['docker', 'exec', cid + '_nsd_server', 'nsd-checkzone',
-                                  origin, f'{zone_file.name}'],
-                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False)
-    output = compilezone.stdout.decode("utf-8").strip().split('\n')
-    return (compilezone.returncode, output)
-
-
-def knot(zone_file: pathlib.Path,
-         origin: str,
+        start_preprocessor_container('nsd', cid, port, tag)
+    return check_batch(cid + '_nsd_server', zones, 'nsd-checkzone "$origin" "$name"')
+
+
+def knot(zones: List[Tuple[pathlib.Path, str]],
          cid: str,
          new: bool,
          port: int,
-         tag: str) -> Tuple[int, str]:
+         tag: str) -> Dict[str, Tuple[int, List[str]]]:
     """
-    Uses a Knot container to check the input zone file with Knot preprocessor kcheckzone.
-    Returns the preprocessor return code and output.
+    Uses a Knot container to check the input zone files with Knot preprocessor kzonecheck.
+    Returns a map from the zone id to the preprocessor return code and output.
 
-    :param zone_file: The path to the zone file
-    :param zone_domain: The zone origin
+    :param zones: The path and the origin of each zone file
     :param cid: The unique id for the container
-    :param new: Whether to load the input zone file in a new container
+    :param new: Whether to check the input zone files in a new container
                         or reuse the existing container
     :param port: The host port to map to the container port 53
     :param tag: Tag of the image to use
     """
     if new:
-        delete_container(f'{cid}_knot_server')
-        subprocess.run(['docker', 'run', '-dp', str(port * int(cid))+':53/udp',
-                        '--name=' + cid + '_knot_server', 'knot' + tag], check=False)
-    subprocess.run(['docker', 'cp', zone_file, cid +
-                    '_knot_server:.'], check=False)
-    compilezone = subprocess.run(['docker', 'exec', cid + '_knot_server', 'kzonecheck', '-v', '-o',
-                                  origin, f'{zone_file.name}'],
-                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False)
-    output = compilezone.stdout.decode("utf-8").strip().split('\n')
-    return (compilezone.returncode, output)
-
-
-def powerdns(zone_file: pathlib.Path,
-             origin: str,
+        start_preprocessor_container('knot', cid, port, tag)
+    return check_batch(cid + '_knot_server', zones, 'kzonecheck -v -o "$origin" "$name"')
+
+
+def powerdns(zones: List[Tuple[pathlib.Path, str]],
              cid: str,
              new: bool,
              port: int,
-             tag: str) -> Tuple[int, str]:
+             tag: str) -> Dict[str, Tuple[int, List[str]]]:
     """
-    Uses a Powerdns container to check the input zone file with PDNS preprocessor pdnsutil.
-    Returns the preprocessor return code and output.
+    Uses a Powerdns container to check the input zone files with PDNS preprocessor pdnsutil.
+    Each zone file is copied to /usr/local/etc/<origin> and set as the only zone of the
+    bind backend before checking it.
+    Returns a map from the zone id to the preprocessor return code and output.
 
-    :param zone_file: The path to the zone file
-    :param zone_domain: The zone origin
+    :param zones: The path and the origin of each zone file
     :param cid: The unique id for the container
-    :param new: Whether to load the input zone file in a new container
+    :param new: Whether to check the input zone files in a new container
                         or reuse the existing container
     :param port: The host port to map to the container port 53
     :param tag: Tag of the image to use
     """
     if new:
-        delete_container(f'{cid}_powerdns_server')
-        subprocess.run(['docker', 'run', '-dp', str(port * int(cid))+':53/udp',
-                        '--name=' + cid + '_powerdns_server', 'powerdns' + tag], check=False)
-    subprocess.run(['docker', 'cp', zone_file, cid +
-                    '_powerdns_server:/usr/local/etc/' + origin], check=False)
-    bindbackend = f'zone "{origin}" {{\n  file "/usr/local/etc/{origin}";\n  type master;\n}};'
-    with open('bindbackend'+cid+'.conf', 'w') as file_pointer:
-        file_pointer.write(bindbackend)
-    subprocess.run(['docker', 'cp', 'bindbackend'+cid+'.conf',
-                    cid + '_powerdns_server:/usr/local/etc/bindbackend.conf'], check=False)
-    pathlib.Path('bindbackend'+cid+'.conf').unlink()
-    subprocess.run(['docker', 'exec', cid + '_powerdns_server',
-                    'dos2unix', '/usr/local/etc/bindbackend.conf'], check=False)
-    compilezone = subprocess.run(['docker', 'exec', cid + '_powerdns_server', 'pdnsutil', '-v',
-                                  'check-zone', f'{origin}'],
-                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False)
-    output = compilezone.stdout.decode("utf-8").strip().split('\n')
-    return (compilezone.returncode, output)
-
-
-def check_zone_with_preprocessors(input_args: Namespace,
-                                  directory: pathlib.Path,
-                                  zone_path: pathlib.Path,
-                                  cid: str,
-                                  new: bool) -> bool:
+        start_preprocessor_container('powerdns', cid, port, tag)
+    bindbackend = r'zone \"%s\" {\n  file \"/usr/local/etc/%s\";\n  type master;\n};'
+    return check_batch(cid + '_powerdns_server', zones,
+                       'cp "$name" "/usr/local/etc/$origin"; '
+                       f'printf "{bindbackend}" "$origin" "$origin" '
+                       '> /usr/local/etc/bindbackend.conf; '
+                       'pdnsutil -v check-zone "$origin"')
+
+
+# The zone-file checker of each preprocessor name used in the implementations registry
+PREPROCESSORS = {
+    'bind': bind,
+    'nsd': nsd,
+    'knot': knot,
+    'powerdns': powerdns,
+}  # type: Dict[str, Callable[..., Dict[str, Tuple[int, List[str]]]]]
+
+
+def get_preprocessor(impl: str) -> Callable[..., Dict[str, Tuple[int, List[str]]]]:
+    """
+    Returns the function that checks a batch of zone files with the preprocessor of the
+    input implementation as declared in the implementations registry.
+
+    :param impl: The implementation name
+    """
+    return PREPROCESSORS[REGISTRY[impl].preprocessor]
+
+
+def check_zones_with_preprocessors(input_args: Namespace,
+                                   directory: pathlib.Path,
+                                   zone_paths: List[pathlib.Path],
+                                   cid: str,
+                                   new: bool,
+                                   manifest: ZoneManifest) -> bool:
     """
-    Checks a zone file with different input implementations preprocessors.
-    Returns if the checks were successful.
+    Checks a batch of zone files with different input implementations preprocessors.
+    The preprocessors check the batch concurrently, each in its own container.
+    Returns if any zone file of the batch was checked.
 
     :param input_args: The input arguments
     :param directory: The path to store the preprocessor outputs
-    :param zone_path: The path to the zone file
+    :param zone_paths: The paths to the zone files
     :param cid: The unique id for the container
-    :param new: Whether to load the input zone file in a new container
-                        or reuse the existing container
+    :param new: Whether to check the input zone files in new containers
+                        or reuse the existing containers
+    :param manifest: The manifest of the zone files
     """
-    outputs = {}
-    origin = ''
     tag = ':oct'
     if input_args.latest:
         tag = ':latest'
-    with open(zone_path, 'r') as zone_fp:
-        for line in zone_fp:
-            if 'SOA' in line:
-                origin = line.split('\t')[0]
-                if ' ' in origin:
-                    origin = line.split()[0]
-    if not origin:
-        print(f'{datetime.now()}\tSkipping {zone_path.stem} as no SOA is found')
+    zones = []
+    for zone_path in zone_paths:
+        origin = manifest.entry(zone_path.stem)["Origin"]
+        if not origin:
+            print(f'{datetime.now()}\tSkipping {zone_path.stem} as no SOA is found')
+            continue
+        zones.append((zone_path, origin))
+    if not zones:
         return False
     port_mappings = get_ports(input_args)
-    for impl, (check, port) in port_mappings.items():
-        if check:
-            if impl == 'bind':
-                outputs["Bind"] = {}
-                outputs["Bind"]["Code"], outputs["Bind"]["Output"] = bind(
-                    zone_path, origin, cid, new, port, tag)
-            elif impl == 'nsd':
-                outputs["Nsd"] = {}
-                outputs["Nsd"]["Code"], outputs["Nsd"]["Output"] = nsd(
-                    zone_path, origin, cid, new, port, tag)
-            elif impl == 'knot':
-                outputs["Knot"] = {}
-                outputs["Knot"]["Code"], outputs["Knot"]["Output"] = knot(
-                    zone_path, origin, cid, new, port, tag)
-            elif impl == 'powerdns':
-                outputs["Powerdns"] = {}
-                outputs["Powerdns"]["Code"], outputs["Powerdns"]["Output"] = powerdns(
-                    zone_path, origin, cid, new, port, tag)
-    with open(directory / PREPROCESSOR_DIRECTORY / (zone_path.stem + '.json'), 'w') as output_fp:
-        json.dump(outputs, output_fp, indent=2)
+    checked = [impl for impl, (check, _) in port_mappings.items() if check]
+    if new:
+        verify_images([impl + tag for impl in checked])
+    with ThreadPoolExecutor(max_workers=max(len(checked), 1)) as executor:
+        futures = {impl: executor.submit(get_preprocessor(impl), zones, cid, new,
+                                         port_mappings[impl][1], tag)
+                   for impl in checked}
+        results = {impl: future.result() for impl, future in futures.items()}
+    for zone_path, _ in zones:
+        outputs = {}
+        for impl in checked:
+            code, output = results[impl][zone_path.stem]
+            outputs[REGISTRY[impl].directory] = {"Code": code, "Output": output}
+        with open(directory / PREPROCESSOR_DIRECTORY / (zone_path.stem + '.json'), 'w') \
+                as output_fp:
+            json.dump(outputs, output_fp, indent=2)
     return True
 
 
@@ -246,7 +300,7 @@ def preprocessor_check_helper(input_args: Namespace, input_dir: pathlib.Path) ->
     """
     Helper function to check (invalid) zone files with implementations' preprocessors.
     Iterates recursively over the input directory to find ZoneFiles directory and
-    calls check_zone_with_preprocessors function to check a zone file.
+    calls check_zones_with_preprocessors function to check the zone files in batches.
 
     :param input_args: The input arguments
     :param input_dir: The path to the parent directory with ZoneFiles directory.
@@ -258,15 +312,17 @@ def preprocessor_check_helper(input_args: Namespace, input_dir: pathlib.Path) ->
     output_zone_file_dir = input_dir / PREPROCESSOR_DIRECTORY
     if input_zone_files_dir.exists() and input_zone_files_dir.is_dir():
         output_zone_file_dir.mkdir(parents=True, exist_ok=True)
+        manifest = load_manifest(input_zone_files_dir)
         new_container = False
         print(
             f'{datetime.now()}\tStarted checking the zone files in {input_zone_files_dir}')
         start = time.time()
-        for zone_path in input_zone_files_dir.iterdir():
-            if not zone_path.is_file():
-                continue
-            new_container = check_zone_with_preprocessors(
-                input_args, input_dir, zone_path, str(input_args.id), not new_container)
+        zone_paths = [zone_path for zone_path in input_zone_files_dir.iterdir()
+                      if zone_path.is_file()]
+        for index in range(0, len(zone_paths), input_args.batch):
+            new_container = check_zones_with_preprocessors(
+                input_args, input_dir, zone_paths[index:index + input_args.batch],
+                str(input_args.id), not new_container, manifest) or new_container
         print(f'{datetime.now()}\tFinished checking the zone files in'
               f'{input_zone_files_dir} in {time.time() - start}')
     else:
@@ -284,10 +340,10 @@ if __name__ == '__main__':
                         '(default: Results/InvalidZoneFileTests/)')
     parser.add_argument('-id', type=int, default=1, choices=range(1, 6),
                         help='Unique id for all the containers')
-    parser.add_argument('-b', help='Disable Bind.', action="store_true")
-    parser.add_argument('-n', help='Disable Nsd.', action="store_true")
-    parser.add_argument('-k', help='Disable Knot.', action="store_true")
-    parser.add_argument('-p', help='Disable PowerDns.', action="store_true")
+    parser.add_argument('-batch', metavar='BATCH_SIZE', type=int, default=100,
+                        help='The number of zone files each preprocessor checks with one '
+                        'command in its container.')
+    add_disable_arguments(parser, with_preprocessor())
     parser.add_argument(
         '-l', '--latest', help='Test using latest image tag.', action="store_true")
     args = parser.parse_args()
@@ -0,0 +1,182 @@
+"""
+Plans the queries of a zone file from its GRoot equivalence class (EC) names within a
+query budget. Each EC name is assigned to a stratum by what it exercises in the zone:
+    - dname: at or below a DNAME record
+    - delegation: at or below a delegation (NS records other than at the zone origin)
+    - wildcard: synthesized from (or at) a wildcard record
+    - cname: at a CNAME record
+    - depth-<n>: otherwise, by the number of labels below the zone origin (up to 3)
+The (name, type) pairs are then picked from the strata in turn, the query types most
+relevant to each stratum first, until the budget is reached, so that a large zone is
+tested with a bounded number of queries that still covers every stratum.
+The budget is set globally and can be overridden per zone with a JSON file mapping a
+zone id (or "<directory name>/<zone id>") to its budget.
+"""
+
+#!/usr/bin/env python3
+
+import json
+import pathlib
+import sys
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+QUERY_TYPES = ['A', 'NS', 'SOA', 'CNAME', 'DNAME', 'TXT']
+# 200 EC names with all the query types, the largest zone tested without a budget
+DEFAULT_BUDGET = 1200
+MAX_DEPTH = 3
+# The query types tried first for the names of a stratum
+RELEVANT_TYPES = {
+    'dname': ['DNAME', 'A', 'CNAME'],
+    'delegation': ['NS', 'A'],
+    'wildcard': ['TXT', 'A', 'CNAME'],
+    'cname': ['CNAME', 'A'],
+}
+
+
+def _suffixes(name: str) -> Iterator[str]:
+    """Yields the name and the names it is a subdomain of, the longest first."""
+    yield name
+    for index, char in enumerate(name):
+        if char == '.' and index + 1 < len(name):
+            yield name[index + 1:]
+    if name != '.':
+        yield '.'
+
+
+class OwnerIndex:
+    """
+    The owner names of a zone and the owners with a DNAME record or a delegation, built
+    once per zone so that the ancestors of an EC name are found by looking up its suffixes
+    instead of scanning all the owners.
+    """
+
+    def __init__(self, zone_domain: str, owner_types: Dict[str, Set[str]]) -> None:
+        """
+        :param zone_domain: The zone origin
+        :param owner_types: Map from each owner name of the zone (absolute and in lower
+                            case) to its record types
+        """
+        self.zone_domain = zone_domain.lower()
+        self.owner_types = owner_types
+        self.dnames = {owner for owner, types in owner_types.items() if 'DNAME' in types}
+        self.delegations = {owner for owner, types in owner_types.items()
+                            if 'NS' in types and owner != self.zone_domain}
+
+    def ancestors(self, name: str) -> List[str]:
+        """Returns the owners the name is at or below, the closest first."""
+        return [suffix for suffix in _suffixes(name) if suffix in self.owner_types]
+
+
+def stratum(name: str,
+            zone_domain: str,
+            owner_types: Dict[str, Set[str]],
+            index: Optional[OwnerIndex] = None) -> str:
+    """
+    Returns the stratum of the EC name.
+
+    :param name: The EC name (absolute)
+    :param zone_domain: The zone origin
+    :param owner_types: Map from each owner name of the zone (absolute and in lower case)
+                        to its record types
+    :param index: The index of the zone's owners, built from the owners if not given
+    """
+    if index is None:
+        index = OwnerIndex(zone_domain, owner_types)
+    name = name.lower()
+    zone_domain = index.zone_domain
+    ancestors = index.ancestors(name)
+    if any(owner in index.dnames for owner in ancestors):
+        return 'dname'
+    if any(owner in index.delegations for owner in ancestors):
+        return 'delegation'
+    if name.startswith('*.'):
+        return 'wildcard'
+    if name not in owner_types and ancestors:
+        # A wildcard covers the names whose closest existing ancestor has the wildcard child
+        if '*.' + ancestors[0] in owner_types:
+            return 'wildcard'
+    if 'CNAME' in owner_types.get(name, set()):
+        return 'cname'
+    depth = name.count('.') - zone_domain.count('.') if name != zone_domain else 0
+    return f'depth-{min(max(depth, 0), MAX_DEPTH)}'
+
+
+def _stratum_pairs(names: List[str], types: List[str]) -> Iterator[Tuple[str, str]]:
+    """Yields the (name, type) pairs of a stratum, all the names for a type at a time."""
+    for qtype in types:
+        for name in names:
+            yield name, qtype
+
+
+def plan_queries(ec_names: List[str],
+                 zone_domain: str,
+                 owner_types: Dict[str, Set[str]],
+                 budget: int) -> List[Tuple[str, str]]:
+    """
+    Returns the (name, type) pairs to query. All the pairs are returned (in the order of
+    the EC names) if they fit in the budget; otherwise up to `budget` pairs are picked from
+    the strata in turn.
+
+    :param ec_names: The EC names within the zone
+    :param zone_domain: The zone origin
+    :param owner_types: Map from each owner name of the zone (absolute and in lower case)
+                        to its record types
+    :param budget: The maximum number of queries
+    """
+    if len(ec_names) * len(QUERY_TYPES) <= budget:
+        return [(name, qtype) for name in ec_names for qtype in QUERY_TYPES]
+    index = OwnerIndex(zone_domain, owner_types)
+    strata = OrderedDict()  # type: Dict[str, List[str]]
+    for name in ec_names:
+        strata.setdefault(stratum(name, zone_domain, owner_types, index), []).append(name)
+    iterators = []
+    for key, names in strata.items():
+        relevant = RELEVANT_TYPES.get(key, [])
+        types = relevant + [qtype for qtype in QUERY_TYPES if qtype not in relevant]
+        iterators.append(_stratum_pairs(names, types))
+    planned = []  # type: List[Tuple[str, str]]
+    while iterators and len(planned) < budget:
+        for iterator in list(iterators):
+            pair = next(iterator, None)
+            if pair is None:
+                iterators.remove(iterator)
+                continue
+            planned.append(pair)
+            if len(planned) == budget:
+                break
+    return planned
+
+
+class QueryBudgets:
+    """
+    The global query budget and the per-zone overrides.
+    """
+
+    def __init__(self, budget: int = DEFAULT_BUDGET,
+                 path: Optional[pathlib.Path] = None) -> None:
+        """
+        :param budget: The budget of the zones without an override
+        :param path: The JSON file mapping a zone id (or "<directory name>/<zone id>")
+                     to its budget, if any
+        """
+        self.budget = budget
+        self.overrides = {}  # type: Dict[str, int]
+        if path:
+            with open(path, 'r') as budgets_fp:
+                try:
+                    self.overrides = {key: int(value)
+                                      for key, value in json.load(budgets_fp).items()}
+                except (ValueError, AttributeError) as error:
+                    sys.exit(f'The query budget file {path} is not a JSON object of '
+                             f'zone ids to budgets: {error}')
+
+    def get(self, parent_dir: pathlib.Path, zoneid: str) -> int:
+        """
+        Returns the budget of the zone.
+
+        :param parent_dir: The path to the directory containing the zone files directory
+        :param zoneid: The unique zone identifier
+        """
+        return self.overrides.get(f'{parent_dir.name}/{zoneid}',
+                                  self.overrides.get(zoneid, self.budget))
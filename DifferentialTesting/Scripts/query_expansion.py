@@ -0,0 +1,125 @@
+"""
+Derives extra queries from the contents of a zone file, to be sent to the implementations
+in addition to the Zen generated queries while the zone file is loaded, as loading the
+zone file is the most expensive step of a test. The queries are of the following kinds:
+    - owner: each owner name with each of its record types and a type it does not have
+    - near-miss: a non-existent sibling of each owner name
+    - wildcard: names synthesized from each wildcard record, one and two labels deep
+    - below: a name below each delegation, DNAME and CNAME owner name
+The kinds are taken in turn up to the maximum number of extra queries of a zone, so that
+each kind is covered even when the maximum is small.
+"""
+
+#!/usr/bin/env python3
+
+import pathlib
+from typing import Any, Dict, Iterator, List, Set, Tuple
+
+import dns.exception
+import dns.name
+
+from Scripts.zone_features import get_owner_types
+
+# The type queried at each owner name in addition to its own types (the first one missing)
+ABSENT_TYPES = ['A', 'TXT']
+NEAR_MISS_SUFFIX = '-x'
+SYNTHESIZED_LABEL = 'expanded'
+
+
+def _is_below(name: str, ancestor: str) -> bool:
+    """Returns whether the name is a subdomain of the ancestor."""
+    return name.endswith('.' + ancestor) or (ancestor == '.' and name != '.')
+
+
+def _valid(name: str) -> bool:
+    """Returns whether the name is a valid domain name."""
+    try:
+        dns.name.from_text(name)
+        return True
+    except dns.exception.DNSException:
+        return False
+
+
+def _owner_queries(owner_types: Dict[str, Set[str]]) -> Iterator[Tuple[str, str]]:
+    for owner in sorted(owner_types):
+        types = sorted(owner_types[owner])
+        absent = [rtype for rtype in ABSENT_TYPES if rtype not in owner_types[owner]]
+        for rtype in types + absent[:1]:
+            yield owner, rtype
+
+
+def _near_miss_queries(owner_types: Dict[str, Set[str]],
+                       zone_domain: str) -> Iterator[Tuple[str, str]]:
+    for owner in sorted(owner_types):
+        if owner == zone_domain or owner.startswith('*.'):
+            continue
+        label, parent = owner.split('.', 1)
+        sibling = f'{label}{NEAR_MISS_SUFFIX}.{parent}'
+        if sibling not in owner_types:
+            yield sibling, 'A'
+
+
+def _wildcard_queries(owner_types: Dict[str, Set[str]]) -> Iterator[Tuple[str, str]]:
+    for owner in sorted(owner_types):
+        if not owner.startswith('*.'):
+            continue
+        synthesized = f'{SYNTHESIZED_LABEL}.{owner[2:]}'
+        for name in (synthesized, f'{SYNTHESIZED_LABEL}.{synthesized}'):
+            if name in owner_types:
+                continue
+            for rtype in sorted(owner_types[owner]) + ['A']:
+                yield name, rtype
+
+
+def _below_queries(owner_types: Dict[str, Set[str]],
+                   zone_domain: str) -> Iterator[Tuple[str, str]]:
+    for owner in sorted(owner_types):
+        types = owner_types[owner]
+        if not ({'DNAME', 'CNAME'} & types or ('NS' in types and owner != zone_domain)):
+            continue
+        name = f'{SYNTHESIZED_LABEL}.{owner}'
+        if name in owner_types:
+            continue
+        yield name, 'A'
+        if 'NS' in types and owner != zone_domain:
+            yield name, 'NS'
+        if 'DNAME' in types:
+            yield name, 'CNAME'
+
+
+def expand_queries(zone_path: pathlib.Path,
+                   zone_domain: str,
+                   queries: List[Dict[str, Any]],
+                   limit: int) -> List[Dict[str, Any]]:
+    """
+    Returns up to `limit` extra queries derived from the zone file that are not among the
+    input queries. Each extra query has the "Expansion" key with its kind.
+
+    :param zone_path: The path to the zone file
+    :param zone_domain: The zone origin
+    :param queries: The queries of the zone file
+    :param limit: The maximum number of extra queries
+    """
+    zone_domain = zone_domain.lower()
+    owner_types = {owner: types
+                   for owner, types in get_owner_types(zone_path, zone_domain).items()
+                   if owner == zone_domain or _is_below(owner, zone_domain)}
+    seen = {(query["Query"]["Name"].lower(), query["Query"]["Type"]) for query in queries}
+    kinds = [('owner', _owner_queries(owner_types)),
+             ('near-miss', _near_miss_queries(owner_types, zone_domain)),
+             ('wildcard', _wildcard_queries(owner_types)),
+             ('below', _below_queries(owner_types, zone_domain))]
+    expanded = []  # type: List[Dict[str, Any]]
+    while kinds and len(expanded) < limit:
+        for kind, pairs in list(kinds):
+            for name, rtype in pairs:
+                if (name, rtype) not in seen and _valid(name):
+                    seen.add((name, rtype))
+                    expanded.append({"Query": {"Name": name, "Type": rtype},
+                                     "Expansion": kind})
+                    break
+            else:
+                kinds.remove((kind, pairs))
+            if len(expanded) == limit:
+                break
+    return expanded
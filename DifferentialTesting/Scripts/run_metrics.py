@@ -0,0 +1,242 @@
+"""
+Records the metrics of a test run and writes them periodically, while the run is going on,
+to two files with the same prefix:
+    - <prefix>.prom: the current values in the Prometheus text format (replaced each time),
+      which can be exposed with the textfile collector of the node exporter
+    - <prefix>.jsonl: a JSON line with the current values appended each time
+The metrics are:
+    - the time each implementation takes to load (prepare) a zone file
+    - the time until each implementation first answers a query after the load began
+    - the latency of the queries answered by each implementation
+    - the queries of each implementation that timed out or failed
+    - the container restarts of each implementation
+    - the zones tested, in total and per minute
+    - the number of items waiting in the queue of each stage, if the run has stages
+"""
+
+#!/usr/bin/env python3
+
+import json
+import os
+import pathlib
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+import dns.message
+
+
+DEFAULT_INTERVAL = 60
+# The upper bounds (in seconds) of the histogram buckets
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5]
+PREPARE_BUCKETS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 60, 120]
+PREFIX = 'ferret_'
+
+
+class Histogram:
+    """
+    The cumulative bucket counts, the sum and the count of the observed values.
+    """
+
+    def __init__(self, buckets: List[float]) -> None:
+        """
+        :param buckets: The upper bounds of the buckets
+        """
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """Adds the value."""
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def to_json(self) -> Dict[str, Any]:
+        """Returns the histogram as a JSON object."""
+        return {"Count": self.count, "Sum": round(self.sum, 6),
+                "Buckets": {str(bound): count for bound, count in zip(self.buckets, self.counts)}}
+
+    def to_prometheus(self, name: str, labels: str) -> List[str]:
+        """Returns the sample lines of the histogram."""
+        lines = [f'{name}_bucket{{{labels},le="{bound}"}} {count}'
+                 for bound, count in zip(self.buckets, self.counts)]
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum:.6f}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class ImplementationMetrics:
+    """
+    The metrics of one implementation.
+    """
+
+    def __init__(self) -> None:
+        self.prepare = Histogram(PREPARE_BUCKETS)
+        self.ready = Histogram(PREPARE_BUCKETS)
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.timeouts = 0
+        self.errors = 0
+        self.restarts = 0
+
+    def to_json(self) -> Dict[str, Any]:
+        """Returns the metrics as a JSON object."""
+        return {"Prepare": self.prepare.to_json(), "Ready": self.ready.to_json(),
+                "QueryLatency": self.latency.to_json(), "Timeouts": self.timeouts,
+                "Errors": self.errors, "Restarts": self.restarts}
+
+
+class RunMetrics:
+    """
+    The metrics of a test run, which are written every `interval` seconds by a background
+    thread. All the methods can be called from multiple threads.
+    """
+
+    def __init__(self,
+                 prefix: pathlib.Path,
+                 run: str,
+                 interval: float = DEFAULT_INTERVAL,
+                 queue_depths: Optional[Callable[[], Dict[str, int]]] = None) -> None:
+        """
+        :param prefix: The path of the metrics files without the extensions
+        :param run: The run the metrics are labelled with (the container id)
+        :param interval: The number of seconds between two writes
+        :param queue_depths: Returns the number of items waiting in each stage, if any
+        """
+        self.prom_path = prefix.with_name(prefix.name + '.prom')
+        self.jsonl_path = prefix.with_name(prefix.name + '.jsonl')
+        self.run = run
+        self.interval = interval
+        self.queue_depths = queue_depths
+        self.implementations = {}  # type: Dict[str, ImplementationMetrics]
+        self.zones = 0
+        self.start = time.time()
+        self.last_write = (self.start, 0)
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._write_periodically, daemon=True)
+        # Start a new JSON lines file for the run
+        if self.jsonl_path.exists():
+            self.jsonl_path.unlink()
+
+    def _implementation(self, impl: str) -> ImplementationMetrics:
+        if impl not in self.implementations:
+            self.implementations[impl] = ImplementationMetrics()
+        return self.implementations[impl]
+
+    def observe_prepare(self, prepare_times: Dict[str, float]) -> None:
+        """Adds the seconds each implementation took to load a zone file."""
+        with self.lock:
+            for impl, seconds in prepare_times.items():
+                self._implementation(impl).prepare.observe(seconds)
+
+    def observe_ready(self, impl: str, seconds: float) -> None:
+        """Adds the seconds from the start of loading a zone file to the first response."""
+        with self.lock:
+            self._implementation(impl).ready.observe(seconds)
+
+    def observe_query(self, impl: str, seconds: float, response: Any) -> None:
+        """
+        Adds a query sent to the implementation.
+
+        :param impl: The implementation
+        :param seconds: The time taken by the query
+        :param response: The DNS response or the error message returned by the querier
+        """
+        with self.lock:
+            metrics = self._implementation(impl)
+            if isinstance(response, dns.message.Message):
+                metrics.latency.observe(seconds)
+            elif response == "No response":
+                metrics.timeouts += 1
+            else:
+                metrics.errors += 1
+
+    def restarted(self, impl: str) -> None:
+        """Counts a restart of the implementation's container."""
+        with self.lock:
+            self._implementation(impl).restarts += 1
+
+    def zone_done(self) -> None:
+        """Counts a tested zone."""
+        with self.lock:
+            self.zones += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Returns the current values of the metrics as a JSON object."""
+        queue_depths = self.queue_depths() if self.queue_depths else {}
+        now = time.time()
+        with self.lock:
+            elapsed = max(now - self.start, 1e-9)
+            last_time, last_zones = self.last_write
+            self.last_write = (now, self.zones)
+            return {
+                "Time": datetime.now().isoformat(),
+                "Run": self.run,
+                "Elapsed": round(elapsed, 3),
+                "Zones": self.zones,
+                "ZonesPerMinute": round(self.zones * 60 / elapsed, 3),
+                "IntervalZonesPerMinute": round(
+                    (self.zones - last_zones) * 60 / max(now - last_time, 1e-9), 3),
+                "QueueDepth": queue_depths,
+                "Implementations": {impl: metrics.to_json()
+                                    for impl, metrics in sorted(self.implementations.items())},
+            }
+
+    def to_prometheus(self, snapshot: Dict[str, Any]) -> str:
+        """Returns the metrics in the Prometheus text format."""
+        run = f'run="{self.run}"'
+        lines = [f'# TYPE {PREFIX}zones_total counter',
+                 f'{PREFIX}zones_total{{{run}}} {snapshot["Zones"]}',
+                 f'# TYPE {PREFIX}zones_per_minute gauge',
+                 f'{PREFIX}zones_per_minute{{{run}}} {snapshot["IntervalZonesPerMinute"]}',
+                 f'# TYPE {PREFIX}queue_depth gauge']
+        lines += [f'{PREFIX}queue_depth{{{run},stage="{stage}"}} {depth}'
+                  for stage, depth in snapshot["QueueDepth"].items()]
+        with self.lock:
+            implementations = sorted(self.implementations.items())
+            histograms = (('prepare_seconds', 'prepare'), ('ready_seconds', 'ready'),
+                          ('query_latency_seconds', 'latency'))
+            for name, attribute in histograms:
+                lines.append(f'# TYPE {PREFIX}{name} histogram')
+                for impl, metrics in implementations:
+                    lines += getattr(metrics, attribute).to_prometheus(
+                        PREFIX + name, f'{run},implementation="{impl}"')
+            counters = (('query_timeouts_total', 'timeouts'), ('query_errors_total', 'errors'),
+                        ('restarts_total', 'restarts'))
+            for name, attribute in counters:
+                lines.append(f'# TYPE {PREFIX}{name} counter')
+                lines += [f'{PREFIX}{name}{{{run},implementation="{impl}"}} '
+                          f'{getattr(metrics, attribute)}' for impl, metrics in implementations]
+        return '\n'.join(lines) + '\n'
+
+    def write(self) -> None:
+        """Writes the current values of the metrics to the metrics files."""
+        snapshot = self.snapshot()
+        # Replaced atomically, as the textfile collector may read it at any time
+        tmp_path = self.prom_path.with_name(f'{self.prom_path.name}.{os.getpid()}.tmp')
+        with open(tmp_path, 'w') as prom_fp:
+            prom_fp.write(self.to_prometheus(snapshot))
+        os.replace(tmp_path, self.prom_path)
+        with open(self.jsonl_path, 'a') as jsonl_fp:
+            jsonl_fp.write(json.dumps(snapshot) + '\n')
+
+    def _write_periodically(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def start_writing(self) -> None:
+        """Starts writing the metrics every `interval` seconds."""
+        self.thread.start()
+
+    def close(self) -> None:
+        """Stops the periodic writes and writes the final values of the metrics."""
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.write()
@@ -0,0 +1,99 @@
+"""
+Known-issue suppression list applied when comparing the responses.
+A suppression file is a JSON list of rules; a test that resulted in a difference and
+matches any rule is only counted (per rule) and is not written to the differences.
+Each rule has a "Name" and any of the following conditions, all of which must hold:
+    - "Alone": The implementations that together form one of the groups, for example
+      ["maradns"] for the tests in which only MaraDNS disagrees
+    - "Groups": All the groups of the test, for example [["technitium"], ["bind", "nsd"]]
+    - "ModelCase": The Zen model case of the test
+    - "QueryType": The query type of the test
+    - "Signature": Diff signature entries that must all be in the signature of the test
+      (see diff_signature.py), for example ["rcode:NOERROR>SERVFAIL"]
+"""
+
+#!/usr/bin/env python3
+
+import json
+import pathlib
+import sys
+from collections import Counter
+from typing import Any, Dict, FrozenSet, List, NamedTuple, Optional
+
+from Scripts.diff_signature import diff_signature
+from Scripts.fingerprints import fingerprint_differences
+
+
+class Suppression(NamedTuple):
+    """
+    A rule of the suppression file (None or empty for the conditions that are not set).
+    """
+    name: str
+    alone: Optional[FrozenSet[str]]
+    groups: Optional[FrozenSet[FrozenSet[str]]]
+    model_case: Optional[str]
+    query_type: Optional[str]
+    signature: FrozenSet[str]
+
+
+class SuppressionList:
+    """
+    The rules of a suppression file and the number of tests suppressed by each rule.
+    """
+
+    def __init__(self, path: pathlib.Path) -> None:
+        """
+        Loads the rules of the suppression file.
+
+        :param path: The path to the suppression file
+        """
+        self.rules = []  # type: List[Suppression]
+        self.counts = Counter()  # type: Counter
+        with open(path, 'r') as suppressions_fp:
+            try:
+                rules = json.load(suppressions_fp)
+            except ValueError as error:
+                sys.exit(f'The suppression file {path} is not valid JSON: {error}')
+        for index, rule in enumerate(rules):
+            self.rules.append(Suppression(
+                rule.get("Name", f'Rule {index}'),
+                frozenset(rule["Alone"]) if "Alone" in rule else None,
+                frozenset(frozenset(grp) for grp in rule["Groups"]) if "Groups" in rule else None,
+                rule.get("ModelCase"),
+                rule.get("QueryType"),
+                frozenset(rule.get("Signature", []))))
+
+    def suppressed(self, difference: Dict[str, Any], model_case: str = '-') -> bool:
+        """
+        Returns whether the test matches a rule, counting the test for the first such rule.
+
+        :param difference: The difference of the test as in the Differences files
+        :param model_case: The Zen model case of the test ("-" if not available)
+        """
+        fingerprinted = fingerprint_differences([difference], {})
+        if not fingerprinted:
+            return False
+        groups = frozenset(frozenset(grp) for grp in fingerprinted[0][0][1])
+        signature = None  # type: Optional[FrozenSet[str]]
+        for rule in self.rules:
+            if rule.query_type is not None and rule.query_type != difference["Query Type"]:
+                continue
+            if rule.model_case is not None and rule.model_case != model_case:
+                continue
+            if rule.alone is not None and rule.alone not in groups:
+                continue
+            if rule.groups is not None and rule.groups != groups:
+                continue
+            if rule.signature:
+                # The signature is only computed when a rule needs it
+                if signature is None:
+                    signature = diff_signature(difference)
+                if not rule.signature <= signature:
+                    continue
+            self.counts[rule.name] += 1
+            return True
+        return False
+
+    def summary(self) -> str:
+        """Returns the number of tests suppressed by each rule as a string."""
+        return str(dict(self.counts.most_common()))
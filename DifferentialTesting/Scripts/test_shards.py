@@ -0,0 +1,230 @@
+"""
+JSON-Lines shards of tests as an alternative to one file per test.
+A directory in the shard format (for example, ZenTests) has the tests in shard files
+(shard-00000.jsonl, ...) with one test per line, {"Id": ..., "Data": ...}, and a
+ShardIndex.json file with the shard, the byte offset and the length of each test for
+random access by test id. The data of a test is the JSON content of the test file or,
+for other files (for example, zone files), the text of the file.
+The scripts that read ZenTests and ZenZoneFiles accept either layout.
+
+usage: python3 -m Scripts.test_shards [-h] (-pack | -unpack) [-size SHARD_SIZE]
+                                      DIRECTORY_PATH
+
+positional arguments:
+  DIRECTORY_PATH    The path to the directory with the tests (for example, ZenTests).
+
+optional arguments:
+  -h, --help        show this help message and exit
+  -pack             Convert the test files of the directory to shards and remove them.
+                    (default: False)
+  -unpack           Convert the shards of the directory to test files and remove them.
+                    (default: False)
+  -size SHARD_SIZE  The number of tests in each shard when packing. (default: 10000)
+"""
+
+#!/usr/bin/env python3
+
+import json
+import os
+import pathlib
+import sys
+from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+SHARD_INDEX = "ShardIndex.json"
+SHARD_PATTERN = "shard-*.jsonl"
+SHARD_SIZE = 10000
+
+
+def is_sharded(dir_path: pathlib.Path) -> bool:
+    """Returns whether the directory is in the shard format."""
+    return (dir_path / SHARD_INDEX).exists()
+
+
+class ShardWriter:
+    """
+    Writes tests to the shards of a directory.
+    The index is written when the writer is closed.
+    """
+
+    def __init__(self, dir_path: pathlib.Path, suffix: str = '.json',
+                 shard_size: int = SHARD_SIZE) -> None:
+        """
+        Removes the existing shards of the directory, if any.
+
+        :param dir_path: The path to the directory to write the shards to
+        :param suffix: The suffix of the test files in the directory layout
+        :param shard_size: The number of tests in each shard
+        """
+        dir_path.mkdir(parents=True, exist_ok=True)
+        for shard in dir_path.glob(SHARD_PATTERN):
+            shard.unlink()
+        if is_sharded(dir_path):
+            (dir_path / SHARD_INDEX).unlink()
+        self.dir_path = dir_path
+        self.suffix = suffix
+        self.shard_size = shard_size
+        self.tests = {}  # type: Dict[str, Tuple[str, int, int]]
+        self.shard_fp = None  # type: Optional[BinaryIO]
+        self.shard_name = ''
+
+    def write(self, test_id: str, data: Any) -> None:
+        """
+        Appends the test to the current shard, starting a new shard if it is full.
+
+        :param test_id: The unique test identifier
+        :param data: The JSON content or the text of the test
+        """
+        if len(self.tests) % self.shard_size == 0:
+            if self.shard_fp:
+                self.shard_fp.close()
+            self.shard_name = f'shard-{len(self.tests) // self.shard_size:05d}.jsonl'
+            self.shard_fp = open(self.dir_path / self.shard_name, 'wb')
+        line = (json.dumps({"Id": test_id, "Data": data}, separators=(',', ':')) + '\n') \
+            .encode('utf-8')
+        self.tests[test_id] = (self.shard_name, self.shard_fp.tell(), len(line))
+        self.shard_fp.write(line)
+
+    def close(self) -> None:
+        """Closes the current shard and writes the index."""
+        if self.shard_fp:
+            self.shard_fp.close()
+        tmp_path = self.dir_path / f'{SHARD_INDEX}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as index_fp:
+            json.dump({"Suffix": self.suffix, "Tests": self.tests}, index_fp,
+                      separators=(',', ':'))
+        os.replace(tmp_path, self.dir_path / SHARD_INDEX)
+
+
+class ShardReader:
+    """
+    Reads the tests from the shards of a directory, sequentially or by test id.
+    """
+
+    def __init__(self, dir_path: pathlib.Path) -> None:
+        """
+        :param dir_path: The path to the directory with the shards
+        """
+        self.dir_path = dir_path
+        with open(dir_path / SHARD_INDEX, 'r') as index_fp:
+            index = json.load(index_fp)
+        self.suffix = index["Suffix"]  # type: str
+        self.tests = index["Tests"]  # type: Dict[str, List[Any]]
+        self.shard_fps = {}  # type: Dict[str, BinaryIO]
+
+    def ids(self) -> List[str]:
+        """Returns the ids of the tests."""
+        return list(self.tests)
+
+    def get(self, test_id: str) -> Any:
+        """Returns the data of the test with the input id."""
+        shard, offset, length = self.tests[test_id]
+        if shard not in self.shard_fps:
+            self.shard_fps[shard] = open(self.dir_path / shard, 'rb')
+        self.shard_fps[shard].seek(offset)
+        return json.loads(self.shard_fps[shard].read(length))["Data"]
+
+    def __iter__(self) -> Iterator[Tuple[str, Any]]:
+        """Yields the id and the data of each test, reading the shards sequentially."""
+        for shard in sorted({shard for shard, _, _ in self.tests.values()}):
+            with open(self.dir_path / shard, 'rb') as shard_fp:
+                for line in shard_fp:
+                    test = json.loads(line)
+                    # Skip the tests replaced in a later shard
+                    if self.tests.get(test["Id"], [None])[0] == shard:
+                        yield test["Id"], test["Data"]
+
+    def close(self) -> None:
+        """Closes the shards opened for random access."""
+        for shard_fp in self.shard_fps.values():
+            shard_fp.close()
+        self.shard_fps = {}
+
+
+def read_tests(dir_path: pathlib.Path, suffix: str = '.json') -> Iterator[Tuple[str, Any]]:
+    """
+    Yields the id and the data of each test of the directory in either layout.
+
+    :param dir_path: The path to the directory with the tests
+    :param suffix: The suffix of the test files in the directory layout
+    """
+    if is_sharded(dir_path):
+        yield from ShardReader(dir_path)
+        return
+    for test in dir_path.iterdir():
+        if test.is_file() and test.suffix == suffix:
+            with open(test, 'r') as test_fp:
+                yield test.stem, json.load(test_fp) if suffix == '.json' else test_fp.read()
+
+
+def pack(dir_path: pathlib.Path, shard_size: int = SHARD_SIZE) -> int:
+    """
+    Converts the test files of the directory to shards, removes the test files and
+    returns the number of tests.
+
+    :param dir_path: The path to the directory with the test files
+    :param shard_size: The number of tests in each shard
+    """
+    files = sorted((test for test in dir_path.iterdir()
+                    if test.is_file() and test.suffix in ('.json', '.txt')
+                    and test.name != SHARD_INDEX),
+                   key=lambda test: (len(test.stem), test.stem))
+    if not files:
+        return 0
+    suffix = files[0].suffix
+    files = [test for test in files if test.suffix == suffix]
+    writer = ShardWriter(dir_path, suffix, shard_size)
+    for test in files:
+        with open(test, 'r') as test_fp:
+            writer.write(test.stem, json.load(test_fp) if suffix == '.json' else test_fp.read())
+    writer.close()
+    for test in files:
+        test.unlink()
+    return len(writer.tests)
+
+
+def unpack(dir_path: pathlib.Path) -> int:
+    """
+    Converts the shards of the directory to test files, removes the shards and
+    returns the number of tests.
+
+    :param dir_path: The path to the directory with the shards
+    """
+    reader = ShardReader(dir_path)
+    for test_id, data in reader:
+        with open(dir_path / (test_id + reader.suffix), 'w') as test_fp:
+            if reader.suffix == '.json':
+                json.dump(data, test_fp, indent=2)
+            else:
+                test_fp.write(data)
+    (dir_path / SHARD_INDEX).unlink()
+    for shard in dir_path.glob(SHARD_PATTERN):
+        shard.unlink()
+    return len(reader.tests)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter,
+                            description='Converts a directory of tests between one file per '
+                            'test and JSON-Lines shards.')
+    parser.add_argument('Path', metavar='DIRECTORY_PATH',
+                        help='The path to the directory with the tests (for example, ZenTests).')
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument('-pack', action="store_true",
+                      help='Convert the test files of the directory to shards and remove them.')
+    mode.add_argument('-unpack', action="store_true",
+                      help='Convert the shards of the directory to test files and remove them.')
+    parser.add_argument('-size', metavar='SHARD_SIZE', type=int, default=SHARD_SIZE,
+                        help='The number of tests in each shard when packing.')
+    args = parser.parse_args()
+    directory_path = pathlib.Path(args.Path)
+    if not directory_path.is_dir():
+        sys.exit(f'The input path {directory_path} is not a directory.')
+    if args.pack:
+        if is_sharded(directory_path):
+            sys.exit(f'The directory {directory_path} is already in the shard format.')
+        print(f'Packed {pack(directory_path, args.size)} tests')
+    else:
+        if not is_sharded(directory_path):
+            sys.exit(f'There is no {SHARD_INDEX} in {directory_path}.')
+        print(f'Unpacked {unpack(directory_path)} tests')
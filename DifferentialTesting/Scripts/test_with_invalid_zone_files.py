@@ -6,11 +6,16 @@ response to flag differences (only when one implementation is passed for testing
 
 usage: test_with_invalid_zone_files.py [-h] [-path DIRECTORY_PATH]
                                        [-id {1,2,3,4,5}] [-b] [-n] [-k] [-p] [-l]
+                                       [-check] [-batch BATCH_SIZE] [-j JOBS]
+                                       [-budget QUERY_BUDGET] [-budgets BUDGETS_PATH]
+                                       [-network NETWORK_NAME] [-triage | -db | -stream]
+                                       [-suppress SUPPRESSIONS_PATH] [-metrics SECONDS]
 
 optional arguments:
   -h, --help            show this help message and exit
   -path DIRECTORY_PATH  The path to the directory containing ZoneFiles and PreprocessorOutputs
-                         directories; looks for those two directories recursively
+                         directories (only ZoneFiles with -check); looks for those two
+                         directories recursively
                          (default: Results/InvalidZoneFileTests/)
   -id {1,2,3,4,5}       Unique id for all the containers (default: 1)
   -b                    Disable Bind. (default: False)
@@ -18,34 +23,85 @@ optional arguments:
   -k                    Disable Knot. (default: False)
   -p                    Disable PowerDns. (default: False)
   -l, --latest          Test using latest image tag. (default: False)
+  -check                Check the zone files with the preprocessors in the containers used
+                        for testing, a batch at a time right before testing them, instead
+                        of running preprocessor_checks.py first. (default: False)
+  -batch BATCH_SIZE     The number of zone files GRoot generates the equivalence classes
+                        of (and, with -check, the preprocessors check) at a time, ahead of
+                        testing them. (default: 64)
+  -j JOBS               The number of GRoot processes to run in parallel in the GRoot
+                        container. (default: Number of CPUs)
+  -budget QUERY_BUDGET  The maximum number of queries generated from the equivalence
+                        classes of a zone file. (default: 1200)
+  -budgets BUDGETS_PATH A JSON file mapping a zone id (or "<directory name>/<zone id>") to
+                        its query budget, overriding -budget. (default: None)
+  -network NETWORK_NAME Attach the containers to this Docker bridge network (created if
+                        missing) and query their IPs directly instead of the published
+                        host ports (Linux hosts only). (default: Use published host ports)
+  -triage               Update the fingerprints (Fingerprints.json) incrementally while
+                        testing. (default: False)
+  -db                   Write the differences to the differences database
+                        (Differences.sqlite3) instead of the Differences directory.
+                        (default: False)
+  -stream               Write the differences to a compact Differences stream file
+                        (Differences_<id>.bin) instead of the Differences directory.
+                        (default: False)
+  -suppress SUPPRESSIONS_PATH
+                        The suppression file with the known differences, which are only
+                        counted (in the log file) and not written. (default: None)
+  -metrics SECONDS      Write the run metrics every SECONDS seconds to <id>_metrics.prom
+                        and <id>_metrics.jsonl in each directory tested.
+                        (default: No run metrics)
 """
 #!/usr/bin/env python3
 
 import json
 import os
 import pathlib
-import platform
+import queue
+import shutil
 import subprocess
 import sys
+import tempfile
+import threading
 import time
 from argparse import (SUPPRESS, ArgumentDefaultsHelpFormatter, ArgumentParser,
                       Namespace)
 from datetime import datetime
-from typing import Any, Dict, List, TextIO, Tuple
+from typing import Any, Dict, Iterable, List, Optional, Set, TextIO, Tuple
 
 import dns.query
 import dns.rdataclass
 import dns.rdatatype
 import dns.resolver
 
-from Scripts.preprocessor_checks import PREPROCESSOR_DIRECTORY, delete_container
+from Implementations.registry import (REGISTRY, add_disable_arguments,
+                                     with_preprocessor)
+from Scripts.differences_db import DifferencesDB
+from Scripts.differences_stream import DifferencesWriter, stream_path
+from Scripts.fingerprints import FingerprintState
+from Scripts.image_builds import (GROOT_BUILD, BuildScheduler, load_image_manifest,
+                                  verify_images)
+from Scripts.preprocessor_checks import (BATCH_DIRECTORY, PREPROCESSOR_DIRECTORY,
+                                         check_zones_with_preprocessors,
+                                         delete_container, get_ports)
+from Scripts.query_budget import DEFAULT_BUDGET, QUERY_TYPES, QueryBudgets, plan_queries
+from Scripts.run_metrics import RunMetrics
+from Scripts.suppressions import SuppressionList
 from Scripts.test_with_valid_zone_files import (DIFFERENCES, QUERY_RESPONSES,
-                                                ZONE_FILES, group_responses,
-                                                groups_to_json,
-                                                prepare_containers, querier,
-                                                start_containers)
+                                                ZONE_FILES, get_addresses,
+                                                group_responses, groups_to_json,
+                                                prepare_containers,
+                                                restart_implementation,
+                                                start_containers, timed_querier)
+from Scripts.zone_features import get_owner_types
+from Scripts.zone_manifest import ZoneManifest, load_manifest
 
 EQUIVALENCE_CLASSES_DIR = "EquivalenceClassNames/"
+# The directory in the GRoot container the zone files of a batch are copied to
+GROOT_BATCH_DIRECTORY = "/home/groot/groot/build/bin/batch"
+# The images built (or found up to date) by this run
+CHECKED_IMAGES = set()  # type: Set[str]
 
 
 def get_ports_for_invalid_zones(input_args: Namespace) -> Dict[str, Tuple[bool, int]]:
@@ -55,76 +111,187 @@ def get_ports_for_invalid_zones(input_args: Namespace) -> Dict[str, Tuple[bool,
 
     :param input_args: The input arguments
     """
-    implementations = {}
-    implementations['bind'] = (not input_args.b, 8000)
-    implementations['nsd'] = (not input_args.n, 8100)
-    implementations['knot'] = (not input_args.k, 8200)
-    implementations['powerdns'] = (not input_args.p, 8300)
-    return implementations
+    return get_ports(input_args)
 
 
 def generate_groot_image(logger: TextIO) -> None:
     """
-    Generates the GRoot image required for generation of queries using equivalence classes.
+    Generates the GRoot image required for generation of queries using equivalence classes,
+    unless the image is up to date or was already checked by this run.
     Exits the program if the image generation is not successful.
 
     :param logger: The log file pointer
     """
-    run_cmd = ['docker', 'build', '-t',
-               "groot:ferret", '-f', "GRoot/Dockerfile", '.']
-    logger.write(f'{datetime.now()}\tBuilding GRoot image..\n')
-    if platform.system() == 'Linux':
-        my_env = os.environ.copy()
-        my_env['DOCKER_BUILDKIT'] = '1'
-        cmd_output = subprocess.run(
-            run_cmd, env=my_env, stdout=subprocess.PIPE, check=True)
-    else:
-        cmd_output = subprocess.run(
-            run_cmd, stdout=subprocess.PIPE, check=True)
-    if cmd_output.returncode != 0:
+    if GROOT_BUILD.image in CHECKED_IMAGES:
+        return
+    if GROOT_BUILD.image in load_image_manifest():
+        # Imported from a bundle, so it is verified instead of built
+        verify_images([GROOT_BUILD.image])
+    elif BuildScheduler(1, logger).run([GROOT_BUILD]):
         sys.exit('Error in building image for GRoot.\n')
-    logger.write(f'{datetime.now()}\tFinished building GRoot image..\n')
+    CHECKED_IMAGES.add(GROOT_BUILD.image)
 
 
-def generate_ecs(parent_dir: pathlib.Path, zoneid: str) -> None:
+def generate_ecs(parent_dir: pathlib.Path, zoneids: Iterable[str], jobs: int = 1) -> None:
     """
-    Generates equivalence class domain names for the input zone file.
-    Uses GRoot container to generate the names by copying in the zone file
-        and copying out the generated file.
+    Generates equivalence class domain names for the input zone files.
+    Uses GRoot container to generate the names by copying in the zone files as a batch,
+    running GRoot on each zone file in its own sub-directory (up to `jobs` at a time) with
+    a single command, and copying out the generated files.
 
-    :param dir: The parent directory to the directory containing zone files
-    :param zoneid: The zone to consider
+    :param parent_dir: The parent directory to the directory containing zone files
+    :param zoneids: The zones to consider
+    :param jobs: The number of GRoot processes to run in parallel in the container
     """
-    if (parent_dir / EQUIVALENCE_CLASSES_DIR / (zoneid + '.txt')).exists():
+    zoneids = [zoneid for zoneid in zoneids
+               if not (parent_dir / EQUIVALENCE_CLASSES_DIR / (zoneid + '.txt')).exists()]
+    if not zoneids:
         return
-    subprocess.run(['docker', 'cp', parent_dir / ZONE_FILES / (zoneid + '.txt'),
-                    'groot_server:/home/groot/groot/build/bin/zonefile/'],
-                   stdout=subprocess.PIPE, check=False)
-    subprocess.run(['docker', 'exec', 'groot_server', 'sudo',
-                    'python3', '/home/groot/groot/metadata_gen.py', zoneid + '.txt'], check=False)
-    subprocess.run(['docker', 'exec', 'groot_server',
-                    'build/bin/groot', 'build/bin/zonefile/', '-le'],
-                   stdout=subprocess.PIPE, check=False)
-    subprocess.run(['docker', 'cp', 'groot_server:/home/groot/groot/ECs.txt', parent_dir /
-                    EQUIVALENCE_CLASSES_DIR / (zoneid + '.txt')],
+    with tempfile.TemporaryDirectory() as batch_dir:
+        for zoneid in zoneids:
+            shutil.copy(parent_dir / ZONE_FILES / (zoneid + '.txt'), batch_dir)
+        subprocess.run(['docker', 'exec', 'groot_server', 'sudo', 'rm', '-rf',
+                        GROOT_BATCH_DIRECTORY], check=False)
+        subprocess.run(['docker', 'cp', batch_dir, 'groot_server:' + GROOT_BATCH_DIRECTORY],
+                       stdout=subprocess.PIPE, check=False)
+    # GRoot writes ECs.txt to the working directory, hence one directory per zone file
+    script = (f'python3 /home/groot/groot/metadata_gen.py -batch {GROOT_BATCH_DIRECTORY} && '
+              f'cd {GROOT_BATCH_DIRECTORY} && ls | xargs -P {jobs} -I ZONE sh -c '
+              f'"cd ZONE && /home/groot/groot/build/bin/groot ./ -le > /dev/null"')
+    subprocess.run(['docker', 'exec', 'groot_server', 'sudo', 'sh', '-c', script],
                    stdout=subprocess.PIPE, check=False)
+    with tempfile.TemporaryDirectory() as output_dir:
+        subprocess.run(['docker', 'cp', 'groot_server:' + GROOT_BATCH_DIRECTORY, output_dir],
+                       stdout=subprocess.PIPE, check=False)
+        batch_dir = pathlib.Path(output_dir) / pathlib.Path(GROOT_BATCH_DIRECTORY).name
+        for zoneid in zoneids:
+            ecs_path = batch_dir / zoneid / 'ECs.txt'
+            if ecs_path.exists():
+                shutil.move(str(ecs_path), parent_dir / EQUIVALENCE_CLASSES_DIR / (zoneid + '.txt'))
+
+
+class ECGenerator:
+    """
+    Generates the equivalence classes of the zones in batches in a background thread, in
+    the order the zones are added, so that the equivalence classes of a zone are ready
+    (or being generated) by the time the zone is tested.
+    """
+
+    def __init__(self,
+                 parent_dir: pathlib.Path,
+                 batch_size: int,
+                 jobs: int,
+                 logger: TextIO) -> None:
+        """
+        :param parent_dir: The parent directory to the directory containing zone files
+        :param batch_size: The number of zones copied to the GRoot container at a time
+        :param jobs: The number of GRoot processes to run in parallel in the container
+        :param logger: The log file pointer
+        """
+        self.parent_dir = parent_dir
+        self.batch_size = batch_size
+        self.jobs = jobs
+        self.logger = logger
+        self.pending = set()  # type: Set[str]
+        self.batches = queue.Queue()  # type: queue.Queue
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._generate, daemon=True)
+
+    def start(self) -> None:
+        """Starts generating the equivalence classes."""
+        self.thread.start()
+
+    def add(self, zoneids: List[str]) -> None:
+        """Adds the zones to generate the equivalence classes of, in testing order."""
+        with self.condition:
+            self.pending.update(zoneids)
+        for index in range(0, len(zoneids), self.batch_size):
+            self.batches.put(zoneids[index:index + self.batch_size])
+
+    def _generate(self) -> None:
+        while True:
+            batch = self.batches.get()
+            if batch is None:
+                return
+            start = time.time()
+            generate_ecs(self.parent_dir, batch, self.jobs)
+            self.logger.write(f'{datetime.now()}\tGenerated the equivalence classes of '
+                              f'{len(batch)} zones in {time.time() - start}s\n')
+            with self.condition:
+                self.pending.difference_update(batch)
+                self.condition.notify_all()
+
+    def wait(self, zoneid: str) -> None:
+        """Waits until the equivalence classes of the zone are generated."""
+        with self.condition:
+            # Do not keep the tests waiting if the generation failed
+            while zoneid in self.pending and self.thread.is_alive():
+                self.condition.wait(1)
+
+    def close(self) -> None:
+        """Waits until all the equivalence classes added are generated."""
+        self.batches.put(None)
+        self.thread.join()
+
+
+def tested_implementations(input_args: Namespace,
+                           parent_dir: pathlib.Path,
+                           zoneid: str) -> Dict[str, Tuple[bool, int]]:
+    """
+    Returns a map from an implementation to the host port its container port 53
+    should be mapped and whether that implementation should be tested with the zone file,
+    that is, if the zone file is accepted by its preprocessor and it is requested by the user.
+
+    :param input_args: The input arguments
+    :param parent_dir: The path to the directory containing zone files and preprocessor outputs
+    :param zoneid: The unique zone identifier
+    """
+    implementations = get_ports_for_invalid_zones(input_args)
+    with open(parent_dir / PREPROCESSOR_DIRECTORY / (zoneid + ".json"), 'r') as outf:
+        output = json.load(outf)
+    for impl, (check, port) in implementations.items():
+        implementations[impl] = (not bool(output[REGISTRY[impl].directory]['Code']) and check,
+                                 port)
+    return implementations
+
+
+def needs_ecs(input_args: Namespace,
+              parent_dir: pathlib.Path,
+              zoneid: str,
+              manifest: ZoneManifest) -> bool:
+    """
+    Returns whether the zone file is compared across implementations and hence needs the
+    equivalence classes to generate the queries.
+
+    :param input_args: The input arguments
+    :param parent_dir: The path to the directory containing zone files and preprocessor outputs
+    :param zoneid: The unique zone identifier
+    :param manifest: The manifest of the zone files
+    """
+    return bool(manifest.entry(zoneid)["Origin"]) and \
+        (parent_dir / PREPROCESSOR_DIRECTORY / (zoneid + ".json")).exists() and \
+        sum(check for check, _ in
+            tested_implementations(input_args, parent_dir, zoneid).values()) > 1
 
 
 def get_queries_invalid_zones(zoneid: str,
                               num_implemetations: int,
                               parent_dir: pathlib.Path,
                               zone_domain: str,
-                              logger: TextIO) -> List[Dict[str, Any]]:
+                              logger: TextIO,
+                              budget: int = DEFAULT_BUDGET) -> List[Dict[str, Any]]:
     """
     Returns a list of queries to test againt the zone file with zoneid.
     If num_implementations is 1, then it looks for ExpectedResponses directory; otherwise
-    use EquivalenceClassNames directory to generate the queries.
+    use EquivalenceClassNames directory to generate the queries, at most `budget` of them
+    picked across the strata of the equivalence class names (see query_budget.py).
 
     :param zoneid: The unique zone identifier
     :param num_implementations: The number of implementations being tested
     :param parent_dir: The path to the directory containing zone files and queries
     :param zone_domain: The zone origin
     :param log_fp: The log file pointer
+    :param budget: The maximum number of queries generated from the equivalence classes
     """
     if num_implemetations == 1:
         if not (parent_dir / QUERY_RESPONSES / (zoneid + '.json')).exists():
@@ -144,23 +311,22 @@ def get_queries_invalid_zones(zoneid: str,
                 f'{EQUIVALENCE_CLASSES_DIR} directory\n')
             return []
         with open(parent_dir / EQUIVALENCE_CLASSES_DIR / (zoneid + '.txt'), 'r') as ecf:
-            ecs = ecf.readlines()
-            if len(ecs) > 200:
-                logger.write(f'{datetime.now()}\tSkipping zone {zoneid} in {parent_dir}'
-                             f' with {len(ecs)} as there are too many ECs\n')
-                return []
-            queries = []
-            for ec_name in ecs:
-                qname = ec_name[:-1]
-                if not qname.endswith(zone_domain):
-                    continue
-                for qtype in ['A', 'NS', 'SOA', 'CNAME', 'DNAME', 'TXT']:
-                    tmp = {}  # type: Dict[str, Dict[str, str]]
-                    tmp["Query"] = {}
-                    tmp["Query"]["Name"] = qname
-                    tmp["Query"]["Type"] = qtype
-                    queries.append(tmp)
-            return queries
+            ec_names = [ec_name[:-1] for ec_name in ecf.readlines()
+                        if ec_name[:-1].endswith(zone_domain)]
+        owner_types = get_owner_types(parent_dir / ZONE_FILES / (zoneid + '.txt'), zone_domain)
+        planned = plan_queries(ec_names, zone_domain, owner_types, budget)
+        if len(planned) < len(ec_names) * len(QUERY_TYPES):
+            logger.write(f'{datetime.now()}\tTesting {len(planned)} of the '
+                         f'{len(ec_names) * len(QUERY_TYPES)} queries of zone {zoneid} in '
+                         f'{parent_dir} with {len(ec_names)} ECs (budget: {budget})\n')
+        queries = []
+        for qname, qtype in planned:
+            tmp = {}  # type: Dict[str, Dict[str, str]]
+            tmp["Query"] = {}
+            tmp["Query"]["Name"] = qname
+            tmp["Query"]["Type"] = qtype
+            queries.append(tmp)
+        return queries
 
 
 def run_test(input_args: Namespace,
@@ -168,50 +334,64 @@ def run_test(input_args: Namespace,
              zoneid: str,
              cid: int,
              tag: str,
-             logger: TextIO) -> None:
+             logger: TextIO,
+             manifest: ZoneManifest,
+             addresses: Dict[str, Tuple[str, int]],
+             network: Optional[str] = None,
+             triage: Optional[FingerprintState] = None,
+             database: Optional[DifferencesDB] = None,
+             stream: Optional[DifferencesWriter] = None,
+             suppressions: Optional[SuppressionList] = None,
+             ecs: Optional[ECGenerator] = None,
+             budgets: Optional[QueryBudgets] = None,
+             metrics: Optional[RunMetrics] = None,
+             batch_dir: Optional[str] = None) -> None:
     """
     Run the tests on the input zone file.
+    The addresses to query the implementations are updated when a container is restarted.
+    The fingerprint state, if any, is updated with the differences.
+    The differences are written to the database or the stream file, if any, instead of the
+    Differences directory. The known differences in the suppression list, if any, are only
+    counted. The equivalence classes are taken from the background generator, if any, and
+    generated for the zone file alone otherwise. The number of queries generated from them
+    is bounded by the query budget of the zone. The preparation and the queries are
+    recorded in the run metrics, if any. The zone file is copied to the containers from
+    the directory the preprocessor checks copied it to in them, if any.
     """
-    zone_domain = ''
-    with open(parent_dir / ZONE_FILES / (zoneid + '.txt'), 'r') as zone_fp:
-        for line in zone_fp:
-            if 'SOA' in line:
-                zone_domain = line.split('\t')[0]
-                if ' ' in zone_domain:
-                    zone_domain = line.split()[0]
+    zone_domain = manifest.entry(zoneid)["Origin"]
     if not zone_domain:
         logger.write(
             f'{datetime.now()}\tNot checking zone {zoneid} as SOA not found\n')
         return
-    implementations = get_ports_for_invalid_zones(input_args)
-    with open(parent_dir / PREPROCESSOR_DIRECTORY / (zoneid + ".json"), 'r') as outf:
-        output = json.load(outf)
-        # Check an implementation if the zone file is accepted by the preprocessor and
-        # requested by the user.
-        implementations['bind'] = (not bool(
-            output['Bind']['Code']) and implementations['bind'][0], implementations['bind'][1])
-        implementations['nsd'] = (not bool(
-            output['Nsd']['Code']) and implementations['nsd'][0], implementations['nsd'][1])
-        implementations['knot'] = (not bool(
-            output['Knot']['Code']) and implementations['knot'][0], implementations['knot'][1])
-        implementations['powerdns'] = (not bool(
-            output['Powerdns']['Code']) and implementations['powerdns'][0],
-                                       implementations['powerdns'][1])
-        total_impl_tested = sum(v[0] for v in implementations.values())
-        if total_impl_tested == 0:
-            logger.write(f'{datetime.now()}\tZone file {zoneid} in {parent_dir} can not be tested '
-                         'as no implementation that accepts the zone file is selected\n')
-            return
-        if total_impl_tested == 1 and not (parent_dir / QUERY_RESPONSES).exists():
-            logger.write(f'{datetime.now()}\tZone file {zoneid} in {parent_dir} can not be tested '
-                         'as only one implementation is used and there is '
-                         'no expected responses directory\n')
-            return
-    generate_ecs(parent_dir, zoneid)
-    prepare_containers(parent_dir / ZONE_FILES / (zoneid + '.txt'),
-                       zone_domain, cid, False, implementations, tag)
+    # Check an implementation if the zone file is accepted by the preprocessor and
+    # requested by the user.
+    implementations = tested_implementations(input_args, parent_dir, zoneid)
+    total_impl_tested = sum(v[0] for v in implementations.values())
+    if total_impl_tested == 0:
+        logger.write(f'{datetime.now()}\tZone file {zoneid} in {parent_dir} can not be tested '
+                     'as no implementation that accepts the zone file is selected\n')
+        return
+    if total_impl_tested == 1 and not (parent_dir / QUERY_RESPONSES).exists():
+        logger.write(f'{datetime.now()}\tZone file {zoneid} in {parent_dir} can not be tested '
+                     'as only one implementation is used and there is '
+                     'no expected responses directory\n')
+        return
+    if total_impl_tested > 1:
+        if ecs:
+            ecs.wait(zoneid)
+        else:
+            generate_ecs(parent_dir, [zoneid])
+    prepare_start = time.time()
+    prepare_times = prepare_containers(parent_dir / ZONE_FILES / (zoneid + '.txt'),
+                                       zone_domain, cid, False, implementations, tag,
+                                       batch_dir)
+    if metrics:
+        metrics.observe_prepare(prepare_times)
+    # The implementations that have not answered since the zone file was loaded
+    not_ready = set(prepare_times)
+    budget = budgets.get(parent_dir, zoneid) if budgets else DEFAULT_BUDGET
     queries = get_queries_invalid_zones(zoneid, total_impl_tested,
-                                        parent_dir, zone_domain, logger)
+                                        parent_dir, zone_domain, logger, budget)
     if not queries:
         return
     differences = []
@@ -221,16 +401,21 @@ def run_test(input_args: Namespace,
         responses = []
         for impl, (check, port) in implementations.items():
             if check:
-                respo = querier(qname, qtype, port * int(cid))
+                respo = timed_querier(qname, qtype, impl, addresses[impl], metrics)
                 if not isinstance(respo, dns.message.Message):
-                    single_impl = {}
-                    single_impl[impl] = (True, port)
-                    prepare_containers(parent_dir / ZONE_FILES / (zoneid + '.txt'),
-                                       zone_domain, cid, True, implementations, tag)
+                    addresses[impl] = restart_implementation(
+                        parent_dir / ZONE_FILES / (zoneid + '.txt'), zone_domain,
+                        cid, impl, port, tag, network)
                     logger.write(f'{datetime.now()}\tRestarted {impl}\'s container while'
                                  f' testing zone {zoneid}\n')
+                    if metrics:
+                        metrics.restarted(impl)
+                    not_ready.discard(impl)
                     time.sleep(1)
-                    respo = querier(qname, qtype, port * int(cid))
+                    respo = timed_querier(qname, qtype, impl, addresses[impl], metrics)
+                elif metrics and impl in not_ready:
+                    not_ready.discard(impl)
+                    metrics.observe_ready(impl, time.time() - prepare_start)
                 responses.append((impl, respo))
         # If there is only one implementation tested, use expected response/s
         if len(responses) == 1:
@@ -244,19 +429,33 @@ def run_test(input_args: Namespace,
             difference["Query Name"] = qname
             difference["Query Type"] = qtype
             difference["Groups"] = groups_to_json(groups)
+            if suppressions and suppressions.suppressed(difference):
+                continue
             differences.append(difference)
     if differences:
+        if database:
+            database.add(zoneid, differences, {})
+            return
+        if stream:
+            stream.write(zoneid, differences, {})
+            return
         with open(parent_dir / DIFFERENCES / (zoneid + '.json'), 'w') as difference_fp:
             json.dump(differences, difference_fp, indent=2)
+        if triage:
+            triage.record(parent_dir / DIFFERENCES / (zoneid + '.json'), differences, {})
 
 
 def run_tests_helper(input_args: Namespace,
                      input_dir: pathlib.Path,
                      logger: TextIO) -> None:
     """
-    Helper function to check (invalid) zone files with implementations' preprocessors.
-    Iterates recursively over the input directory to find ZoneFiles directory and
-    calls check_zone_with_preprocessors function to check a zone file.
+    Helper function to test (invalid) zone files with the implementations.
+    Iterates recursively over the input directory to find ZoneFiles and
+    PreprocessorOutputs directories and calls run_test function to test each zone file.
+    With the -check flag, the PreprocessorOutputs directory is not required: each batch of
+    zone files is checked with the preprocessors in the containers used for testing right
+    before the zone files are tested, and the containers load each of them from the copy
+    made for the checks instead of copying it from the host again.
 
     :param input_args: The input arguments
     :param input_dir: The path to the parent directory with ZoneFiles directory.
@@ -267,36 +466,90 @@ def run_tests_helper(input_args: Namespace,
         return
     zone_files_dir = input_dir / ZONE_FILES
     preprocessor_output_dir = input_dir / PREPROCESSOR_DIRECTORY
-    if zone_files_dir.exists() and zone_files_dir.is_dir() and \
-            preprocessor_output_dir.exists() and preprocessor_output_dir.is_dir():
+    if zone_files_dir.exists() and zone_files_dir.is_dir() and (input_args.check or (
+            preprocessor_output_dir.exists() and preprocessor_output_dir.is_dir())):
         #  Generate GRoot image required for generation of queries
         generate_groot_image(logger)
         # Start the container for the GRoot
         delete_container('groot_server')
         cmd = "docker run -d --name=groot_server groot:ferret"
         subprocess.run(cmd, shell=True, check=False)
-        (input_dir / DIFFERENCES).mkdir(parents=True, exist_ok=True)
+        if not (input_args.db or input_args.stream):
+            (input_dir / DIFFERENCES).mkdir(parents=True, exist_ok=True)
         (input_dir / EQUIVALENCE_CLASSES_DIR).mkdir(parents=True, exist_ok=True)
+        preprocessor_output_dir.mkdir(parents=True, exist_ok=True)
         implementations = get_ports_for_invalid_zones(input_args)
         tag = ':oct'
         if input_args.latest:
             tag = ':latest'
-        start_containers(input_args.id, implementations, tag)
+        network = input_args.network if "network" in input_args else None
+        start_containers(input_args.id, implementations, tag, network)
+        addresses = get_addresses(input_args.id, implementations, network)
+        manifest = load_manifest(zone_files_dir)
+        triage = FingerprintState(input_dir) if input_args.triage else None
+        database = DifferencesDB(input_dir) if input_args.db else None
+        stream = DifferencesWriter(stream_path(input_dir, input_args.id)) \
+            if input_args.stream else None
+        suppressions = SuppressionList(pathlib.Path(input_args.suppress)) \
+            if "suppress" in input_args else None
+        budgets = QueryBudgets(input_args.budget, pathlib.Path(input_args.budgets)
+                               if "budgets" in input_args else None)
+        zoneids = manifest.zone_ids()
+        ecs = ECGenerator(input_dir, input_args.batch,
+                          input_args.j if "j" in input_args else os.cpu_count() or 1, logger)
+        ecs.start()
+        # The queue depth is the number of zones waiting for their equivalence classes
+        metrics = None  # type: Optional[RunMetrics]
+        if "metrics" in input_args:
+            metrics = RunMetrics(input_dir / (str(input_args.id) + '_metrics'),
+                                 str(input_args.id), input_args.metrics,
+                                 lambda: {'ecs': len(ecs.pending)})
+            metrics.start_writing()
+        if not input_args.check:
+            ecs.add([zoneid for zoneid in zoneids
+                     if needs_ecs(input_args, input_dir, zoneid, manifest)])
         logger.write(
             f'{datetime.now()}\tStarted checking the zone files in {zone_files_dir}\n')
         start = time.time()
-        for zone_path in zone_files_dir.iterdir():
-            if not zone_path.is_file():
-                continue
-            logger.write(f'{datetime.now()}\tChecking zone {zone_path.stem}\n')
-            run_test(input_args, input_dir, zone_path.stem,
-                     int(input_args.id), tag, logger)
+        for index in range(0, len(zoneids), input_args.batch):
+            batch = zoneids[index:index + input_args.batch]
+            # The zone files checked in the containers with this batch
+            in_containers = set()  # type: Set[str]
+            if input_args.check:
+                # The containers are already running, so the zone files are checked in them
+                unchecked = [zoneid for zoneid in batch
+                             if not (preprocessor_output_dir / (zoneid + '.json')).exists()]
+                if check_zones_with_preprocessors(
+                        input_args, input_dir,
+                        [zone_files_dir / (zoneid + '.txt') for zoneid in unchecked],
+                        str(input_args.id), False, manifest):
+                    in_containers.update(unchecked)
+                ecs.add([zoneid for zoneid in batch
+                         if needs_ecs(input_args, input_dir, zoneid, manifest)])
+            for zoneid in batch:
+                logger.write(f'{datetime.now()}\tChecking zone {zoneid}\n')
+                run_test(input_args, input_dir, zoneid,
+                         int(input_args.id), tag, logger, manifest, addresses, network, triage,
+                         database, stream, suppressions, ecs, budgets, metrics,
+                         BATCH_DIRECTORY if zoneid in in_containers else None)
+                if metrics:
+                    metrics.zone_done()
+        ecs.close()
+        if metrics:
+            metrics.close()
         logger.write(f'{datetime.now()}\tFinished checking the zone files in '
                      f'{input_dir} in {time.time() - start}s\n')
-        delete_container(f'{input_args.id}_bind_server')
-        delete_container(f'{input_args.id}_nsd_server')
-        delete_container(f'{input_args.id}_powerdns_server')
-        delete_container(f'{input_args.id}_knot_server')
+        if suppressions:
+            logger.write(f'{datetime.now()}\tSuppressed in {input_dir}: '
+                         f'{suppressions.summary()}\n')
+        if triage:
+            triage.flush(refresh=True)
+        if database:
+            database.close()
+        if stream:
+            stream.close()
+        for impl in with_preprocessor():
+            delete_container(impl.container_name(input_args.id))
         delete_container('groot_server')
     else:
         if input_dir.is_dir():
@@ -314,16 +567,52 @@ if __name__ == '__main__':
                             '(only when one implementation is passed for testing)')
     parser.add_argument('-path', metavar='DIRECTORY_PATH', default=SUPPRESS,
                         help='The path to the directory containing ZoneFiles and '
-                        'PreprocessorOutputs directories; looks for those two directories '
-                        'recursively (default: Results/InvalidZoneFileTests/)')
+                        'PreprocessorOutputs directories (only ZoneFiles with -check); looks '
+                        'for those two directories recursively '
+                        '(default: Results/InvalidZoneFileTests/)')
     parser.add_argument('-id', type=int, default=1, choices=range(1, 6),
                         help='Unique id for all the containers')
-    parser.add_argument('-b', help='Disable Bind.', action="store_true")
-    parser.add_argument('-n', help='Disable Nsd.', action="store_true")
-    parser.add_argument('-k', help='Disable Knot.', action="store_true")
-    parser.add_argument('-p', help='Disable PowerDns.', action="store_true")
+    add_disable_arguments(parser, with_preprocessor())
     parser.add_argument(
         '-l', '--latest', help='Test using latest image tag.', action="store_true")
+    parser.add_argument('-check', action="store_true",
+                        help='Check the zone files with the preprocessors in the containers '
+                        'used for testing, a batch at a time right before testing them, '
+                        'instead of running preprocessor_checks.py first.')
+    parser.add_argument('-batch', metavar='BATCH_SIZE', type=int, default=64,
+                        help='The number of zone files GRoot generates the equivalence classes '
+                        'of (and, with -check, the preprocessors check) at a time, ahead of '
+                        'testing them.')
+    parser.add_argument('-j', metavar='JOBS', type=int, default=SUPPRESS,
+                        help='The number of GRoot processes to run in parallel in the GRoot '
+                        'container. (default: Number of CPUs)')
+    parser.add_argument('-budget', metavar='QUERY_BUDGET', type=int, default=DEFAULT_BUDGET,
+                        help='The maximum number of queries generated from the equivalence '
+                        'classes of a zone file.')
+    parser.add_argument('-budgets', metavar='BUDGETS_PATH', default=SUPPRESS,
+                        help='A JSON file mapping a zone id (or "<directory name>/<zone id>") '
+                        'to its query budget, overriding -budget. (default: None)')
+    parser.add_argument('-network', metavar='NETWORK_NAME', default=SUPPRESS,
+                        help='Attach the containers to this Docker bridge network (created if '
+                        'missing) and query their IPs directly instead of the published host '
+                        'ports (Linux hosts only). (default: Use published host ports)')
+    sink = parser.add_mutually_exclusive_group()
+    sink.add_argument('-triage', action="store_true",
+                      help='Update the fingerprints (Fingerprints.json) incrementally while '
+                      'testing.')
+    sink.add_argument('-db', action="store_true",
+                      help='Write the differences to the differences database '
+                      '(Differences.sqlite3) instead of the Differences directory.')
+    sink.add_argument('-stream', action="store_true",
+                      help='Write the differences to a compact Differences stream file '
+                      '(Differences_<id>.bin) instead of the Differences directory.')
+    parser.add_argument('-suppress', metavar='SUPPRESSIONS_PATH', default=SUPPRESS,
+                        help='The suppression file with the known differences, which are only '
+                        'counted (in the log file) and not written. (default: None)')
+    parser.add_argument('-metrics', metavar='SECONDS', type=float, default=SUPPRESS,
+                        help='Write the run metrics every SECONDS seconds to <id>_metrics.prom '
+                        'and <id>_metrics.jsonl in each directory tested. '
+                        '(default: No run metrics)')
     args = parser.parse_args()
     if "path" in args:
         dir_path = pathlib.Path(args.path)
@@ -6,6 +6,9 @@ expected response to flag differences (only when one implementation is passed fo
 usage: test_with_valid_zone_files.py [-h] [-path DIRECTORY_PATH]
                                      [-id {1,2,3,4,5}] [-r START END] [-b]
                                      [-n] [-k] [-p] [-c] [-y] [-m] [-t] [-e] [-l]
+                                     [-network NETWORK_NAME] [-triage | -db | -stream]
+                                     [-suppress SUPPRESSIONS_PATH] [-expand MAX_QUERIES]
+                                     [-metrics SECONDS]
 
 optional arguments:
   -h, --help            show this help message and exit
@@ -25,10 +28,29 @@ optional arguments:
   -t                    Disable TrustDns. (default: False)
   -e                    Disable Technitium. (default: False)
   -l, --latest          Test using latest image tag. (default: False)
+  -network NETWORK_NAME Attach the containers to this Docker bridge network (created if
+                        missing) and query their IPs directly instead of the published
+                        host ports (Linux hosts only). (default: Use published host ports)
+  -triage               Update the fingerprints (Fingerprints.json) incrementally while
+                        testing. (default: False)
+  -db                   Write the differences to the differences database
+                        (Differences.sqlite3) instead of the Differences directory.
+                        (default: False)
+  -stream               Write the differences to a compact Differences stream file
+                        (Differences_<id>.bin) instead of the Differences directory.
+                        (default: False)
+  -suppress SUPPRESSIONS_PATH
+                        The suppression file with the known differences, which are only
+                        counted (in the log file) and not written. (default: None)
+  -expand MAX_QUERIES   Also send up to MAX_QUERIES queries derived from the contents of
+                        each zone file (owner names, near-miss names, wildcard-covered
+                        names and names below delegations, DNAMEs and CNAMEs) while it is
+                        loaded. (default: Only the Zen queries)
+  -metrics SECONDS      Write the run metrics every SECONDS seconds to <id>_metrics.prom
+                        and <id>_metrics.jsonl. (default: No run metrics)
 """
 #!/usr/bin/env python3
 
-import copy
 import json
 import pathlib
 import subprocess
@@ -38,6 +60,7 @@ from argparse import (SUPPRESS, ArgumentDefaultsHelpFormatter, ArgumentParser,
                       ArgumentTypeError, Namespace)
 from datetime import datetime
 from multiprocessing import Process
+from multiprocessing.connection import wait
 from typing import Any, Dict, List, Optional, TextIO, Tuple, Union
 
 import dns.message
@@ -45,15 +68,17 @@ import dns.query
 import dns.rdataclass
 import dns.rdatatype
 import dns.resolver
-from Implementations.Bind.prepare import run as bind
-from Implementations.Coredns.prepare import run as coredns
-from Implementations.Knot.prepare import run as knot
-from Implementations.Maradns.prepare import run as maradns
-from Implementations.Nsd.prepare import run as nsd
-from Implementations.Powerdns.prepare import run as powerdns
-from Implementations.Technitium.prepare import run as technitium
-from Implementations.Trustdns.prepare import run as trustdns
-from Implementations.Yadifa.prepare import run as yadifa
+from Implementations.registry import (REGISTRY, add_disable_arguments,
+                                     get_ports, load_runner)
+from Scripts.differences_db import DifferencesDB
+from Scripts.differences_stream import DifferencesWriter, stream_path
+from Scripts.fingerprints import FingerprintState
+from Scripts.image_builds import verify_images
+from Scripts.query_expansion import expand_queries
+from Scripts.run_metrics import RunMetrics
+from Scripts.suppressions import SuppressionList
+from Scripts.zone_features import filter_implementations
+from Scripts.zone_manifest import ZoneManifest, load_manifest
 
 ZONE_FILES = "ZoneFiles/"
 QUERIES = "Queries/"
@@ -65,26 +90,6 @@ DIFFERENCES = "Differences/"
 ResponseType = Tuple[str, Union[str, dns.message.Message]]
 
 
-def get_ports(input_args: Namespace) -> Dict[str, Tuple[bool, int]]:
-    """
-    Returns a map from an implementation to the host port its container port 53
-    should be mapped and whether that implementation should be tested.
-
-    :param input_args: The input arguments
-    """
-    implementations = {}
-    implementations['bind'] = (not input_args.b, 8000)
-    implementations['nsd'] = (not input_args.n, 8100)
-    implementations['knot'] = (not input_args.k, 8200)
-    implementations['powerdns'] = (not input_args.p, 8300)
-    implementations['yadifa'] = (not input_args.y, 8400)
-    implementations['coredns'] = (not input_args.c, 8500)
-    implementations['maradns'] = (not input_args.m, 8600)
-    implementations['trustdns'] = (not input_args.t, 8700)
-    implementations['technitium'] = (not input_args.e, 8800)
-    return implementations
-
-
 def remove_container(cid: int) -> None:
     """
     Stops the running containers of all the implementations.
@@ -98,16 +103,54 @@ def remove_container(cid: int) -> None:
     if cmd_status.returncode != 0:
         sys.exit(f'Error in executing Docker ps command: {output}')
     all_container_names = [name[1:-1] for name in output.strip().split("\n")]
-    servers = ["_bind_server", "_nsd_server", "_knot_server", "_powerdns_server",
-               "_maradns_server", "_yadifa_server", "_trustdns_server", "_coredns_server", "_technitium_server"]
-    for server in servers:
+    for impl in REGISTRY.values():
         # Force remove the container if it is running
-        if str(cid) + server in all_container_names:
-            subprocess.run(['docker', 'container', 'rm', str(cid) + server, '-f'],
+        if impl.container_name(cid) in all_container_names:
+            subprocess.run(['docker', 'container', 'rm', impl.container_name(cid), '-f'],
                            stdout=subprocess.PIPE, check=False)
 
 
-def start_containers(cid: int, implementations: Dict[str, Tuple[bool, int]], tag: str) -> None:
+def ensure_network(network: str) -> None:
+    """
+    Creates a user-defined bridge network with the input name if it does not exist.
+
+    :param network: The name of the Docker network
+    """
+    inspect = subprocess.run(['docker', 'network', 'inspect', network],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False)
+    if inspect.returncode != 0:
+        subprocess.run(['docker', 'network', 'create', '--driver', 'bridge', network],
+                       stdout=subprocess.PIPE, check=True)
+
+
+def start_container(cid: int, impl: str, port: int, tag: str, network: Optional[str]) -> None:
+    """
+    Starts a new container for the implementation, removing the existing one if any.
+    When a network is given, the container is attached to it and its port 53 is not
+    published on the host.
+
+    :param cid: The unique id for all the containers
+    :param impl: The implementation
+    :param port: The host port to map to the container port 53
+    :param tag: Tag of the images to use
+    :param network: The Docker network to attach the container to
+    """
+    cname = REGISTRY[impl].container_name(cid)
+    subprocess.run(['docker', 'container', 'rm', cname, '-f'],
+                   stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False)
+    if network:
+        # The loaders that use an API on the host (Technitium) still need it published
+        publish = REGISTRY[impl].port_arguments(port * cid)[2:]
+        publish.append('--network=' + network)
+    else:
+        publish = REGISTRY[impl].port_arguments(port * cid)
+    subprocess.run(['docker', 'run', '-d', *publish, '--name=' + cname, impl + tag], check=True)
+
+
+def start_containers(cid: int,
+                     implementations: Dict[str, Tuple[bool, int]],
+                     tag: str,
+                     network: Optional[str] = None) -> None:
     """
     Starts a container for each requested implementation
 
@@ -116,28 +159,95 @@ def start_containers(cid: int, implementations: Dict[str, Tuple[bool, int]], tag
                             - 1. whether to check that implementation 2. which host port
                             should be mapped to the container port 53
     :param tag: Tag of the images to use
+    :param network: The Docker network to attach the containers to (default: publish ports)
     """
+    verify_images([impl + tag for impl, (check, _) in implementations.items() if check])
     remove_container(cid)
+    if network:
+        ensure_network(network)
     for impl, (check, port) in implementations.items():
         if check:
-            if impl == 'technitium':
-                subprocess.run(['docker', 'run', '-dp', str(port * cid) + ':53/udp', '-p', f'{str(port * cid + 1)}:5380/tcp',
-                                '--name=' + str(cid) + '_' + impl + '_server', impl + tag], check=True)
-            else:
-                subprocess.run(['docker', 'run', '-dp', str(port * cid) + ':53/udp',
-                                '--name=' + str(cid) + '_' + impl + '_server', impl + tag], check=True)
+            start_container(cid, impl, port, tag, network)
+
+
+def get_address(cid: int, impl: str, port: int, network: Optional[str]) -> Tuple[str, int]:
+    """
+    Returns the address and port to send queries to an implementation's container.
+    Without a network, queries go to the host port mapped to the container port 53;
+    otherwise directly to port 53 of the container IP on the network.
+
+    :param cid: The unique id for all the containers
+    :param impl: The implementation
+    :param port: The host port mapped to the container port 53
+    :param network: The Docker network the container is attached to
+    """
+    if not network:
+        return ('127.0.0.1', port * cid)
+    inspect = subprocess.run(['docker', 'inspect', '--format',
+                              f'{{{{(index .NetworkSettings.Networks "{network}").IPAddress}}}}',
+                              REGISTRY[impl].container_name(cid)],
+                             stdout=subprocess.PIPE, check=False)
+    return (inspect.stdout.decode('utf-8').strip(), 53)
+
+
+def get_addresses(cid: int,
+                  implementations: Dict[str, Tuple[bool, int]],
+                  network: Optional[str]) -> Dict[str, Tuple[str, int]]:
+    """
+    Returns a map from each checked implementation to the address and port to query it.
+
+    :param cid: The unique id for all the containers
+    :param implementations: Map from an implementation to a tuple of two items
+                            - 1. whether to check that implementation 2. which host port
+                            should be mapped to the container port 53
+    :param network: The Docker network the containers are attached to
+    """
+    return {impl: get_address(cid, impl, port, network)
+            for impl, (check, port) in implementations.items() if check}
 
 
-def querier(query_name: str, query_type: str, port: int) -> Union[str, dns.message.Message]:
+def restart_implementation(zone_file: pathlib.Path,
+                           zone_domain: str,
+                           cid: int,
+                           impl: str,
+                           port: int,
+                           tag: str,
+                           network: Optional[str]) -> Tuple[str, int]:
     """
-    Sends the input query to the input host port and either DNS response or an error message
+    Loads the zone file in a new container of the implementation and returns the new
+    address and port to query it.
+
+    :param zone_file: The path to the zone file
+    :param zone_domain: The zone origin
+    :param cid: The unique id for all the containers
+    :param impl: The implementation
+    :param port: The host port mapped to the container port 53
+    :param tag: Tag of the images to use
+    :param network: The Docker network to attach the container to
+    """
+    if network:
+        # The loaders start containers with published ports, so start it here instead
+        start_container(cid, impl, port, tag, network)
+        prepare_containers(zone_file, zone_domain, cid, False, {impl: (True, port)}, tag)
+    else:
+        prepare_containers(zone_file, zone_domain, cid, True, {impl: (True, port)}, tag)
+    return get_address(cid, impl, port, network)
+
+
+def querier(query_name: str,
+            query_type: str,
+            port: int,
+            addr: str = '127.0.0.1') -> Union[str, dns.message.Message]:
+    """
+    Sends the input query to the input address and port and returns either
+    DNS response or an error message
 
     :param query_name: Domain name of the query
     :param query_type: Record type requested
-    :param port: The host port to send the query
+    :param port: The port to send the query
+    :param addr: The address to send the query
     """
     domain = dns.name.from_text(query_name)
-    addr = '127.0.0.1'
     try:
         query = dns.message.make_query(domain, query_type)
         # Removes the default Recursion Desired Flag
@@ -241,11 +351,14 @@ def prepare_containers(zone_file: pathlib.Path,
                        cid: int,
                        restart: bool,
                        implementations: Dict[str, Tuple[bool, int]],
-                       tag: str) -> None:
+                       tag: str,
+                       batch_dir: Optional[str] = None) -> Dict[str, float]:
     """
     Either starts new containers or reuses existing containers to prepare the
     container to serve the input zone file.
     Uses one process for each implementation tested to speedup preparation.
+    The prepare module of an implementation is imported only when it is loaded.
+    Returns a map from each implementation prepared to the seconds it took.
 
     :param zone_file: The path to the zone file
     :param zone_domain: The zone origin
@@ -256,19 +369,53 @@ def prepare_containers(zone_file: pathlib.Path,
                             - 1. whether to load that implementation container
                               2. which host port should be mapped to the container port 53
     :param tag: Tag of the images to use
+    :param batch_dir: The directory the preprocessor checks copied the zone file to in the
+                      containers of the implementations with a preprocessor, if any; their
+                      loaders copy it from there instead of from the host
     """
-    process_pool = []
+    process_pool = {}
     for impl, (check, port) in implementations.items():
         if check:
-            process_pool.append(
-                Process(target=globals()[impl],
-                        args=(zone_file, zone_domain,
-                              str(cid) + '_' + impl + '_server',
-                              port * cid, restart, tag)))
-    for process in process_pool:
+            process_pool[impl] = Process(target=load_runner(impl),
+                                         args=(zone_file, zone_domain,
+                                               str(cid) + '_' + impl + '_server',
+                                               port * cid, restart, tag),
+                                         kwargs={'batch_dir': batch_dir}
+                                         if batch_dir and REGISTRY[impl].preprocessor else {})
+    start = time.time()
+    for process in process_pool.values():
         process.start()
-    for process in process_pool:
+    prepare_times = {}
+    running = {process.sentinel: impl for impl, process in process_pool.items()}
+    while running:
+        # Note the time each process finishes at, in the order they finish
+        for sentinel in wait(list(running)):
+            prepare_times[running.pop(sentinel)] = time.time() - start
+    for process in process_pool.values():
         process.join()
+    return prepare_times
+
+
+def timed_querier(query_name: str,
+                  query_type: str,
+                  impl: str,
+                  address: Tuple[str, int],
+                  metrics: Optional[RunMetrics]) -> Union[str, dns.message.Message]:
+    """
+    Sends the input query to the implementation with the querier and adds the time taken
+    to the metrics, if any.
+
+    :param query_name: Domain name of the query
+    :param query_type: Record type requested
+    :param impl: The implementation
+    :param address: The address and port to query the implementation
+    :param metrics: The metrics of the run, if any
+    """
+    start = time.time()
+    response = querier(query_name, query_type, address[1], address[0])
+    if metrics:
+        metrics.observe_query(impl, time.time() - start, response)
+    return response
 
 
 def get_queries(zoneid: str,
@@ -324,7 +471,16 @@ def run_test(zoneid: str,
              cid: int,
              port_mappings: Dict[str, Tuple[bool, int]],
              log_fp: TextIO,
-             tag: str) -> None:
+             tag: str,
+             manifest: ZoneManifest,
+             addresses: Dict[str, Tuple[str, int]],
+             network: Optional[str] = None,
+             triage: Optional[FingerprintState] = None,
+             database: Optional[DifferencesDB] = None,
+             stream: Optional[DifferencesWriter] = None,
+             suppressions: Optional[SuppressionList] = None,
+             expand: Optional[int] = None,
+             metrics: Optional[RunMetrics] = None) -> None:
     """
     Runs the tests on the input single zone file.
 
@@ -337,39 +493,52 @@ def run_test(zoneid: str,
                             should be mapped to the container port 53
     :param log_fp: The log file pointer
     :param tag: Tag of the images to use
+    :param manifest: The manifest of the zone files
+    :param addresses: Map from an implementation to the address and port to query it
+                      (updated when a container is restarted)
+    :param network: The Docker network the containers are attached to, if any
+    :param triage: The fingerprint state to update with the differences, if any
+    :param database: The differences database to write the differences to instead of
+                     the Differences directory, if any
+    :param stream: The Differences stream file to write the differences to instead of
+                   the Differences directory, if any
+    :param suppressions: The known differences to count instead of writing, if any
+    :param expand: The maximum number of extra queries derived from the zone file (see
+                   query_expansion.py) when comparing implementations, if any
+    :param metrics: The metrics of the run to record the preparation and queries in, if any
     """
-    has_dname = False
-    zone_domain = ''
-    with open(parent_directory_path / ZONE_FILES / (zoneid + '.txt'), 'r') as zone_fp:
-        for line in zone_fp:
-            if 'SOA' in line:
-                zone_domain = line.split('\t')[0]
-                if ' ' in zone_domain:
-                    zone_domain = line.split()[0]
-            if 'DNAME' in line:
-                has_dname = True
+    zone_features = manifest.features(zoneid)
+    zone_domain = zone_features.origin
     if not zone_domain:
         log_fp.write(f'{datetime.now()}\tSOA not found in {zoneid}\n')
         errors[zoneid] = 'SOA not found'
         return
 
-    implementations = copy.deepcopy(port_mappings)
-    # Exclude implementations that do not support DNAME type if the zone file has a DNAME record
-    if has_dname:
-        implementations['yadifa'] = (
-            False, implementations['yadifa'][1])  # Yadifa
-        implementations['trustdns'] = (
-            False, implementations['trustdns'][1])    # TrustDns
-        implementations['maradns'] = (
-            False, implementations['maradns'][1])    # MaraDns
+    # Exclude implementations that can not represent the record types or features of the zone
+    implementations, skipped = filter_implementations(port_mappings, zone_features)
+    if skipped:
+        log_fp.write(f'{datetime.now()}\tSkipping {", ".join(skipped)} for zone {zoneid} as '
+                     'the zone has unsupported record types or features\n')
     total_impl_tested = sum(x[0] for x in list(implementations.values()))
     queries = get_queries(zoneid, total_impl_tested,
                           parent_directory_path, log_fp, errors)
     if not queries:
         return
-
-    prepare_containers(parent_directory_path / ZONE_FILES /
-                       (zoneid + '.txt'), zone_domain, cid, False, implementations, tag)
+    # The derived queries have no expected responses to compare a single implementation with
+    if expand and total_impl_tested > 1:
+        expanded = expand_queries(parent_directory_path / ZONE_FILES / (zoneid + '.txt'),
+                                  zone_domain, queries, expand)
+        log_fp.write(f'{datetime.now()}\tAdded {len(expanded)} queries derived from '
+                     f'zone {zoneid}\n')
+        queries = queries + expanded
+
+    prepare_start = time.time()
+    prepare_times = prepare_containers(parent_directory_path / ZONE_FILES / (zoneid + '.txt'),
+                                       zone_domain, cid, False, implementations, tag)
+    if metrics:
+        metrics.observe_prepare(prepare_times)
+    # The implementations that have not answered since the zone file was loaded
+    not_ready = set(prepare_times)
 
     differences = []
     for query in queries:
@@ -378,17 +547,22 @@ def run_test(zoneid: str,
         responses = []
         for impl, (check, port) in implementations.items():
             if check:
-                respo = querier(qname, qtype, port * int(cid))
+                respo = timed_querier(qname, qtype, impl, addresses[impl], metrics)
                 #  If it is not a proper DNS response, try again with a new container
                 if not isinstance(respo, dns.message.Message):
-                    single_impl = {}
-                    single_impl[impl] = (True, port)
-                    prepare_containers(parent_directory_path / ZONE_FILES /
-                                       (zoneid + '.txt'), zone_domain, cid, True, single_impl, tag)
+                    addresses[impl] = restart_implementation(
+                        parent_directory_path / ZONE_FILES / (zoneid + '.txt'), zone_domain,
+                        cid, impl, port, tag, network)
                     log_fp.write(f'{datetime.now()}\tRestarted {impl}\'s container while '
                                  f'testing zone {zoneid}\n')
+                    if metrics:
+                        metrics.restarted(impl)
+                    not_ready.discard(impl)
                     time.sleep(1)
-                    respo = querier(qname, qtype, port * int(cid))
+                    respo = timed_querier(qname, qtype, impl, addresses[impl], metrics)
+                elif metrics and impl in not_ready:
+                    not_ready.discard(impl)
+                    metrics.observe_ready(impl, time.time() - prepare_start)
                 responses.append((impl, respo))
         # If there is only one implementation tested, use expected response/s
         if len(responses) == 1:
@@ -402,10 +576,24 @@ def run_test(zoneid: str,
             difference["Query Name"] = qname
             difference["Query Type"] = qtype
             difference["Groups"] = groups_to_json(groups)
+            if suppressions and \
+                    suppressions.suppressed(difference, query.get("ZenResponseTag", '-')):
+                continue
             differences.append(difference)
     if differences:
+        model_cases = {query["Query"]["Name"] + ":" + query["Query"]["Type"]:
+                       query["ZenResponseTag"] for query in queries if "ZenResponseTag" in query}
+        if database:
+            database.add(zoneid, differences, model_cases)
+            return
+        if stream:
+            stream.write(zoneid, differences, model_cases)
+            return
         with open(parent_directory_path / DIFFERENCES / (zoneid + '.json'), 'w') as difference_fp:
             json.dump(differences, difference_fp, indent=2)
+        if triage:
+            triage.record(parent_directory_path / DIFFERENCES / (zoneid + '.json'),
+                          differences, model_cases)
 
 
 def run_tests(parent_directory_path: pathlib.Path,
@@ -430,14 +618,31 @@ def run_tests(parent_directory_path: pathlib.Path,
     tag = ':oct'
     if input_args.latest:
         tag = ':latest'
-    start_containers(input_args.id, implementations, tag)
+    manifest = load_manifest(parent_directory_path / ZONE_FILES)
+    network = input_args.network if "network" in input_args else None
+    start_containers(input_args.id, implementations, tag, network)
+    addresses = get_addresses(input_args.id, implementations, network)
+    triage = FingerprintState(parent_directory_path) if input_args.triage else None
+    database = DifferencesDB(parent_directory_path) if input_args.db else None
+    stream = DifferencesWriter(stream_path(parent_directory_path, input_args.id)) \
+        if input_args.stream else None
+    suppressions = SuppressionList(pathlib.Path(input_args.suppress)) \
+        if "suppress" in input_args else None
+    expand = input_args.expand if "expand" in input_args else None
+    metrics = None  # type: Optional[RunMetrics]
+    if "metrics" in input_args:
+        metrics = RunMetrics(parent_directory_path / (str(input_args.id) + '_metrics'),
+                             str(input_args.id), input_args.metrics)
+        metrics.start_writing()
     # Create and dump logs to a file
     with open(parent_directory_path / (str(input_args.id) + '_log.txt'), 'w', 1) as log_fp:
-        for zone in sorted((parent_directory_path / ZONE_FILES).iterdir(),
-                           key=lambda x: int(x.stem))[start:end]:
-            log_fp.write(f'{datetime.now()}\tChecking zone: {zone.stem}\n')
-            run_test(zone.stem, parent_directory_path, errors,
-                     input_args.id, implementations, log_fp, tag)
+        for zoneid in sorted(manifest.zone_ids(), key=int)[start:end]:
+            log_fp.write(f'{datetime.now()}\tChecking zone: {zoneid}\n')
+            run_test(zoneid, parent_directory_path, errors,
+                     input_args.id, implementations, log_fp, tag, manifest, addresses, network,
+                     triage, database, stream, suppressions, expand, metrics)
+            if metrics:
+                metrics.zone_done()
             i += 1
             if i % 25 == 0:
                 log_fp.write(
@@ -447,8 +652,19 @@ def run_tests(parent_directory_path: pathlib.Path,
         log_fp.write(
             f'{datetime.now()}\tTotal time for checking from {start}-{end if end else i}: '
             f'{time.time()-timer}s\n')
+        if metrics:
+            metrics.close()
         log_fp.write("Errors:\n")
         log_fp.write(str(errors))
+        if suppressions:
+            log_fp.write("\nSuppressed:\n")
+            log_fp.write(suppressions.summary())
+        if triage:
+            triage.flush(refresh=True)
+        if database:
+            database.close()
+        if stream:
+            stream.close()
         remove_container(input_args.id)
 
 
@@ -477,17 +693,34 @@ if __name__ == '__main__':
     parser.add_argument('-r', nargs=2, type=check_non_negative, metavar=('START', 'END'),
                         default=SUPPRESS,
                         help='The range of tests to compare. (default: All tests)')
-    parser.add_argument('-b', help='Disable Bind.', action="store_true")
-    parser.add_argument('-n', help='Disable Nsd.', action="store_true")
-    parser.add_argument('-k', help='Disable Knot.', action="store_true")
-    parser.add_argument('-p', help='Disable PowerDns.', action="store_true")
-    parser.add_argument('-c', help='Disable CoreDns.', action="store_true")
-    parser.add_argument('-y', help='Disable Yadifa.', action="store_true")
-    parser.add_argument('-m', help='Disable MaraDns.', action="store_true")
-    parser.add_argument('-t', help='Disable TrustDns.', action="store_true")
-    parser.add_argument('-e', help='Disable Technitium.', action="store_true")
+    add_disable_arguments(parser)
     parser.add_argument(
         '-l', '--latest', help='Test using latest image tag.', action="store_true")
+    parser.add_argument('-network', metavar='NETWORK_NAME', default=SUPPRESS,
+                        help='Attach the containers to this Docker bridge network (created if '
+                        'missing) and query their IPs directly instead of the published host '
+                        'ports (Linux hosts only). (default: Use published host ports)')
+    sink = parser.add_mutually_exclusive_group()
+    sink.add_argument('-triage', action="store_true",
+                      help='Update the fingerprints (Fingerprints.json) incrementally while '
+                      'testing.')
+    sink.add_argument('-db', action="store_true",
+                      help='Write the differences to the differences database '
+                      '(Differences.sqlite3) instead of the Differences directory.')
+    sink.add_argument('-stream', action="store_true",
+                      help='Write the differences to a compact Differences stream file '
+                      '(Differences_<id>.bin) instead of the Differences directory.')
+    parser.add_argument('-suppress', metavar='SUPPRESSIONS_PATH', default=SUPPRESS,
+                        help='The suppression file with the known differences, which are only '
+                        'counted (in the log file) and not written. (default: None)')
+    parser.add_argument('-expand', metavar='MAX_QUERIES', type=int, default=SUPPRESS,
+                        help='Also send up to MAX_QUERIES queries derived from the contents of '
+                        'each zone file (owner names, near-miss names, wildcard-covered names '
+                        'and names below delegations, DNAMEs and CNAMEs) while it is loaded. '
+                        '(default: Only the Zen queries)')
+    parser.add_argument('-metrics', metavar='SECONDS', type=float, default=SUPPRESS,
+                        help='Write the run metrics every SECONDS seconds to <id>_metrics.prom '
+                        'and <id>_metrics.jsonl. (default: No run metrics)')
 
     args = parser.parse_args()
     if "path" in args:
@@ -497,9 +730,7 @@ if __name__ == '__main__':
     if not (dir_path / ZONE_FILES).exists():
         sys.exit(
             f'The directory {dir_path} does not have ZoneFiles directory')
-    checked_implementations = (not args.b) + (not args.n) + (not args.k) + \
-        (not args.p) + (not args.c) + (not args.y) + \
-        (not args.m) + (not args.t) + (not args.e)
+    checked_implementations = sum(check for check, _ in get_ports(args).values())
     if checked_implementations == 0:
         sys.exit('Enable at least one implementation')
     if checked_implementations < 2:
@@ -516,5 +747,6 @@ if __name__ == '__main__':
     else:
         START = 0
         END = None
-    (dir_path / DIFFERENCES).mkdir(parents=True, exist_ok=True)
+    if not (args.db or args.stream):
+        (dir_path / DIFFERENCES).mkdir(parents=True, exist_ok=True)
     run_tests(dir_path, START, END, args)
@@ -1,9 +1,14 @@
 """
 Translates valid zone files and queries with Zen generated integer labels to English labels.
-Requires named-compilezone to properly format the translated zone files.
+The translated zone files are formatted (one record per line with absolute names and
+explicit TTL and class, in canonical order) using dnspython, in a pool of processes.
+The formatted zone files can optionally be validated with named-compilezone.
 https://linux.die.net/man/8/named-compilezone
+The ZenTests directory can be in either the one file per test or the shard format
+(see test_shards.py), and the translated tests can also be output as shards.
 
-usage: translate_tests.py [-h] [-c COMPILEZONE_PATH] DIRECTORY_PATH
+usage: python3 -m Scripts.translate_tests [-h] [-j JOBS] [-validate] [-c COMPILEZONE_PATH]
+                                         [-shards] DIRECTORY_PATH
 
 positional arguments:
   DIRECTORY_PATH       The path to the directory containing ZenTests
@@ -11,21 +16,39 @@ positional arguments:
 
 optional arguments:
   -h, --help           show this help message and exit
-  -c COMPILEZONE_PATH  The path to the named-compilezone executable.
-                        (default: system "named-compilzone" executable)
+  -j JOBS              The number of processes to translate the tests with.
+                       (default: Number of CPUs)
+  -validate            Also check the formatted zone files with named-compilezone.
+                       (default: False)
+  -c COMPILEZONE_PATH  The path to the named-compilezone executable used for
+                       validation. (default: system "named-compilzone" executable)
+  -shards              Output the ZoneFiles, Queries and TestsTotalInfo directories in the
+                       shard format. (default: False)
 """
 #!/usr/bin/env python3
 
 import argparse
 import json
+import os
 import pathlib
 import subprocess
+import tempfile
 import time
 from argparse import ArgumentParser, FileType
 from datetime import datetime
-from typing import Any, Dict, Generator, List, Set
+from functools import partial
+from itertools import islice
+from multiprocessing import Pool
+from typing import Any, Dict, Generator, List, Optional, Set, Tuple, Union
 
-from zone_translator import SUPPORTED_TYPES, get_domain_name, zone_translator
+import dns.exception
+import dns.name
+import dns.rdataclass
+import dns.rdatatype
+import dns.zonefile
+
+from Scripts.test_shards import ShardWriter, read_tests
+from Scripts.zone_translator import SUPPORTED_TYPES, get_domain_name, zone_translator
 
 ZEN_TESTS = "ZenTests/"
 ZONE_FILES = "ZoneFiles/"
@@ -89,22 +112,19 @@ def get_domain_name_dname(labels: List[Generator[str, None, None]],
 def query_response_relevant_translator(test_json: Dict[str, Any],
                                        zone: List[str],
                                        labels: List[Generator[str, None, None]],
-                                       label_translator: List[Dict[int, str]],
-                                       fileid: str,
-                                       output_path: pathlib.Path) -> None:
+                                       label_translator: List[Dict[int, str]]
+                                       ) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
     """
     Translates Zen query, relevant records and response with integers labels to English labels.
-    Generates a JSON in the TESTS_INFO directory with all the test information generated from Zen
-    Test generation module with English labels.
-    Generates a JSON in the QUERIES directory with the translated query for use in testing.
+    Returns the JSON for the TESTS_INFO directory with all the test information generated from
+    Zen Test generation module with English labels and the JSON for the QUERIES directory with
+    the translated query for use in testing.
 
     :param test_json: The Zen generated test in JSON format
     :param zone: The zone file as a list of resource records with English labels
     :param labels: List of label generators, one for each label index
     :param label_translator: List of maps for each label index from an
                                 integer label to an English label.
-    :param fileid: The unique test identifier
-    :param output_path: The output parent directory path
     """
     # Zen response tags:
     # https://github.com/dns-groot/Ferret/blob/main/TestGenerator/Authoritative/Response.cs#L12-L72
@@ -166,53 +186,90 @@ def query_response_relevant_translator(test_json: Dict[str, Any],
                 labels, label_translator, res_records["RData"]["Value"]) + '.'
         test_info["Relevant"].append(record)
 
-    with open(output_path / (TESTS_INFO + fileid + '.json'), 'w') as test_info_fp:
-        json.dump(test_info, test_info_fp, indent=2)
-    with open(output_path / (QUERIES + fileid + '.json'), 'w') as query_fp:
-        query_json = {}
-        query_json["Query"] = test_info["Query"]
-        query_json["ZenResponseTag"] = test_info["Response"]["Tag"]
-        query_list = [query_json]
-        json.dump(query_list, query_fp, indent=2)
+    query_json = {}
+    query_json["Query"] = test_info["Query"]
+    query_json["ZenResponseTag"] = test_info["Response"]["Tag"]
+    return test_info, [query_json]
+
+
+def format_zone(records: List[str], zone_name: str) -> Tuple[Optional[List[str]], str]:
+    """
+    Formats the translated zone file as named-compilezone does: one record per line with
+    the absolute owner name, TTL, class, type and RDATA, the SOA record first and the other
+    records in canonical order. Out-of-zone records are dropped.
+    Returns the formatted lines (None if the zone file has an error) and the output message.
+
+    :param records: The translated zone file as a list of resource records
+    :param zone_name: The origin of the zone
+    """
+    try:
+        origin = dns.name.from_text(zone_name)
+        rrsets = dns.zonefile.read_rrsets(''.join(records) + '\n', origin=origin,
+                                          relativize=False,
+                                          default_rdclass=dns.rdataclass.IN)
+    except (dns.exception.DNSException, ValueError) as error:
+        return None, f'zone {zone_name}/IN: loading from master file failed: {error}'
+    soa = [rrset for rrset in rrsets if rrset.rdtype == dns.rdatatype.SOA]
+    if not soa:
+        return None, f'zone {zone_name}/IN: has no SOA record'
+    lines = []
+    for rrset in sorted(rrsets, key=lambda rrset: (rrset.rdtype != dns.rdatatype.SOA,
+                                                   rrset.name, rrset.rdtype)):
+        lines.extend(f'{rrset.name}\t{rrset.ttl}\tIN\t{dns.rdatatype.to_text(rrset.rdtype)}'
+                     f'\t{rdata.to_text()}\n' for rdata in rrset)
+    return lines, f'zone {zone_name}/IN: loaded serial {soa[0][0].serial}'
 
 
-def test_translator(test_json: Dict[str, Any], compilezone: str, fileid: str,
-                    output_path: pathlib.Path, error_zone_ids: Set[str],
-                    compilezone_output: Dict[str, Any]) -> None:
+def test_translator(test: Tuple[str, Dict[str, Any]], compilezone: Optional[str],
+                    output_path: Optional[pathlib.Path]) -> Tuple[str, bool,
+                                                                  Union[None, str, List[str]],
+                                                                  Optional[Dict[str, Any]]]:
     """
     Translates Zen Tests to test with English labels
-    Uses zone_translator.py to translate the zone file
+    Uses zone_translator.py to translate the zone file and formats it with format_zone.
+    Returns the unique test identifier, whether translation failed, the output from
+    formatting (and validating) the zone file (helpful when there is an error in the
+    zone file), which is None if the zone file is empty, and the translated test (the zone
+    file, the queries and the test information) if it is not written to the output path.
 
-    :param test_json: The Zen generated test in JSON format
-    :param compilezone: The named-compilezone to use for formatting the translated zone files
-    :param fileid: The unique test identifier
-    :param output_path: The output parent directory path
-    :param error_zone_ids: The set of test ids for which translation failed
-    :param compilezone_output: The output from running named-compilezone on the test zone file
-                                (Helpful when there is an error in the zone file)
+    :param test: The unique test identifier and the Zen generated test in JSON format
+    :param compilezone: The named-compilezone to validate the formatted zone files with, if any
+    :param output_path: The output parent directory path to write the translated test to
+                        (None to return it instead)
     """
+    fileid, test_json = test
     records, labels, label_translator, zone_name = zone_translator(test_json)
-    if records:
-        with open(output_path / (ZONE_FILES + fileid + '.txt'), 'w') as zone_fp:
-            zone_fp.writelines(records)
-            zone_fp.write('\n')
-        query_response_relevant_translator(
-            test_json, records, labels, label_translator, fileid, output_path)
-        # Overwrite the translated zone file with the named-compilezone formatted zone file
-        cmd_output = subprocess.run([compilezone, '-i',
-                                     'local', '-k', 'ignore', '-o',
-                                     output_path /
-                                     (ZONE_FILES + fileid + '.txt'), zone_name,
-                                     output_path / (ZONE_FILES + fileid + '.txt')],
+    if not records:
+        print(f'{datetime.now()}\tRecords are empty for {fileid}')
+        return fileid, False, None, None
+    test_info, queries = query_response_relevant_translator(
+        test_json, records, labels, label_translator)
+    formatted, output = format_zone(records, zone_name)
+    error = formatted is None
+    # Keep the translated zone file for debugging if it has an error
+    zone = ''.join(records) + '\n' if formatted is None else ''.join(formatted)
+    if compilezone and not error:
+        zone_fd, zone_path = tempfile.mkstemp(suffix='.txt')
+        with os.fdopen(zone_fd, 'w') as zone_fp:
+            zone_fp.write(zone)
+        cmd_output = subprocess.run([compilezone, '-i', 'local', '-k', 'ignore',
+                                     '-o', os.devnull, zone_name, zone_path],
                                     stdout=subprocess.PIPE, check=False)
+        os.remove(zone_path)
         output = cmd_output.stdout.decode("utf-8")
-        if cmd_output.returncode != 0:
-            error_zone_ids.add(fileid)
-            compilezone_output[fileid] = output.split('\n')
-        else:
-            compilezone_output[fileid] = output
-    else:
-        print(f'{datetime.now()}\tRecords are empty for {fileid}')
+        error = cmd_output.returncode != 0
+    if error:
+        output = output.split('\n')
+    translated = {ZONE_FILES: zone, QUERIES: queries, TESTS_INFO: test_info}
+    if output_path is None:
+        return fileid, error, output, translated
+    with open(output_path / (ZONE_FILES + fileid + '.txt'), 'w') as zone_fp:
+        zone_fp.write(zone)
+    with open(output_path / (TESTS_INFO + fileid + '.json'), 'w') as test_info_fp:
+        json.dump(test_info, test_info_fp, indent=2)
+    with open(output_path / (QUERIES + fileid + '.json'), 'w') as query_fp:
+        json.dump(queries, query_fp, indent=2)
+    return fileid, error, output, None
 
 
 def main(args: argparse.Namespace) -> None:
@@ -222,36 +279,55 @@ def main(args: argparse.Namespace) -> None:
     :param args: The input arguments
     """
     directory_path = pathlib.Path(args.Path)
-    if args.c:
-        compilezone = args.c.name
-    else:
-        compilezone = "named-compilezone"
+    compilezone = None
+    if args.validate:
+        compilezone = args.c.name if args.c else "named-compilezone"
     if directory_path.exists():
         if (directory_path / ZEN_TESTS).exists() and (directory_path / ZEN_TESTS).is_dir():
             # (path / 'TranslatedZones/').mkdir(parents=True, exist_ok=True)
             (directory_path / ZONE_FILES).mkdir(parents=True, exist_ok=True)
             (directory_path / QUERIES).mkdir(parents=True, exist_ok=True)
             (directory_path / TESTS_INFO).mkdir(parents=True, exist_ok=True)
+            writers = {}  # type: Dict[str, ShardWriter]
+            if args.shards:
+                writers = {directory: ShardWriter(directory_path / directory, suffix)
+                           for directory, suffix in ((ZONE_FILES, '.txt'), (QUERIES, '.json'),
+                                                     (TESTS_INFO, '.json'))}
             i = 0
             start_timer = time.time()
             intermediate_timer = time.time()
             error_zones = set()  # type: Set[str]
             compilezone_output = {}  # type: Dict[str, Any]
-            for test in (directory_path / ZEN_TESTS).iterdir():
-                if test.is_file():
-                    with open(test, 'r') as test_fp:
-                        test_translator(json.load(test_fp), compilezone, test.stem,
-                                        directory_path, error_zones, compilezone_output)
-                i = i + 1
-                if i % 1000 == 0:
-                    print(f'{datetime.now()}\tTime for translation of {i-1000} - {i} tests: '
-                          f'{time.time()-intermediate_timer}s')
-                    intermediate_timer = time.time()
+            tests = read_tests(directory_path / ZEN_TESTS)
+            jobs = args.j if args.j else os.cpu_count() or 1
+            translator = partial(test_translator, compilezone=compilezone,
+                                 output_path=None if args.shards else directory_path)
+            with Pool(jobs) as pool:
+                # The tests are read in batches so that only a batch is held in memory
+                batch = list(islice(tests, jobs * 256))
+                while batch:
+                    for fileid, error, output, translated in pool.imap_unordered(
+                            translator, batch, chunksize=16):
+                        if error:
+                            error_zones.add(fileid)
+                        if output is not None:
+                            compilezone_output[fileid] = output
+                        if translated:
+                            for directory, data in translated.items():
+                                writers[directory].write(fileid, data)
+                        i = i + 1
+                        if i % 1000 == 0:
+                            print(f'{datetime.now()}\tTime for translation of {i-1000} - {i} '
+                                  f'tests: {time.time()-intermediate_timer}s')
+                            intermediate_timer = time.time()
+                    batch = list(islice(tests, jobs * 256))
+            for writer in writers.values():
+                writer.close()
             if error_zones:
                 print(
                     f'{datetime.now()}\tErrors encountered while translation for: {error_zones}')
             with open(directory_path / 'CompileZoneOutput.json', 'w') as compile_output_fp:
-                json.dump(compilezone_output, compile_output_fp, indent=2)
+                json.dump(dict(sorted(compilezone_output.items())), compile_output_fp, indent=2)
             print(
                 f'{datetime.now()}\tTotal time for translation of {i} tests: '
                 f'{time.time()-start_timer}s')
@@ -268,6 +344,14 @@ if __name__ == '__main__':
                     'integer labels to English labels.')
     parser.add_argument('Path', metavar='DIRECTORY_PATH',
                         help='The path to the directory containing ZenTests directory.')
+    parser.add_argument('-j', metavar='JOBS', type=int,
+                        help='The number of processes to translate the tests with. '
+                        '(default: Number of CPUs)')
+    parser.add_argument('-validate', action="store_true",
+                        help='Also check the formatted zone files with named-compilezone.')
     parser.add_argument('-c', metavar='COMPILEZONE_PATH', type=FileType('r'),
-                        help='The path to the named-compilezone executable.')
+                        help='The path to the named-compilezone executable used for validation.')
+    parser.add_argument('-shards', action="store_true",
+                        help='Output the ZoneFiles, Queries and TestsTotalInfo directories in the '
+                        'shard format.')
     main(parser.parse_args())
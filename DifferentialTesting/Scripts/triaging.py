@@ -4,147 +4,262 @@ files) as well as the unique implementations in each group from the responses.
 For invalid zone files, they are already separated into different directories based on the condition
 violated. Therefore, only the unique implementations in each group is used.
 
-usage: triaging.py [-h] [-path DIRECTORY_PATH]
+usage: triaging.py [-h] [-path DIRECTORY_PATH] [-j JOBS] [-i | -db | -stream] [-matrix]
+                   [-baseline BASELINE_PATH]
 
 optional arguments:
   -h, --help            show this help message and exit
   -path DIRECTORY_PATH  The path to the directory containing Differences directory.
                         Searches recursively (default: Results/)
+  -j JOBS               The number of processes to fingerprint the Differences files.
+                        (default: number of CPUs)
+  -i, --incremental     Only fingerprint the Differences files that changed since the last
+                        incremental triage (or that were fingerprinted while testing).
+                        (default: False)
+  -db                   Read the differences from the differences database
+                        (Differences.sqlite3) instead of the Differences directory.
+                        (default: False)
+  -stream               Read the differences from the Differences stream files
+                        (Differences_<id>.bin) instead of the Differences directory.
+                        (default: False)
+  -matrix               Group the tests with a vectorized fingerprint matrix and output the
+                        disagreement rate of each implementation and the pairwise agreement
+                        of the implementations to Statistics.json (requires NumPy).
+                        (default: False)
+  -baseline BASELINE_PATH
+                        Compare the fingerprints with a baseline run (its directory or
+                        FingerprintIndex.json file) and output the new, disappeared and
+                        changed fingerprints to FingerprintsDelta.json.
+                        (default: No comparison)
 """
 
 import json
+import os
 import pathlib
 import sys
+import tempfile
 from argparse import SUPPRESS, ArgumentDefaultsHelpFormatter, ArgumentParser
-from collections import defaultdict
-from typing import Any, Dict
+from multiprocessing import Pool
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
 
-from Scripts.test_with_valid_zone_files import (DIFFERENCES, QUERIES,
-                                                QUERY_RESPONSES)
+from Scripts.differences_db import DIFFERENCES_DB, DifferencesDB
+from Scripts.differences_stream import STREAM_PATTERN, read_stream_directory
+from Scripts.fingerprint_delta import FINGERPRINT_INDEX, fingerprint_delta
+from Scripts.fingerprints import (FINGERPRINTS, FingerprintSpill,
+                                  FingerprintState, fingerprint_differences,
+                                  write_fingerprints, write_spilled_fingerprints)
+from Scripts.model_cases import ModelCaseIndex
+from Scripts.test_with_valid_zone_files import DIFFERENCES
+
+
+def check_model_cases(dir_path: pathlib.Path, has_model_cases: Set[bool]) -> None:
+    """
+    Exits the program unless either all the zones with differences have model cases or
+    none of them have.
+
+    :param dir_path: The path to the directory containing the differences
+    :param has_model_cases: Whether the zones have model cases (True, False or both)
+    """
+    if len(has_model_cases) > 1:
+        sys.exit(f'Some of the tests have model cases and other don\'t in {dir_path}')
+
+
+def fingerprint_shard(shard: List[pathlib.Path],
+                      dir_path: pathlib.Path,
+                      spill_path: pathlib.Path) -> Set[bool]:
+    """
+    Fingerprints the tests in the input Differences files into the spill database at the
+    input path (the partial map from a fingerprint to the tests with that fingerprint).
+    The model cases are looked up a zone at a time in the model case index of the
+    directory. Returns whether the zones have model cases (True, False or both).
+
+    :param shard: The Differences files to fingerprint
+    :param dir_path: The path to the directory containing the Differences directory
+    :param spill_path: The path to the spill database of the shard
+    """
+    index = ModelCaseIndex(dir_path)
+    spill = FingerprintSpill(spill_path)
+    has_model_cases = set()  # type: Set[bool]
+    for diff in shard:
+        model_cases = index.get(diff.stem)
+        has_model_cases.add(bool(model_cases))
+        with open(diff, 'r') as diff_fp:
+            diff_json = json.load(diff_fp)
+        spill.add(diff.stem, fingerprint_differences(diff_json, model_cases))
+    spill.close()
+    index.close()
+    return has_model_cases
 
 
 def fingerprint_group_tests(dir_path: pathlib.Path,
-                            model_cases: Dict[str, Dict[str, str]]) -> None:
+                            jobs: int = 1,
+                            matrix: bool = False) -> None:
     """
     Fingerprints each test with the model case if available and the unique
     implementations in each group from the responses.
     Then groups the tests with the same fingerprint and outputs the groups as
     a JSON file.
+    The Differences files are split into shards that are fingerprinted in parallel
+    and the partial fingerprint maps (or fingerprint matrices) are merged.
+    Each shard looks up the model cases of its zones one at a time, and the partial maps
+    are spilled to disk and merged there, and the tests are streamed from the merged map
+    to the output, so that only the fingerprints and their counts are held in memory. The
+    fingerprint matrix has a row per test, so with it the memory use grows with the
+    number of tests.
 
     :param dir_path: The path to the directory containing the Differences directory
+    :param jobs: The number of processes to use
+    :param matrix: Whether to group the tests with the vectorized fingerprint matrix and
+                   output the implementations' statistics
     """
     # Either all the zone files that resulted in some difference have the model cases
-    # or none of them have it.
-    # If all of them are not True and there is a True in the list then print error
-    # and return: All of them are not true - there is at least one False and there
-    # is a True => some zones have model cases and some don't.
-    # The only acceptable scenarios are the list being all true and all false
+    # or none of them have it, which is checked when the shards are merged.
     difference_zones = list((dir_path / DIFFERENCES).iterdir())
-    has_model_cases = [zone.stem in model_cases for zone in difference_zones]
-    if not all(model_cases) and any(has_model_cases):
-        sys.exit(
-            f'Some of the tests have model cases and other don\'t in {dir_path}')
-    vectors = defaultdict(set)
-    for diff in difference_zones:
+    jobs = max(1, min(jobs, len(difference_zones)))
+    shards = [difference_zones[i::jobs] for i in range(jobs)]
+    shard_args = [(shard, dir_path) for shard in shards]
+    if matrix:
+        # NumPy is only required for the fingerprint matrix
+        from Scripts import fingerprint_matrix
+        if jobs == 1:
+            encoded = [fingerprint_matrix.encode_shard(*shard_args[0])] \
+                if difference_zones else []
+        else:
+            with Pool(jobs) as pool:
+                encoded = pool.starmap(fingerprint_matrix.encode_shard, shard_args)
+        check_model_cases(dir_path, set().union(*(has for _, has in encoded)))
+        merged = fingerprint_matrix.merge_matrices([partial for partial, _ in encoded])
+        write_fingerprints(dir_path, fingerprint_matrix.group_fingerprints(merged))
+        fingerprint_matrix.write_statistics(dir_path, merged)
+        return
+    with tempfile.TemporaryDirectory(dir=dir_path) as spill_dir:
+        spill_paths = [pathlib.Path(spill_dir) / f'shard_{index}.sqlite3'
+                       for index in range(jobs)]
+        if jobs == 1:
+            has_model_cases = [fingerprint_shard(*shard_args[0], spill_paths[0])]
+        else:
+            with Pool(jobs) as pool:
+                has_model_cases = pool.starmap(
+                    fingerprint_shard, [args + (spill_path,) for args, spill_path
+                                        in zip(shard_args, spill_paths)])
+        check_model_cases(dir_path, set().union(*has_model_cases))
+        spill = FingerprintSpill(spill_paths[0])
+        for spill_path in spill_paths[1:]:
+            spill.merge(spill_path)
+        write_spilled_fingerprints(dir_path, spill)
+        spill.close()
+
+
+def fingerprint_group_tests_incremental(dir_path: pathlib.Path) -> None:
+    """
+    Updates the persistent fingerprint state with the new, modified and removed
+    Differences files and refreshes the Fingerprints.json file if anything changed.
+    The model cases are looked up only for the Differences files fingerprinted again.
+
+    :param dir_path: The path to the directory containing the Differences directory
+    """
+    index = ModelCaseIndex(dir_path)
+    state = FingerprintState(dir_path, interval=float('inf'))
+    state.load()
+    present = set()
+    for diff in (dir_path / DIFFERENCES).iterdir():
+        present.add(diff.stem)
+        if state.is_current(diff):
+            continue
         with open(diff, 'r') as diff_fp:
-            diff_json = json.load(diff_fp)
-        for difference in diff_json:
-            query_str = difference["Query Name"] + \
-                ":" + difference["Query Type"]
-            zoneid = diff.stem
-            groups = difference["Groups"]
-            frozen_groups = []
-            for group in groups:
-                servers = set(group["Server/s"].strip().split())
-                if servers:
-                    frozen_groups.append(frozenset(servers))
-            if len(frozen_groups) > 1:
-                if zoneid in model_cases:
-                    test_model_case = model_cases[zoneid][query_str]
-                    vectors[(test_model_case, frozenset(frozen_groups))].add(
-                        (zoneid, query_str))
-                else:
-                    vectors[("-", frozenset(frozen_groups))
-                            ].add((zoneid, query_str))
-    summary = []
-    keys = sorted(vectors.keys())
-    output_json = defaultdict(list)
-    model_cases_present = set(k[0] for k in keys)
-    for model_case in model_cases_present:
-        for k in keys:
-            if k[0] != model_case:
-                continue
-            sorted_groups = sorted(k[1], key=len, reverse=True)
-            json_groups = []
-            groups_summary = ''
-            for grp in sorted_groups:
-                groups_summary += f' {{{",".join(grp)}}} '
-                json_groups.append(list(grp))
-            if model_case != '-':
-                summary.append(
-                    f'{model_case} {len(vectors[k])} {groups_summary}')
-                output_json[model_case].append({
-                    'Groups': json_groups,
-                    'Count': len(vectors[k]),
-                    'Tests': list(vectors[k])
-                })
-            else:
-                summary.append(
-                    f'{len(vectors[k])} {groups_summary}')
-                output_json["Fingerprints"].append({
-                    'Groups': json_groups,
-                    'Count': len(vectors[k]),
-                    'Tests': list(vectors[k])
-                })
-    output = {}# type: Dict[str, Any]
-    output["Summary"] = summary
-    output["Details"] = output_json
-    with open(dir_path / "Fingerprints.json", 'w') as cj_fp:
-        json.dump(output, cj_fp, indent=2)
-
-
-def get_model_cases(dir_path: pathlib.Path) -> Dict[str, Dict[str, str]]:
+            state.record(diff, json.load(diff_fp), index.get(diff.stem))
+    index.close()
+    for zoneid in set(state.zones) - present:
+        state.remove(zoneid)
+    state.flush(refresh=not (dir_path / FINGERPRINTS).exists())
+
+
+def fingerprint_group_zones(dir_path: pathlib.Path,
+                            zones: Iterable[Tuple[str, List[Dict[str, Any]], Dict[str, str]]],
+                            matrix: bool = False) -> None:
     """
-    Returns the Zen model case for each test if it exists.
+    Fingerprints and groups the tests of the input zones, using the model cases stored
+    along with the differences, and outputs the groups as a JSON file.
+    The zones are read one at a time and their tests are spilled to disk, unless the
+    fingerprint matrix is used, which needs all the zones in memory.
 
-    :param dir_path: The path to the directory containing the DIFFERENCES directory.
+    :param dir_path: The path to the directory to output the Fingerprints.json file in
+    :param zones: The zone id, the differences and the model cases of each zone, read
+                  from the differences database or the Differences stream files
+    :param matrix: Whether to group the tests with the vectorized fingerprint matrix and
+                   output the implementations' statistics
     """
-    model_cases = defaultdict(dict) # type: Dict[str, Dict[str, str]]
-    queries_dir = dir_path / QUERIES
-    expected_res_dir = dir_path / QUERY_RESPONSES
-    tag_dir = None
-    if queries_dir.exists() and queries_dir.is_dir():
-        tag_dir = queries_dir
-    elif expected_res_dir.exists() and expected_res_dir.is_dir():
-        tag_dir = expected_res_dir
-    if isinstance(tag_dir, pathlib.Path):
-        for queries_file in tag_dir.iterdir():
-            with open(queries_file, 'r') as qf_fp:
-                queries_info = json.load(qf_fp)
-                for qinfo in queries_info:
-                    if "ZenResponseTag" in qinfo:
-                        query_str = qinfo["Query"]["Name"] + ":" +\
-                            qinfo["Query"]["Type"]
-                        model_cases[queries_file.stem][query_str] = qinfo["ZenResponseTag"]
-    return model_cases
-
-
-def fingerprint_group_tests_helper(input_dir: pathlib.Path) -> None:
+    if matrix:
+        # NumPy is only required for the fingerprint matrix
+        from Scripts import fingerprint_matrix
+        zones_list = list(zones)
+        check_model_cases(dir_path, {bool(zone[2]) for zone in zones_list})
+        encoded = fingerprint_matrix.encode_differences(zones_list)
+        write_fingerprints(dir_path, fingerprint_matrix.group_fingerprints(encoded))
+        fingerprint_matrix.write_statistics(dir_path, encoded)
+        return
+    has_model_cases = set()  # type: Set[bool]
+    with tempfile.TemporaryDirectory(dir=dir_path) as spill_dir:
+        spill = FingerprintSpill(pathlib.Path(spill_dir) / 'spill.sqlite3')
+        for zoneid, differences, zone_model_cases in zones:
+            has_model_cases.add(bool(zone_model_cases))
+            if len(has_model_cases) > 1:
+                spill.close()
+                check_model_cases(dir_path, has_model_cases)
+            spill.add(zoneid, fingerprint_differences(differences, zone_model_cases))
+        write_spilled_fingerprints(dir_path, spill)
+        spill.close()
+
+
+def fingerprint_group_tests_helper(input_dir: pathlib.Path,
+                                   jobs: int = 1,
+                                   incremental: bool = False,
+                                   source: str = DIFFERENCES,
+                                   matrix: bool = False,
+                                   baseline: Optional[pathlib.Path] = None) -> None:
     """
+    Helper function to fingerprint and group the tests.
+    Iterates recursively over the input directory to find Differences directory
+    (or the differences database or the Differences stream files).
 
     :param input_dir: The input directory
+    :param jobs: The number of processes to use
+    :param incremental: Whether to only fingerprint the changed Differences files
+    :param source: Where to read the differences from: the Differences directory,
+                   the differences database or the Differences stream files
+    :param matrix: Whether to group the tests with the vectorized fingerprint matrix
+    :param baseline: The fingerprint index of the baseline run to compare with, or the
+                     baseline directory corresponding to the input directory
     """
     # Exit if the inputted path does not exist or is not a directory.
     if not (input_dir.exists() or input_dir.is_dir()):
         return
     differences_dir = input_dir / DIFFERENCES
-    if differences_dir.exists() and differences_dir.is_dir():
-        model_cases = get_model_cases(input_dir)
-        fingerprint_group_tests(input_dir, model_cases)
+    if source == DIFFERENCES_DB and (input_dir / DIFFERENCES_DB).exists():
+        database = DifferencesDB(input_dir)
+        fingerprint_group_zones(input_dir, database.zones(), matrix)
+        database.close()
+    elif source == STREAM_PATTERN and any(input_dir.glob(STREAM_PATTERN)):
+        fingerprint_group_zones(input_dir, read_stream_directory(input_dir), matrix)
+    elif source == DIFFERENCES and differences_dir.exists() and differences_dir.is_dir():
+        if incremental:
+            fingerprint_group_tests_incremental(input_dir)
+        else:
+            fingerprint_group_tests(input_dir, jobs, matrix)
     else:
         if input_dir.is_dir():
             for subdir in input_dir.iterdir():
-                fingerprint_group_tests_helper(subdir)
+                fingerprint_group_tests_helper(
+                    subdir, jobs, incremental, source, matrix,
+                    baseline / subdir.name if baseline and baseline.is_dir() else baseline)
+        return
+    if baseline and not (baseline.is_file() or (baseline / FINGERPRINT_INDEX).exists()):
+        print(f'No baseline fingerprint index for {input_dir} in {baseline}')
+        baseline = None
+    new, disappeared, changed = fingerprint_delta(input_dir, baseline)
+    if baseline:
+        print(f'{input_dir}: {new} new, {disappeared} disappeared and {changed} changed '
+              'fingerprints')
 
 
 if __name__ == '__main__':
@@ -158,9 +273,39 @@ if __name__ == '__main__':
     parser.add_argument('-path', metavar='DIRECTORY_PATH', default=SUPPRESS,
                         help='The path to the directory containing Differences directory.'
                         ' Searches recursively (default: Results/)')
+    parser.add_argument('-j', metavar='JOBS', type=int, default=os.cpu_count() or 1,
+                        help='The number of processes to fingerprint the Differences files.')
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('-i', '--incremental', action="store_true",
+                        help='Only fingerprint the Differences files that changed since the last '
+                        'incremental triage (or that were fingerprinted while testing).')
+    source.add_argument('-db', action="store_true",
+                        help='Read the differences from the differences database '
+                        '(Differences.sqlite3) instead of the Differences directory.')
+    source.add_argument('-stream', action="store_true",
+                        help='Read the differences from the Differences stream files '
+                        '(Differences_<id>.bin) instead of the Differences directory.')
+    parser.add_argument('-matrix', action="store_true",
+                        help='Group the tests with a vectorized fingerprint matrix and output the '
+                        'disagreement rate of each implementation and the pairwise agreement '
+                        'of the implementations to Statistics.json (requires NumPy).')
+    parser.add_argument('-baseline', metavar='BASELINE_PATH', default=SUPPRESS,
+                        help='Compare the fingerprints with a baseline run (its directory or '
+                        'FingerprintIndex.json file) and output the new, disappeared and changed '
+                        'fingerprints to FingerprintsDelta.json. (default: No comparison)')
     args = parser.parse_args()
+    if args.matrix and args.incremental:
+        parser.error('argument -matrix: not allowed with argument -i/--incremental')
     if "path" in args:
         directory_path = pathlib.Path(args.path)
     else:
         directory_path = pathlib.Path("Results/")
-    fingerprint_group_tests_helper(directory_path)
+    if args.db:
+        differences_source = DIFFERENCES_DB
+    elif args.stream:
+        differences_source = STREAM_PATTERN
+    else:
+        differences_source = DIFFERENCES
+    fingerprint_group_tests_helper(directory_path, max(1, args.j), args.incremental,
+                                   differences_source, args.matrix,
+                                   pathlib.Path(args.baseline) if "baseline" in args else None)
@@ -0,0 +1,177 @@
+"""
+Extracts the origin, the record types and the features of a Bind-style zone file
+without requiring the zone file to be valid, so that the implementations that
+can not serve a zone are skipped before loading it.
+"""
+
+#!/usr/bin/env python3
+
+import pathlib
+import re
+from collections import Counter
+from typing import Dict, Iterator, List, NamedTuple, Set, Tuple
+
+import dns.ttl
+
+from Implementations.registry import (MULTI_STRING_TXT, REGISTRY,
+                                      TXT_WITH_SPACES, WILDCARD)
+
+CLASSES = {'IN', 'CH', 'CS', 'HS', 'ANY'}
+# A quoted string (with escapes) or a run of non-space characters
+TOKEN = re.compile(r'"(?:[^"\\]|\\.)*"|[^\s"]+')
+
+
+class ZoneFeatures(NamedTuple):
+    """
+    origin: The owner name of the SOA record ('' if there is no SOA record)
+    record_types: Number of records of each record type
+    features: The zone features other than the record types
+    """
+    origin: str
+    record_types: Dict[str, int]
+    features: Set[str]
+
+    @property
+    def record_count(self) -> int:
+        """The total number of records in the zone."""
+        return sum(self.record_types.values())
+
+
+def _strip_comment(line: str) -> str:
+    """Removes a comment (starting with ';' outside a quoted string) from the line."""
+    in_quotes = False
+    escaped = False
+    for index, char in enumerate(line):
+        if escaped:
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char == '"':
+            in_quotes = not in_quotes
+        elif char == ';' and not in_quotes:
+            return line[:index]
+    return line
+
+
+def _entries(lines: Iterator[str]) -> Iterator[Tuple[bool, List[str]]]:
+    """
+    Yields a tuple for each entry of the zone file: whether the entry starts
+    with a whitespace (inherits the previous owner name) and its tokens.
+    Entries spanning multiple lines with parentheses are joined.
+    """
+    pending = []  # type: List[str]
+    inherits = False
+    depth = 0
+    for line in lines:
+        line = _strip_comment(line.rstrip('\r\n'))
+        if not pending:
+            inherits = line[:1] in (' ', '\t')
+        tokens = TOKEN.findall(line.replace('(', ' ( ').replace(')', ' ) '))
+        for token in tokens:
+            if token == '(':
+                depth += 1
+            elif token == ')':
+                depth = max(depth - 1, 0)
+            else:
+                pending.append(token)
+        if depth == 0 and pending:
+            yield inherits, pending
+            pending = []
+    if pending:
+        yield inherits, pending
+
+
+def _is_ttl(token: str) -> bool:
+    """Returns whether the token is a TTL, in seconds or with units (e.g., 1h or 1w2d)."""
+    try:
+        dns.ttl.from_text(token)
+    except dns.ttl.BadTTL:
+        return False
+    return True
+
+
+def _records(lines: Iterator[str]) -> Iterator[Tuple[str, str, List[str]]]:
+    """
+    Yields the owner name (as written), the record type and the rdata tokens of each
+    record of the zone file.
+    """
+    owner = ''
+    for inherits, tokens in _entries(lines):
+        if tokens[0].startswith('$'):
+            continue
+        if not inherits:
+            owner, tokens = tokens[0], tokens[1:]
+        # Skip the optional TTL and class in either order
+        while tokens and (_is_ttl(tokens[0]) or tokens[0].upper() in CLASSES):
+            tokens = tokens[1:]
+        if not tokens:
+            continue
+        yield owner, tokens[0].upper(), tokens[1:]
+
+
+def get_zone_features(zone_path: pathlib.Path) -> ZoneFeatures:
+    """
+    Returns the origin, the histogram of record types and the features of the zone file.
+
+    :param zone_path: The path to the zone file
+    """
+    origin = ''
+    record_types = Counter()  # type: Counter
+    features = set()  # type: Set[str]
+    with open(zone_path, 'r') as zone_fp:
+        for owner, rtype, rdata in _records(zone_fp):
+            record_types[rtype] += 1
+            if rtype == 'SOA' and not origin:
+                origin = owner
+            if owner.startswith('*'):
+                features.add(WILDCARD)
+            if rtype == 'TXT':
+                if len(rdata) > 1:
+                    features.add(MULTI_STRING_TXT)
+                if any(' ' in text or '\t' in text for text in rdata):
+                    features.add(TXT_WITH_SPACES)
+    return ZoneFeatures(origin, dict(record_types), features)
+
+
+def get_owner_types(zone_path: pathlib.Path, origin: str) -> Dict[str, Set[str]]:
+    """
+    Returns a map from each owner name of the zone file (absolute and in lower case) to
+    its record types. Relative owner names are taken relative to the input origin.
+
+    :param zone_path: The path to the zone file
+    :param origin: The zone origin
+    """
+    origin = origin.lower()
+    owner_types = {}  # type: Dict[str, Set[str]]
+    with open(zone_path, 'r') as zone_fp:
+        for owner, rtype, _ in _records(zone_fp):
+            owner = owner.lower()
+            if owner == '@':
+                owner = origin
+            elif not owner.endswith('.'):
+                owner = owner + '.' + origin if origin != '.' else owner + '.'
+            owner_types.setdefault(owner, set()).add(rtype)
+    return owner_types
+
+
+def filter_implementations(implementations: Dict[str, Tuple[bool, int]],
+                           zone_features: ZoneFeatures) -> Tuple[Dict[str, Tuple[bool, int]],
+                                                                 List[str]]:
+    """
+    Returns a copy of the implementations map in which the implementations that can
+    not serve the zone are disabled, along with the names of those implementations.
+
+    :param implementations: Map from an implementation to a tuple of two items
+                            - 1. whether to check that implementation 2. which host port
+                            should be mapped to the container port 53
+    :param zone_features: The features of the zone
+    """
+    filtered = {}
+    skipped = []
+    for impl, (check, port) in implementations.items():
+        if check and not REGISTRY[impl].can_serve(zone_features.record_types,
+                                                  zone_features.features):
+            skipped.append(impl)
+            check = False
+        filtered[impl] = (check, port)
+    return filtered, skipped
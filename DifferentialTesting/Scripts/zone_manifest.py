@@ -0,0 +1,173 @@
+"""
+Builds and updates a manifest (index) of the zone files in a ZoneFiles directory.
+Each zone file is parsed once and its origin, record type histogram, record count,
+content hash and features are stored in ZoneManifest.json, a sibling of the ZoneFiles
+directory. The manifest is updated incrementally: only the zone files that were added
+or modified (by size or modification time) since the last update are parsed again.
+
+usage: python3 -m Scripts.zone_manifest [-h] [-path DIRECTORY_PATH]
+
+optional arguments:
+  -h, --help            show this help message and exit
+  -path DIRECTORY_PATH  The path to the directory containing ZoneFiles directory.
+                        Searches recursively (default: Results/)
+"""
+
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import os
+import pathlib
+from argparse import SUPPRESS, ArgumentDefaultsHelpFormatter, ArgumentParser
+from typing import Any, Dict, List
+
+from Implementations.registry import WILDCARD
+from Scripts.zone_features import ZoneFeatures, get_zone_features
+
+MANIFEST = "ZoneManifest.json"
+
+
+def zone_hash(zone_path: pathlib.Path) -> str:
+    """Returns the SHA-256 hash of the zone file contents."""
+    with open(zone_path, 'rb') as zone_fp:
+        return hashlib.sha256(zone_fp.read()).hexdigest()
+
+
+class ZoneManifest:
+    """
+    The manifest of the zone files in a ZoneFiles directory.
+    Entries are keyed by the zone id (the zone file name without the suffix).
+    """
+
+    def __init__(self, zone_files_dir: pathlib.Path) -> None:
+        """
+        Loads the existing manifest of the zone files directory, if any.
+
+        :param zone_files_dir: The path to the ZoneFiles directory
+        """
+        self.zone_files_dir = zone_files_dir
+        self.path = zone_files_dir.parent / MANIFEST
+        self.entries = {}  # type: Dict[str, Dict[str, Any]]
+        self.modified = False
+        if self.path.exists():
+            try:
+                with open(self.path, 'r') as manifest_fp:
+                    self.entries = json.load(manifest_fp)
+            except ValueError:
+                # A corrupt manifest is rebuilt from the zone files
+                self.entries = {}
+
+    def _refresh(self, zone_path: pathlib.Path) -> Dict[str, Any]:
+        """Returns the entry of the zone file after parsing it again if it changed."""
+        stat = zone_path.stat()
+        entry = self.entries.get(zone_path.stem)
+        if entry and entry["Size"] == stat.st_size and entry["MTime"] == stat.st_mtime_ns:
+            return entry
+        features = get_zone_features(zone_path)
+        entry = {
+            "Origin": features.origin,
+            "RecordTypes": features.record_types,
+            "RecordCount": features.record_count,
+            "Hash": zone_hash(zone_path),
+            "HasDname": 'DNAME' in features.record_types,
+            "HasWildcard": WILDCARD in features.features,
+            "Features": sorted(features.features),
+            "Size": stat.st_size,
+            "MTime": stat.st_mtime_ns,
+        }
+        self.entries[zone_path.stem] = entry
+        self.modified = True
+        return entry
+
+    def update(self) -> None:
+        """Adds new and modified zone files to the manifest and removes deleted ones."""
+        present = set()
+        for zone_path in self.zone_files_dir.iterdir():
+            if zone_path.is_file():
+                present.add(zone_path.stem)
+                self._refresh(zone_path)
+        for zoneid in set(self.entries) - present:
+            del self.entries[zoneid]
+            self.modified = True
+
+    def save(self) -> None:
+        """Writes the manifest (atomically) if it was modified."""
+        if not self.modified:
+            return
+        tmp_path = self.path.with_name(f'{MANIFEST}.{os.getpid()}.tmp')
+        with open(tmp_path, 'w') as manifest_fp:
+            json.dump(self.entries, manifest_fp, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+        self.modified = False
+
+    def zone_ids(self) -> List[str]:
+        """Returns the ids of the zone files in the manifest."""
+        return list(self.entries)
+
+    def entry(self, zoneid: str) -> Dict[str, Any]:
+        """
+        Returns the manifest entry of the zone file, parsing it if it is new or modified.
+
+        :param zoneid: The unique zone identifier
+        """
+        zone_path = self.zone_files_dir / (zoneid + '.txt')
+        if not zone_path.exists() and zoneid in self.entries:
+            return self.entries[zoneid]
+        return self._refresh(zone_path)
+
+    def features(self, zoneid: str) -> ZoneFeatures:
+        """
+        Returns the features of the zone file from the manifest.
+
+        :param zoneid: The unique zone identifier
+        """
+        entry = self.entry(zoneid)
+        return ZoneFeatures(entry["Origin"], entry["RecordTypes"], set(entry["Features"]))
+
+
+def load_manifest(zone_files_dir: pathlib.Path) -> ZoneManifest:
+    """
+    Returns the up-to-date manifest of the zone files directory and saves it.
+
+    :param zone_files_dir: The path to the ZoneFiles directory
+    """
+    manifest = ZoneManifest(zone_files_dir)
+    manifest.update()
+    manifest.save()
+    return manifest
+
+
+def build_manifest_helper(input_dir: pathlib.Path) -> None:
+    """
+    Helper function to build or update the manifests.
+    Iterates recursively over the input directory to find ZoneFiles directories.
+
+    :param input_dir: The path to the parent directory with ZoneFiles directory.
+    """
+    # Exit if the inputted path does not exist or is not a directory.
+    if not (input_dir.exists() or input_dir.is_dir()):
+        return
+    zone_files_dir = input_dir / 'ZoneFiles'
+    if zone_files_dir.exists() and zone_files_dir.is_dir():
+        manifest = load_manifest(zone_files_dir)
+        print(f'{manifest.path}: {len(manifest.entries)} zone files')
+    else:
+        if input_dir.is_dir():
+            for subdir in input_dir.iterdir():
+                build_manifest_helper(subdir)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter,
+                            description='Builds or updates the manifest of zone files in each '
+                            'ZoneFiles directory.')
+    parser.add_argument('-path', metavar='DIRECTORY_PATH', default=SUPPRESS,
+                        help='The path to the directory containing ZoneFiles directory.'
+                        ' Searches recursively (default: Results/)')
+    args = parser.parse_args()
+    if "path" in args:
+        directory_path = pathlib.Path(args.path)
+    else:
+        directory_path = pathlib.Path("Results/")
+    build_manifest_helper(directory_path)
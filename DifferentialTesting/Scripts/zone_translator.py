@@ -1,7 +1,9 @@
 """
 Translates zone files with Zen generated integer labels to English labels.
+The ZenZoneFiles directories can be in either the one file per zone or the shard format
+(see test_shards.py).
 
-usage: zone_translator.py [-h] DIRECTORY_PATH
+usage: python3 -m Scripts.zone_translator [-h] DIRECTORY_PATH
 
 positional arguments:
   DIRECTORY_PATH  The path to the directory containing (searches recursively)
@@ -9,12 +11,13 @@ positional arguments:
 """
 #!/usr/bin/env python3
 
-import json
 import pathlib
 import random
 from argparse import ArgumentParser
 from typing import Any, Dict, Generator, List, Tuple
 
+from Scripts.test_shards import read_tests
+
 # Same order as in
 # https://github.com/dns-groot/Ferret/blob/main/TestGenerator/Authoritative/ResourceRecord.cs#L12-L52
 SUPPORTED_TYPES = ['SOA', 'NS', 'A', 'CNAME', 'DNAME', 'AAAA', 'TXT', 'N']
@@ -202,18 +205,14 @@ def zone_translator_helper(input_dir: pathlib.Path) -> None:
     output_zone_file_dir = input_dir / 'ZoneFiles/'
     if input_zone_files_dir.exists() and input_zone_files_dir.is_dir():
         output_zone_file_dir.mkdir(parents=True, exist_ok=True)
-        for zone_path in input_zone_files_dir.iterdir():
-            if not zone_path.is_file():
-                continue
-            with open(zone_path, 'r') as zone_fp:
-                translated_records, _, _, _ = zone_translator(
-                    json.load(zone_fp))
-                if translated_records:
-                    with open(output_zone_file_dir / (zone_path.stem + '.txt'), 'w') as write_fp:
-                        write_fp.writelines(translated_records)
-                        write_fp.write('\n')
-                else:
-                    print(f'Records are empty for {zone_path}')
+        for zoneid, zone_json in read_tests(input_zone_files_dir):
+            translated_records, _, _, _ = zone_translator(zone_json)
+            if translated_records:
+                with open(output_zone_file_dir / (zoneid + '.txt'), 'w') as write_fp:
+                    write_fp.writelines(translated_records)
+                    write_fp.write('\n')
+            else:
+                print(f'Records are empty for {input_zone_files_dir / zoneid}')
     else:
         if input_dir.is_dir():
             for subdir in input_dir.iterdir():